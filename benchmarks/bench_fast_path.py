@@ -0,0 +1,59 @@
+"""Per-step orchestration overhead of a stub-model Chain, interpreted versus compiled.
+
+    python benchmarks/bench_fast_path.py --steps 50 --repeats 200
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from base import Chain, Concept, ConceptRegistry, LanguageModel, ProbabilisticComponent, Prompt  # noqa: E402
+
+
+def build_chain(steps: int) -> Chain:
+    return Chain([ProbabilisticComponent(LanguageModel(f'model{i}'), Prompt(f'step {i}: {{c{i}}}', Concept(f'c{i + 1}')))
+                  for i in range(steps)])
+
+
+def per_step_us(run, steps: int, repeats: int) -> float:
+    run()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        run()
+    return (time.perf_counter() - start) / repeats / steps * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--repeats', type=int, default=200)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter('ignore')
+
+    chain = build_chain(args.steps)
+    plan = chain.compile(['c0'])
+
+    def initial():
+        return ConceptRegistry([Concept(name='c0', string_content='input')])
+
+    model = LanguageModel('model')
+    results = {
+        'Chain.run': per_step_us(lambda: chain.run(initial()), args.steps, args.repeats),
+        'CompiledPipeline.run': per_step_us(lambda: plan.run(initial()), args.steps, args.repeats),
+        'LanguageModel.generate_response': per_step_us(
+            lambda: [model.generate_response('prompt') for _ in range(args.steps)], args.steps, args.repeats),
+        'LanguageModel._respond': per_step_us(
+            lambda: [model._respond('prompt') for _ in range(args.steps)], args.steps, args.repeats),
+    }
+    for name, value in results.items():
+        print(f'{name:<34}{value:>10.2f} us/step')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Throughput of pipeline runs through the SQLite job queue with 1..N worker processes, against one process.
+
+    python benchmarks/bench_jobs.py --jobs 500 --processes 1 2 4 --steps 20
+
+The pipeline is a Chain of zero-latency simulated models, so every run is CPU bound on prompt assembly and
+orchestration, the case where more processes help. Queue figures include submitting, claiming, writing the
+results back and collecting them.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from base import Chain, Concept, ProbabilisticComponent, Prompt, run_batch  # noqa: E402
+from base.jobs import DistributedExecutor, SQLiteJobQueue, start_workers  # noqa: E402
+from base.simulated import SimulatedModel  # noqa: E402
+
+
+def build_pipeline(steps: int, response_size: int) -> Chain:
+    return Chain([ProbabilisticComponent(SimulatedModel(f'm{i}', mean_latency=0.0, response_size=response_size),
+                                         Prompt(f'step {i}: {{c{i}}}', Concept(f'c{i + 1}')))
+                  for i in range(steps)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=500)
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--response-size', type=int, default=256)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter('ignore')
+
+    pipeline = build_pipeline(args.steps, args.response_size)
+    rows = [{'c0': f'input {i}'} for i in range(args.jobs)]
+
+    start = time.perf_counter()
+    for _ in run_batch(pipeline, rows, chunk_size=1):
+        pass
+    print(f'{"one process":<24}{args.jobs / (time.perf_counter() - start):>10.1f} runs/s')
+
+    with tempfile.TemporaryDirectory() as directory:
+        for processes in args.processes:
+            queue = SQLiteJobQueue(os.path.join(directory, f'jobs{processes}.db'))
+            executor = DistributedExecutor(queue, poll_interval=0.01)
+            workers = start_workers(queue, processes, idle_timeout=0.5, poll_interval=0.01,
+                                    cache_dir=os.path.join(directory, 'cache'))
+            start = time.perf_counter()
+            run_id = executor.submit(pipeline, rows)
+            executor.results(run_id)
+            elapsed = time.perf_counter() - start
+            for process in workers:
+                process.join()
+            print(f'{f"{processes} worker processes":<24}{args.jobs / elapsed:>10.1f} runs/s')
+    print(f'{os.cpu_count()} CPUs')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Import time, and construction versus load time of a pipeline with several hundred components.
+
+    python benchmarks/bench_load.py --components 300 --repeats 5
+
+The pipeline is a Chain of Threads of short Chains with shared models. Cold loads parse and validate the
+serialized file, warm loads read the pickle load_pipeline keeps in --cache-dir. The process figures run a fresh
+interpreter per repeat, so they include the interpreter start and `import base`.
+"""
+import argparse
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path.insert(0, SRC)
+
+from base import (Chain, Concept, LanguageModel, ProbabilisticComponent, Prompt, Threads,  # noqa: E402
+                  load_pipeline, save_pipeline)
+
+
+def build_pipeline(components: int, models: int = 8) -> Chain:
+    shared = [LanguageModel(f'model{i}') for i in range(models)]
+    stages, count, previous = [], 0, 'c0'
+    while count < components:
+        branches = []
+        for branch in range(4):
+            steps = []
+            for step in range(3):
+                name = f's{count}'
+                steps.append(ProbabilisticComponent(shared[count % models],
+                                                    Prompt(f'step {count}: {{{previous}}}', Concept(name))))
+                count += 1
+            branches.append(Chain(steps))
+        stages.append(Threads(branches, max_workers=4))
+        previous = name
+    return Chain(stages)
+
+
+def median_ms(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def process_ms(code: str, repeats: int) -> float:
+    env = {**os.environ, 'PYTHONPATH': SRC}
+    return median_ms(lambda: subprocess.run([sys.executable, '-c', code], env=env, check=True), repeats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--components', type=int, default=300)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter('ignore')
+
+    pipeline = build_pipeline(args.components)
+    size = sum(len(branch.components) for stage in pipeline.components for branch in stage.components)
+    with tempfile.TemporaryDirectory() as directory:
+        json_path, yaml_path = os.path.join(directory, 'p.json'), os.path.join(directory, 'p.yaml')
+        save_pipeline(pipeline, json_path)
+        save_pipeline(pipeline, yaml_path)
+        cache_dir = os.path.join(directory, 'cache')
+        load_pipeline(json_path, cache_dir=cache_dir)
+        load_pipeline(json_path, cache_dir=cache_dir, compiled=True)
+
+        load = f'from base import load_pipeline; load_pipeline({json_path!r}, cache_dir={cache_dir!r})'
+        results = {
+            'python -c pass': process_ms('pass', args.repeats),
+            'python -c "import base"': process_ms('import base', args.repeats),
+            'process: import + warm load': process_ms(load, args.repeats),
+            'construct in Python': median_ms(lambda: build_pipeline(args.components), args.repeats),
+            'save JSON': median_ms(lambda: save_pipeline(pipeline, json_path), args.repeats),
+            'cold load JSON': median_ms(lambda: load_pipeline(json_path), args.repeats),
+            'cold load YAML': median_ms(lambda: load_pipeline(yaml_path), args.repeats),
+            'warm load': median_ms(lambda: load_pipeline(json_path, cache_dir=cache_dir), args.repeats),
+            'warm load, compiled': median_ms(lambda: load_pipeline(json_path, cache_dir=cache_dir, compiled=True),
+                                             args.repeats),
+        }
+    print(f'{size} components, median of {args.repeats}')
+    for name, value in results.items():
+        print(f'{name:<34}{value:>10.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Load test of the pipeline server with simulated models, with and without micro-batching.
+
+    python benchmarks/bench_server.py --requests 2000 --concurrency 200 --max-batch-size 32
+
+Requests go over real HTTP connections on localhost. The simulated model charges its latency once per batch, the
+way a provider's batched endpoint does, so the gain from batching shows up as throughput.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from base import Chain, Concept, ProbabilisticComponent, Prompt  # noqa: E402
+from base.server import PipelineServer  # noqa: E402
+from base.simulated import SimulatedModel  # noqa: E402
+
+
+class BatchedSimulatedModel(SimulatedModel):
+    def _generate_batch(self, prompt_strings):
+        time.sleep(self.mean_latency)
+        return [self._response(prompt_string) for prompt_string in prompt_strings]
+
+
+def build_pipeline(latency: float) -> Chain:
+    def step(name, template, output):
+        model = BatchedSimulatedModel(name, mean_latency=latency)
+        return ProbabilisticComponent(model, Prompt(template, Concept(output)))
+    return Chain([step('outline', 'Outline a talk about {subject}', 'outline'),
+                  step('draft', 'Write the talk from {outline}', 'draft')])
+
+
+async def request(port: int, body: bytes, latencies, statuses):
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'POST /pipelines/talk HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n'
+                 f'Connection: close\r\n\r\n'.encode() + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    await reader.read()
+    writer.close()
+    latencies.append(time.perf_counter() - started)
+    statuses[status] = statuses.get(status, 0) + 1
+
+
+async def load(options, max_batch_size: int) -> dict:
+    server = PipelineServer({'talk': build_pipeline(options.latency)}, port=0, max_batch_size=max_batch_size,
+                            max_wait=options.max_wait, max_pending=options.max_pending)
+    await server.start()
+    semaphore = asyncio.Semaphore(options.concurrency)
+    latencies, statuses = [], {}
+
+    async def one(index):
+        body = json.dumps({'concepts': {'subject': f'subject {index}'}}).encode()
+        async with semaphore:
+            await request(server.port, body, latencies, statuses)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(index) for index in range(options.requests)])
+    elapsed = time.perf_counter() - started
+    stats = server.stats()
+    await server.stop()
+    latencies.sort()
+    return {'max_batch_size': max_batch_size, 'throughput_rps': options.requests / elapsed,
+            'p50_ms': latencies[len(latencies) // 2] * 1e3, 'p99_ms': latencies[int(len(latencies) * 0.99)] * 1e3,
+            'mean_ms': statistics.fmean(latencies) * 1e3, 'statuses': statuses,
+            'mean_batch_size': stats['batching']['mean_batch_size']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated seconds per model call or batch')
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait', type=float, default=0.005)
+    parser.add_argument('--max-pending', type=int, default=256)
+    options = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter('ignore')
+    for max_batch_size in (1, options.max_batch_size):
+        print(json.dumps(asyncio.run(load(options, max_batch_size))))
+
+
+if __name__ == '__main__':
+    main()
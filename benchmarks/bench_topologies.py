@@ -0,0 +1,190 @@
+"""Throughput, latency percentiles, per-step overhead and peak memory of representative pipeline topologies.
+
+    python benchmarks/bench_topologies.py --runs 50 --latency 0.005 --output results.json
+    python benchmarks/bench_topologies.py --runs 50 --latency 0.005 --baseline results.json
+
+Every model is a seeded SimulatedModel, so two runs with the same arguments do the same work. Per-step overhead
+is measured separately with zero-latency models and is the wall time per component that is not model time.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+from base import (Chain, Concept, ConceptRegistry, GraphExecutor, MapReduce, ProbabilisticComponent,  # noqa: E402
+                  Prompt, Threads)
+from base.simulated import SimulatedModel  # noqa: E402
+
+
+def component(name: str, inputs, output: str, options) -> ProbabilisticComponent:
+    model = SimulatedModel(name, latency=options.distribution, mean_latency=options.latency,
+                           response_size=options.response_size, seed=options.seed)
+    template = ' '.join(f'{{{name}}}' for name in inputs)
+    return ProbabilisticComponent(model, Prompt(f'{output}: {template}', Concept(output)))
+
+
+def deep_chain(options):
+    steps = [component(f'm{i}', [f'c{i}'], f'c{i + 1}', options) for i in range(options.width)]
+    return Chain(steps), {'c0': 'input'}, len(steps)
+
+
+def wide_threads(options):
+    branches = [component(f'm{i}', ['c0'], f'w{i}', options) for i in range(options.width)]
+    return Threads(branches, max_workers=options.width), {'c0': 'input'}, len(branches)
+
+
+def nested(options):
+    # the notebook shape: chains of chains feeding a Threads, feeding a final step
+    def sub_chain(prefix):
+        return Chain([component(f'{prefix}a', ['subject'], f'{prefix}1', options),
+                      component(f'{prefix}b', [f'{prefix}1'], f'{prefix}2', options)])
+    threads = Threads([component('ta', ['x2', 'y2'], 't1', options), component('tb', ['x2'], 't2', options),
+                       Chain([component('tc', ['y2'], 't3', options), component('td', ['t3'], 't4', options)])],
+                      max_workers=4)
+    pipeline = Chain([Chain([sub_chain('x'), sub_chain('y')]), threads,
+                      component('z', ['t1', 't2', 't4'], 'z', options)])
+    return pipeline, {'subject': 'input'}, 9
+
+
+def fan_out(options):
+    # one step producing a list, then one mapper run per element
+    split = ProbabilisticComponent(
+        SimulatedModel('split', seed=options.seed, response_size=options.width * 8),
+        Prompt('{document}', Concept('sections', type='list', listify_func=str.split)))
+    mapper = component('map', ['item'], 'summary', options)
+    pipeline = Chain([split, MapReduce('sections', mapper, Concept('summaries', type='list'),
+                                       max_concurrency=options.width)])
+    registry = ConceptRegistry([Concept(name='document', string_content='input')])
+    sections = len(split.run(registry).as_list())
+    return pipeline, {'document': 'input'}, sections + 1
+
+
+TOPOLOGIES = {'deep_chain': deep_chain, 'wide_threads': wide_threads, 'nested': nested, 'fan_out': fan_out}
+
+
+def runner(pipeline, mode: str):
+    if mode == 'compiled':
+        return pipeline.compile().run
+    if mode == 'graph':
+        return GraphExecutor(pipeline).run
+    return pipeline.run
+
+
+def initial_registry(initial) -> ConceptRegistry:
+    return ConceptRegistry([Concept(name=name, string_content=value) for name, value in initial.items()])
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def measure(name: str, mode: str, options) -> dict:
+    pipeline, initial, steps = TOPOLOGIES[name](options)
+    run = runner(pipeline, mode)
+    run(initial_registry(initial))
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(options.runs):
+        run_started = time.perf_counter()
+        run(initial_registry(initial))
+        latencies.append(time.perf_counter() - run_started)
+    elapsed = time.perf_counter() - started
+
+    # tracemalloc slows everything down, so memory gets a pass of its own
+    tracemalloc.start()
+    for _ in range(min(options.runs, 5)):
+        run(initial_registry(initial))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    zero_latency = argparse.Namespace(**{**vars(options), 'latency': 0.0})
+    pipeline, initial, _ = TOPOLOGIES[name](zero_latency)
+    run = runner(pipeline, mode)
+    run(initial_registry(initial))
+    overhead_started = time.perf_counter()
+    for _ in range(options.runs):
+        run(initial_registry(initial))
+    overhead = (time.perf_counter() - overhead_started) / options.runs / steps
+
+    return {'topology': name, 'mode': mode, 'steps': steps, 'runs': options.runs,
+            'throughput_runs_per_s': options.runs / elapsed,
+            'p50_ms': percentile(latencies, 50) * 1e3, 'p95_ms': percentile(latencies, 95) * 1e3,
+            'p99_ms': percentile(latencies, 99) * 1e3, 'mean_ms': statistics.fmean(latencies) * 1e3,
+            'overhead_us_per_step': overhead * 1e6, 'peak_memory_kb': peak / 1024}
+
+
+def compare(results, baseline, tolerance: float) -> bool:
+    # lower is better for everything but throughput. Returns False when any metric regressed past tolerance
+    previous = {(entry['topology'], entry['mode']): entry for entry in baseline['results']}
+    ok = True
+    for entry in results:
+        old = previous.get((entry['topology'], entry['mode']))
+        if old is None:
+            continue
+        for metric in ('throughput_runs_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'overhead_us_per_step',
+                       'peak_memory_kb'):
+            if not old[metric]:
+                continue
+            change = (entry[metric] - old[metric]) / old[metric]
+            regressed = -change > tolerance if metric == 'throughput_runs_per_s' else change > tolerance
+            ok = ok and not regressed
+            print(f'{entry["topology"]:<14}{entry["mode"]:<13}{metric:<24}{old[metric]:>12.2f}{entry[metric]:>12.2f}'
+                  f'{change:>+9.1%}{"  REGRESSION" if regressed else ""}')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--topology', choices=['all'] + list(TOPOLOGIES), default='all')
+    parser.add_argument('--mode', choices=['all', 'interpreted', 'compiled', 'graph'], default='all')
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--width', type=int, default=16, help='chain depth, threads width and fan-out size')
+    parser.add_argument('--latency', type=float, default=0.002, help='mean simulated model latency in seconds')
+    parser.add_argument('--distribution', choices=['constant', 'uniform', 'exponential', 'lognormal'],
+                        default='lognormal')
+    parser.add_argument('--response-size', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    parser.add_argument('--baseline', help='compare against a JSON file written with --output')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change counted as a regression')
+    options = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter('ignore')
+
+    topologies = list(TOPOLOGIES) if options.topology == 'all' else [options.topology]
+    modes = ['interpreted', 'compiled', 'graph'] if options.mode == 'all' else [options.mode]
+    results = []
+    for name in topologies:
+        for mode in modes:
+            entry = measure(name, mode, options)
+            results.append(entry)
+            print(f'{name:<14}{mode:<13}{entry["throughput_runs_per_s"]:>9.1f} runs/s  p50 {entry["p50_ms"]:>8.2f} ms'
+                  f'  p95 {entry["p95_ms"]:>8.2f} ms  p99 {entry["p99_ms"]:>8.2f} ms'
+                  f'  overhead {entry["overhead_us_per_step"]:>8.2f} us/step  peak {entry["peak_memory_kb"]:>9.1f} KiB')
+
+    report = {'python': platform.python_version(), 'platform': platform.platform(),
+              'options': {key: value for key, value in vars(options).items() if key not in ('output', 'baseline')},
+              'results': results}
+    if options.output:
+        with open(options.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    if options.baseline:
+        with open(options.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if not compare(results, baseline, options.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
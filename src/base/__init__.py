@@ -1 +1,43 @@
 from .executable import *
+from .cache import *
+from .memory import *
+from .template import *
+from .tracing import *
+from .limits import *
+from .resilience import *
+from .accounting import *
+from .lazy import *
+from .singleflight import *
+
+from importlib import import_module as _import_module
+
+# the subsystems below are imported on first use, so `import base` only pays for what running a pipeline needs
+_LAZY = {
+    'graph': ['GraphNode', 'ExecutionGraph', 'compile_graph', 'prune_graph', 'GraphExecutor'],
+    'batch': ['run_batch', 'registry_to_row', 'row_value'],
+    'plan': ['PipelineCompileError', 'PlanStep', 'CompiledPipeline', 'compile_pipeline'],
+    'mapreduce': ['MapReduce'],
+    'simulated': ['SimulatedModel'],
+    'checkpoint': ['CheckpointStore', 'CheckpointWriter', 'CheckpointedPipeline'],
+    'incremental': ['IncrementalReport', 'IncrementalPipeline'],
+    'router': ['Router'],
+    'serialization': ['FORMAT', 'FORMAT_VERSION', 'PipelineFormatError', 'load_object', 'object_spec',
+                      'dump_concept', 'load_concept', 'pipeline_to_dict', 'pipeline_from_dict', 'dump_pipeline',
+                      'save_pipeline', 'load_pipeline'],
+}
+_LAZY_NAMES = {name: module for module, names in _LAZY.items() for name in names}
+# `from base import *` still gets every name, and imports the subsystems
+__all__ = [name for name in globals() if not name.startswith('_')] + list(_LAZY_NAMES)
+
+
+def __getattr__(name: str):
+    module = _LAZY_NAMES.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(_import_module(f'.{module}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_NAMES))
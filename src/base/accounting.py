@@ -0,0 +1,168 @@
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+import threading
+
+# None means accounting is off, every hook then returns straight away
+_METER: Optional['UsageMeter'] = None
+_COMPONENT: ContextVar[Optional[str]] = ContextVar('lexflow_component', default=None)
+
+# the component name used for model calls made outside of any component
+DIRECT_CALL = '(direct)'
+
+_FIELDS = ('calls', 'cache_hits', 'prompt_bytes', 'prompt_tokens', 'response_bytes', 'response_tokens', 'cost')
+
+
+def estimate_tokens(text: str) -> int:
+    # roughly four characters per token for English text, good enough for budgeting
+    return max(1, len(text) // 4)
+
+
+@dataclass(frozen=True)
+class ModelPrice:
+    # in your currency of choice per 1000 tokens
+    prompt_per_1k: float
+    response_per_1k: float
+
+
+class UsageMeter:
+    # aggregates model usage per (component, model) over all runs. Tokens are counted with `tokenizer` when
+    # given, otherwise with the model's own count_tokens. Cache hits, and calls that shared the response of an
+    # identical call in flight, are counted but cost nothing
+    def __init__(self, prices: Optional[Dict[str, ModelPrice]] = None,
+                 tokenizer: Optional[Callable[[str], int]] = None):
+        self.prices = prices if prices is not None else {}
+        self.tokenizer = tokenizer
+        self._usage: Dict[Tuple[str, str], Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model, prompt_string: str, response: str, cached: bool = False):
+        count = self.tokenizer if self.tokenizer is not None else model.count_tokens
+        prompt_tokens, response_tokens = count(prompt_string), count(response)
+        price = self.prices.get(model.name)
+        cost = 0.0
+        if price is not None and not cached:
+            cost = (prompt_tokens * price.prompt_per_1k + response_tokens * price.response_per_1k) / 1000
+        key = (_COMPONENT.get() or DIRECT_CALL, model.name)
+        with self._lock:
+            usage = self._usage.get(key)
+            if usage is None:
+                usage = self._usage[key] = dict.fromkeys(_FIELDS, 0)
+                usage['max_prompt_tokens'] = 0
+            usage['calls'] += 1
+            usage['cache_hits'] += cached
+            usage['prompt_bytes'] += len(prompt_string.encode())
+            usage['prompt_tokens'] += prompt_tokens
+            usage['response_bytes'] += len(response.encode())
+            usage['response_tokens'] += response_tokens
+            usage['cost'] += cost
+            usage['max_prompt_tokens'] = max(usage['max_prompt_tokens'], prompt_tokens)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            usage = {key: dict(values) for key, values in self._usage.items()}
+        snapshot = {'components': {}, 'models': {}, 'total': _empty()}
+        for (component, model), values in usage.items():
+            for group, name in (('components', component), ('models', model)):
+                _add(snapshot[group].setdefault(name, _empty()), values)
+            _add(snapshot['total'], values)
+        for group in (snapshot['components'], snapshot['models'], {'total': snapshot['total']}):
+            for values in group.values():
+                values['mean_prompt_tokens'] = values['prompt_tokens'] / values['calls'] if values['calls'] else 0.0
+        return snapshot
+
+    def prometheus(self, prefix: str = 'lexflow') -> str:
+        with self._lock:
+            usage = sorted((key, dict(values)) for key, values in self._usage.items())
+        lines = []
+        for field, kind, description in _METRICS:
+            name = f'{prefix}_{field}' + ('_total' if kind == 'counter' else '')
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (component, model), values in usage:
+                lines.append(f'{name}{{component="{_escape(component)}",model="{_escape(model)}"}} {values[field]}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._usage.clear()
+
+
+_METRICS = (('calls', 'counter', 'Model calls, including cache hits'),
+            ('cache_hits', 'counter', 'Model calls answered from the response cache or by an identical call in flight'),
+            ('prompt_bytes', 'counter', 'UTF-8 bytes of filled prompts'),
+            ('prompt_tokens', 'counter', 'Tokens of filled prompts'),
+            ('response_bytes', 'counter', 'UTF-8 bytes of responses'),
+            ('response_tokens', 'counter', 'Tokens of responses'),
+            ('cost', 'counter', 'Estimated cost of the calls that were not cache hits'),
+            ('max_prompt_tokens', 'gauge', 'Largest filled prompt seen, in tokens'))
+
+
+def _empty() -> Dict[str, float]:
+    values = dict.fromkeys(_FIELDS, 0)
+    values['max_prompt_tokens'] = 0
+    return values
+
+
+def _add(target: Dict[str, float], values: Dict[str, float]):
+    for field in _FIELDS:
+        target[field] += values[field]
+    target['max_prompt_tokens'] = max(target['max_prompt_tokens'], values['max_prompt_tokens'])
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _ComponentScope:
+    __slots__ = ('name', 'token')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.token = _COMPONENT.set(self.name)
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            _COMPONENT.reset(self.token)
+        except ValueError:
+            # an abandoned stream is closed by the event loop's finalizer, in a context of its own
+            pass
+        return False
+
+
+class _NoopScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NOOP_SCOPE = _NoopScope()
+
+
+def metered(component_name: str):
+    # attributes the model calls made inside the block to the component
+    if _METER is None:
+        return _NOOP_SCOPE
+    return _ComponentScope(component_name)
+
+
+def record(model, prompt_string: str, response: str, cached: bool = False):
+    meter = _METER
+    if meter is not None:
+        meter.record(model, prompt_string, response, cached)
+
+
+def set_meter(meter: Optional[UsageMeter]) -> Optional[UsageMeter]:
+    global _METER
+    previous, _METER = _METER, meter
+    return previous
+
+
+def get_meter() -> Optional[UsageMeter]:
+    return _METER
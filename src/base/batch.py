@@ -0,0 +1,88 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Union
+import logging
+import math
+import numbers
+
+from . import tracing
+from .executable import Concept, ConceptRegistry, Executable, ExecutableOrchestrator
+from .graph import ExecutionGraph, compile_graph
+from .lazy import LazyText
+
+LOGGER = logging.getLogger(__name__)
+
+
+def run_batch(pipeline: Union[Executable, ExecutableOrchestrator], rows, chunk_size: int = 64,
+              max_workers: int = 1, callback=None) -> Iterator[Dict[str, Union[str, List[str], None]]]:
+    # rows is an iterable of {concept name: value} dicts or anything with iterrows (e.g. a pandas DataFrame), with
+    # strings, lists of strings or numbers as values. Results are yielded in input order, with at most max_workers
+    # chunks held in memory at once
+    if chunk_size < 1:
+        raise ValueError(f'chunk_size must be a positive integer, got {chunk_size}')
+    if max_workers < 1:
+        raise ValueError(f'max_workers must be a positive integer, got {max_workers}')
+
+    graph = compile_graph(pipeline)
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lexflow-batch') as executor:
+        pending = deque()
+        for chunk in _chunks(_iter_rows(rows), chunk_size):
+            pending.append(tracing.submit(executor, _run_chunk, graph, chunk, callback))
+            if len(pending) >= max_workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _iter_rows(rows) -> Iterator[Dict[str, Union[str, List[str], LazyText]]]:
+    if hasattr(rows, 'iterrows'):
+        rows = (row.to_dict() for _, row in rows.iterrows())
+    for position, row in enumerate(rows):
+        yield {name: row_value(position, name, value) for name, value in row.items()}
+
+
+def row_value(position: int, name: str, value) -> Union[str, List[str], LazyText]:
+    # checks a value of row `position` of a batch or job submission. Numbers, e.g. from a DataFrame column,
+    # become their text. Missing values (None, NaN) are an error rather than the text 'nan' in a prompt
+    if isinstance(value, (str, LazyText)):
+        return value
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return value
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        raise ValueError(f'Row {position} has no value for {name!r}')
+    if isinstance(value, numbers.Number):
+        return str(value)
+    raise TypeError(f'Row {position} has a {type(value).__name__} for {name!r}, expected a string, a list of '
+                    f'strings or a number')
+
+
+def _chunks(rows: Iterator[Dict[str, str]], chunk_size: int) -> Iterator[List[Dict[str, str]]]:
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _run_chunk(graph: ExecutionGraph, chunk: List[Dict[str, str]], callback=None) -> List[Dict]:
+    LOGGER.debug('Running a chunk of %d rows', len(chunk))
+
+    registries = [ConceptRegistry([Concept(name=name, type='list', list_content=value) if isinstance(value, list)
+                                   else Concept(name=name, string_content=value) for name, value in row.items()])
+                  for row in chunk]
+    outputs: List[List[Optional[Concept]]] = [[None] * len(graph.nodes) for _ in chunk]
+
+    # one batched model call per component for the whole chunk
+    for node in graph.nodes:
+        views = [node.view(registry, row_outputs) for registry, row_outputs in zip(registries, outputs)]
+        for row_outputs, concept in zip(outputs, node.component.run_batch(views, callback)):
+            row_outputs[node.index] = concept
+
+    return [registry_to_row(graph.commit(registry, row_outputs)) for registry, row_outputs in zip(registries, outputs)]
+
+
+def registry_to_row(concept_registry: ConceptRegistry) -> Dict[str, Union[str, List[str], None]]:
+    # the row form of a run's result, as run_batch yields it and the server and job queue return it
+    return {name: concept.list_content if concept.type == 'list' else concept.string_content
+            for name, concept in concept_registry.concepts.items()}
@@ -0,0 +1,168 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Optional
+import hashlib
+import json
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+
+def make_cache_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ResponseCache(ABC):
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: str):
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self)}
+
+
+class LRUCache(ResponseCache):
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        super().__init__()
+        if max_entries < 1:
+            raise ValueError(f'max_entries must be a positive integer, got {max_entries}')
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteCache(ResponseCache):
+    def __init__(self, path: str, max_entries: Optional[int] = None, ttl: Optional[float] = None):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # sqlite3 is only imported by the caches that use it
+        import sqlite3
+        # a single connection shared between threads, every access goes through the lock
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS responses '
+                                     '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL, accessed_at REAL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)')
+
+    def _get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute('SELECT value, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at <= now:
+                self._connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.evictions += 1
+                return None
+            self._connection.execute('UPDATE responses SET accessed_at = ? WHERE key = ?', (now, key))
+            return value
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl is not None else None
+        with self._lock, self._connection:
+            self._connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)',
+                                     (key, value, expires_at, now))
+            if self.max_entries is not None:
+                evicted = self._connection.execute(
+                    'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at DESC '
+                    'LIMIT -1 OFFSET ?)', (self.max_entries,)).rowcount
+                self.evictions += evicted
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM responses')
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+class TieredCache(ResponseCache):
+    # an in-process LRU in front of a persistent cache, disk hits are promoted to memory
+    def __init__(self, memory: LRUCache, disk: ResponseCache):
+        super().__init__()
+        self.memory = memory
+        self.disk = disk
+
+    def _get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        self.disk.set(key, value)
+
+    def __len__(self) -> int:
+        return len(self.disk)
+
+    def stats(self) -> Dict[str, int]:
+        stats = super().stats()
+        stats.update({f'memory_{name}': value for name, value in self.memory.stats().items()})
+        stats.update({f'disk_{name}': value for name, value in self.disk.stats().items()})
+        return stats
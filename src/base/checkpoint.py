@@ -0,0 +1,224 @@
+from typing import Dict, List, Optional, Tuple, Union
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from . import tracing
+from .executable import Concept, ConceptRegistry, Executable, ExecutableOrchestrator
+from .plan import CompiledPipeline, PlanStep, compile_pipeline
+from .serialization import dump_concept, load_concept
+
+LOGGER = logging.getLogger(__name__)
+
+_RUN_ID = re.compile(r'^[A-Za-z0-9_.-]+$')
+
+
+def _dump(concept: Concept) -> Dict:
+    # a listify_func that can't be serialized is taken from the component again on resume
+    return dump_concept(concept, strict=False)
+
+
+class CheckpointStore:
+    # one append-only JSON lines file per run: a start record with the initial concepts, one record per
+    # completed step holding only that step's output, and a done record once the run finished
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, run_id: str) -> str:
+        if not _RUN_ID.match(run_id):
+            raise ValueError(f'run_id may only contain letters, digits, "_", "-" and ".", got {run_id!r}')
+        return os.path.join(self.directory, f'{run_id}.jsonl')
+
+    def load(self, run_id: str) -> Optional[List[Dict]]:
+        path = self.path(run_id)
+        if not os.path.exists(path):
+            return None
+        records = []
+        valid = 0
+        with open(path, 'rb+') as file:
+            for line in file:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('unterminated record')
+                    records.append(json.loads(line))
+                except ValueError:
+                    # the last record is cut short when the process died while writing it. It is cut off the
+                    # file, so records appended on resume start on a fresh line
+                    LOGGER.warning('Dropping a truncated checkpoint record in %s', path)
+                    file.truncate(valid)
+                    break
+                valid += len(line)
+        return records
+
+    def open(self, run_id: str, every: int = 1, durable: bool = False) -> 'CheckpointWriter':
+        return CheckpointWriter(self.path(run_id), every, durable)
+
+    def delete(self, run_id: str):
+        try:
+            os.remove(self.path(run_id))
+        except FileNotFoundError:
+            pass
+
+    def run_ids(self) -> List[str]:
+        return sorted(name[:-len('.jsonl')] for name in os.listdir(self.directory) if name.endswith('.jsonl'))
+
+    def cleanup(self, max_age: Optional[float] = None, completed: bool = True) -> List[str]:
+        # removes finished runs and, with max_age, any checkpoint not written to for max_age seconds
+        removed = []
+        now = time.time()
+        for run_id in self.run_ids():
+            path = self.path(run_id)
+            stale = max_age is not None and now - os.path.getmtime(path) > max_age
+            if stale or (completed and _is_done(self.load(run_id))):
+                self.delete(run_id)
+                removed.append(run_id)
+        return removed
+
+
+def _is_done(records: Optional[List[Dict]]) -> bool:
+    return bool(records) and records[-1].get('kind') == 'done'
+
+
+class CheckpointWriter:
+    # records are buffered and written every `every` completed steps, so a crash loses at most every - 1 steps.
+    # durable=True also fsyncs each write
+    def __init__(self, path: str, every: int = 1, durable: bool = False):
+        if every < 1:
+            raise ValueError(f'every must be a positive integer, got {every}')
+        self.every = every
+        self.durable = durable
+        self._file = open(path, 'a', encoding='utf-8')
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+
+    def append(self, record: Dict, force: bool = False):
+        line = json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n'
+        with self._lock:
+            self._buffer.append(line)
+            if force or len(self._buffer) >= self.every:
+                self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            self._file.write(''.join(self._buffer))
+            self._buffer.clear()
+            self._file.flush()
+            if self.durable:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file.close()
+
+
+class CheckpointedPipeline:
+    # runs a compiled plan, recording every completed step under a run id. Running again with the same run id
+    # skips the steps that already completed and reuses their outputs instead of calling the models again
+    def __init__(self, pipeline: Union[Executable, ExecutableOrchestrator, CompiledPipeline], store: CheckpointStore,
+                 every: int = 1, durable: bool = False, keep: bool = False):
+        self.plan = pipeline if isinstance(pipeline, CompiledPipeline) else compile_pipeline(pipeline)
+        self.store = store
+        self.every = every
+        self.durable = durable
+        # keep=False deletes a run's checkpoint as soon as it finished
+        self.keep = keep
+        # a changed prompt, model or structure changes the signature. Steps without a fingerprint are only known by
+        # their output name
+        self.signature = [list(self.plan.required_inputs)] + [
+            [step.component.output_name(), list(step.input_names),
+             step.component.fingerprint() if hasattr(step.component, 'fingerprint') else None]
+            for step in self.plan.steps]
+
+    def _restore(self, run_id: str, concept_registry: ConceptRegistry) -> Tuple[Dict[int, Concept], bool]:
+        records = self.store.load(run_id)
+        if not records:
+            return {}, False
+        start = records[0]
+        if start.get('kind') != 'start' or start.get('signature') != self.signature:
+            raise ValueError(f'Checkpoint {run_id!r} was written by a different pipeline')
+        initial = {data['name']: data for data in start['initial']}
+        for name in self.plan.required_inputs:
+            if _dump(concept_registry.concepts[name]) != initial[name]:
+                raise ValueError(f'Checkpoint {run_id!r} was written for a different value of the concept {name!r}')
+
+        completed = {}
+        for record in records[1:]:
+            if record.get('kind') == 'step':
+                index = record['index']
+                completed[index] = load_concept(record['concept'], self.plan.steps[index].output_template())
+        return completed, True
+
+    def _start(self, run_id: str, concept_registry: ConceptRegistry):
+        completed, resumed = self._restore(run_id, concept_registry)
+        if resumed:
+            LOGGER.info('Resuming run %s, %d of %d steps already completed', run_id, len(completed),
+                        len(self.plan.steps))
+        writer = self.store.open(run_id, self.every, self.durable)
+        if not resumed:
+            writer.append({'kind': 'start', 'signature': self.signature,
+                           'initial': [_dump(concept_registry.concepts[name])
+                                       for name in self.plan.required_inputs]}, force=True)
+        return completed, writer
+
+    @staticmethod
+    def _record(writer: CheckpointWriter, index: int, step: PlanStep, output_concept: Concept) -> Concept:
+        output_concept.level = step.level
+        writer.append({'kind': 'step', 'index': index, 'concept': _dump(output_concept)})
+        return output_concept
+
+    def _finish(self, run_id: str, writer: CheckpointWriter, concept_registry: ConceptRegistry,
+                slots: List[Concept]) -> ConceptRegistry:
+        writer.append({'kind': 'done'}, force=True)
+        writer.close()
+        if not self.keep:
+            self.store.delete(run_id)
+        return self.plan._commit(concept_registry, slots)
+
+    def run(self, concept_registry: ConceptRegistry, run_id: str, callback=None) -> ConceptRegistry:
+        slots = self.plan._load(concept_registry)
+        completed, writer = self._start(run_id, concept_registry)
+
+        def execute(index: int, step: PlanStep) -> Concept:
+            if index in completed:
+                return completed[index]
+            return self._record(writer, index, step, step.execute(slots, concept_registry, callback))
+
+        try:
+            with tracing.traced('pipeline', 'CheckpointedPipeline', size=len(self.plan.steps),
+                                resumed_steps=len(completed)):
+                self.plan.schedule(slots, execute)
+        except BaseException:
+            writer.close()
+            raise
+        return self._finish(run_id, writer, concept_registry, slots)
+
+    async def arun(self, concept_registry: ConceptRegistry, run_id: str, callback=None) -> ConceptRegistry:
+        slots = self.plan._load(concept_registry)
+        completed, writer = self._start(run_id, concept_registry)
+
+        async def execute(index: int, step: PlanStep) -> Concept:
+            if index in completed:
+                return completed[index]
+            return self._record(writer, index, step, await step.aexecute(slots, concept_registry, callback))
+
+        try:
+            with tracing.traced('pipeline', 'CheckpointedPipeline', size=len(self.plan.steps),
+                                resumed_steps=len(completed)):
+                await self.plan.aschedule(slots, execute)
+        except BaseException:
+            writer.close()
+            raise
+        return self._finish(run_id, writer, concept_registry, slots)
+
+    def resume(self, run_id: str, callback=None) -> ConceptRegistry:
+        # rebuilds the initial registry from the checkpoint, for when the caller no longer has it
+        records = self.store.load(run_id)
+        if not records:
+            raise KeyError(f'No checkpoint for run {run_id!r} in {self.store.directory}')
+        initial = ConceptRegistry([load_concept(data) for data in records[0]['initial']])
+        return self.run(initial, run_id, callback)
@@ -1,27 +1,53 @@
 from abc import ABC, abstractmethod
-from pydantic import BaseModel, StrictStr, StrictInt, StrictFloat, StrictBool, validate_call
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, StrictStr, StrictInt, StrictFloat, StrictBool, validate_call
 from pydantic.dataclasses import dataclass as pydantic_dataclass
-from typing import Literal, List, Callable, Union, Dict, Optional
-import re
+from typing import Literal, List, Callable, Union, Dict, Optional, Iterator, AsyncIterator
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+import asyncio
+import copy
+import inspect
 import pprint
+import random
+import time
 import warnings
 
 import logging
 
-logging.basicConfig(level=logging.DEBUG)
+from . import accounting, tracing
+from .cache import ResponseCache, make_cache_key
+from .lazy import LazyText, compact_prompt
+from .limits import LIMITERS
+from .memory import MemoryBackend, default_memory
+from .resilience import DEFAULT_POLICY, HedgePolicy, ResiliencePolicy, RetryPolicy, check_deadline, deadline_active
+from .singleflight import FLIGHTS
+from .template import compile_template
+
 LOGGER = logging.getLogger(__name__)
 
+# the model whose generate_response override is being called from inside its own response layers
+_OVERRIDDEN: ContextVar[Optional['LanguageModel']] = ContextVar('lexflow_overridden', default=None)
+
+
+def split_lines(text: str) -> List[str]:
+    return text.split('\n')
+
 
 @pydantic_dataclass
 class Concept:
     name: StrictStr
     type: Literal['identity', 'list'] = 'identity'
     choice: Literal['all', 'index', 'stringify', 'random'] = 'all'
-    listify_func: Callable = lambda x: x.split('\n')
-    string_content: Union[StrictStr, None] = None
+    # a named function rather than a lambda, so concepts can be pickled and serialized
+    listify_func: Callable = split_lines
+    # a LazyText keeps a large input on disk until a prompt needs it
+    string_content: Union[StrictStr, LazyText, None] = None
     list_content: List[StrictStr] = None
     inputted: bool = False
     level: int = 0
+    # position used by choice='index'
+    index: int = 0
 
     def __post_init__(self):
         if self.string_content:
@@ -34,11 +60,26 @@ class Concept:
             else:
                 raise ValueError(f'no string value assigned to {self.__dict__}')
         else:
+            items = self.as_list()
             if self.choice == 'all':
-                if self.list_content:
-                    return self.list_content
+                if items:
+                    return items
                 else:
                     raise ValueError(f'no list value assigned to {self.__dict__}')
+            elif self.choice == 'stringify':
+                return '\n'.join(items)
+            elif self.choice == 'random':
+                return random.choice(items)
+            else:
+                return items[self.index]
+
+    def as_list(self) -> List[StrictStr]:
+        # a list concept filled as a string, e.g. by a model, is split with listify_func
+        if self.list_content is not None:
+            return self.list_content
+        if self.string_content is not None:
+            return self.listify_func(str(self.string_content))
+        raise ValueError(f'no list value assigned to {self.__dict__}')
 
     def get_name(self) -> StrictStr:
         return self.name
@@ -57,49 +98,273 @@ class Prompt:
     template: StrictStr
     output: Concept
     inputs: List[StrictStr] = None
+    # no longer written by runs, a Prompt holds no per-run state and can be shared by concurrent runs
     filled_prompt: Union[StrictStr, None] = None
 
     def __post_init__(self):
-        self.inputs = re.findall(r'\{(.*?)\}', self.template)
+        # parsed once, malformed templates fail here rather than on the first run
+        self._compiled = compile_template(self.template)
+        self.inputs = list(self._compiled.inputs)
 
-    def fill(self, running_concepts: Dict[StrictStr, Concept]):
+    def render(self, running_concepts: Dict[StrictStr, Concept]) -> StrictStr:
         try:
-            format_dict = {e: running_concepts[e].get_value() for e in self.inputs}
+            values = [running_concepts[e].get_value() for e in self._compiled.inputs]
         except KeyError as e:
             raise KeyError(f'Could not find the input {e} in available run concepts {running_concepts.keys()} in'
                            f'object {self} with __dict__ {self.__dict__}')
-        self.filled_prompt = self.template.format(**format_dict)
-        return self.filled_prompt
+        return self._compiled.render(values)
+
+    def fill(self, running_concepts: Dict[StrictStr, Concept]):
+        return self.render(running_concepts)
 
-    def assign_output_as_string(self, output: StrictStr):
-        self.output.assign_string_content(string_content=output)
+    def assign_output_as_string(self, output: StrictStr) -> Concept:
+        # output is only a template and is never written to, every response gets a copy of it. A Prompt is shared
+        # by concurrent runs
+        output_concept = copy.copy(self.output)
+        output_concept.assign_string_content(string_content=output)
+        return output_concept
 
     def return_output_concept(self) -> Concept:
         return self.output
 
     def __repr__(self):
-        return pprint.pformat(self.__dict__)
+        return pprint.pformat({k: v for k, v in self.__dict__.items() if not k.startswith('_')})
 
 class LanguageModel(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     name: StrictStr
-    memory: List = []
+    memory: MemoryBackend = Field(default_factory=default_memory)
+    cache: Optional[ResponseCache] = None
+    # models sharing a provider share its rate limits, see limits.LIMITERS
+    provider: Optional[StrictStr] = None
+    # identical calls in flight at the same time share one response, see singleflight.FLIGHTS. Turn it off for
+    # sampled models whose callers want independent responses to the same prompt
+    coalesce: StrictBool = True
+
+    def __init__(self, name: StrictStr, cache: Optional[ResponseCache] = None, memory: Optional[MemoryBackend] = None,
+                 provider: Optional[StrictStr] = None, coalesce: bool = True):
+        super().__init__(name=name, cache=cache, memory=memory if memory is not None else default_memory(),
+                         provider=provider, coalesce=coalesce)
 
-    def __init__(self, name: StrictStr):
-        super().__init__(name=name)
-        self.memory = []
+    @property
+    def limiter_key(self) -> StrictStr:
+        return self.provider if self.provider is not None else self.name
+
+    def count_tokens(self, text: str) -> int:
+        # providers with a real tokenizer should override this, accounting uses it for prompts and responses
+        return accounting.estimate_tokens(text)
     # didn't use a datacclass here as it complaind about a list as a default value. it wanted to have a factory method to set it to a list to avoid setting any instance of the class to teh same list.
     # this was an example where using dataclasses is not suitable for things that are not data structures
 
+    def generation_params(self) -> Dict:
+        # anything besides the prompt that changes the response, e.g. temperature, must be part of the cache key
+        return {}
+
+    def cache_key(self, prompt_string: StrictStr) -> StrictStr:
+        return make_cache_key(type(self).__qualname__, self.name, self.generation_params(), prompt_string)
+
+    def _lookup(self, prompt_string: str):
+        if self.cache is None:
+            return None, None
+        key = self.cache_key(prompt_string)
+        return key, self.cache.get(key)
+
     @validate_call
     def generate_response(self, prompt_string: StrictStr) -> StrictStr:
-        response = f"Response of {self.name}: to ({prompt_string})"
-        self.memory.append((prompt_string, response))
+        if _OVERRIDDEN.get() is self:
+            # reached through super() from an override the layers below are already running around
+            return self._generate(prompt_string)
+        return self._respond(prompt_string, self._generate)
+
+    @validate_call
+    async def generate_response_async(self, prompt_string: StrictStr) -> StrictStr:
+        return await self._arespond(prompt_string)
+
+    @validate_call
+    def generate_batch(self, prompt_strings: List[StrictStr]) -> List[StrictStr]:
+        return self._respond_batch(prompt_strings)
+
+    def _overrides_generate_response(self) -> bool:
+        return type(self).generate_response is not LanguageModel.generate_response
+
+    def _generate_overridden(self, prompt_string: str) -> str:
+        # a subclass overriding generate_response (rather than _generate) is called as the provider, inside the
+        # cache, limiter, singleflight and memory layers. Its super() call goes straight to _generate
+        token = _OVERRIDDEN.set(self)
+        try:
+            return self.generate_response(prompt_string)
+        finally:
+            _OVERRIDDEN.reset(token)
+
+    async def _agenerate_overridden(self, prompt_string: str) -> str:
+        # kept off the event loop, the override is a blocking call
+        return await asyncio.to_thread(self._generate_overridden, prompt_string)
+
+    # _respond, _arespond and _respond_batch skip argument validation. They are used by components, whose
+    # prompts come from templates validated when the pipeline was built
+    def _respond(self, prompt_string: str, generate: Optional[Callable[[str], str]] = None) -> str:
+        if generate is None:
+            generate = self._generate_overridden if self._overrides_generate_response() else self._generate
+        key, response = self._lookup(prompt_string)
+        cached = response is not None
+        tracing.annotate(cache_hit=cached)
+        if response is None:
+            if self.coalesce:
+                response, cached = FLIGHTS.do(self._flight_key(prompt_string), self._miss, key, prompt_string,
+                                              generate)
+                tracing.annotate(coalesced=cached)
+            else:
+                response = self._miss(key, prompt_string, generate)
+        self.memory.append((compact_prompt(prompt_string), response))
+        accounting.record(self, prompt_string, response, cached)
+        return response
+
+    def _miss(self, key: Optional[str], prompt_string: str, generate: Callable[[str], str]) -> str:
+        with LIMITERS.limit(self.limiter_key, prompt_string):
+            response = generate(prompt_string)
+        if key is not None:
+            self.cache.set(key, response)
+        return response
+
+    async def _amiss(self, key: Optional[str], prompt_string: str, agenerate: Callable) -> str:
+        async with LIMITERS.alimit(self.limiter_key, prompt_string):
+            response = await agenerate(prompt_string)
+        if key is not None:
+            self.cache.set(key, response)
         return response
 
-    # add async later
+    def _flight_key(self, prompt_string: str):
+        # the same things as the cache key, without hashing the prompt
+        params = self.generation_params()
+        return type(self), self.name, repr(params) if params else None, prompt_string
+
+    async def _arespond(self, prompt_string: str) -> str:
+        agenerate = self._agenerate_overridden if self._overrides_generate_response() else self._agenerate
+        key, response = self._lookup(prompt_string)
+        cached = response is not None
+        tracing.annotate(cache_hit=cached)
+        if response is None:
+            if self.coalesce:
+                response, cached = await FLIGHTS.ado(self._flight_key(prompt_string), self._amiss, key, prompt_string,
+                                                     agenerate)
+                tracing.annotate(coalesced=cached)
+            else:
+                response = await self._amiss(key, prompt_string, agenerate)
+        self.memory.append((compact_prompt(prompt_string), response))
+        accounting.record(self, prompt_string, response, cached)
+        return response
+
+    def _respond_batch(self, prompt_strings: List[str]) -> List[str]:
+        lookups = [self._lookup(prompt_string) for prompt_string in prompt_strings]
+        missing = [index for index, (_, response) in enumerate(lookups) if response is None]
+        tracing.annotate(cache_hits=len(prompt_strings) - len(missing))
+        generated = []
+        if missing:
+            # a batch is a single request as far as the provider's limits are concerned
+            batch = [prompt_strings[index] for index in missing]
+            with LIMITERS.limit(self.limiter_key, ''.join(batch)):
+                if self._overrides_generate_response():
+                    generated = [self._generate_overridden(prompt_string) for prompt_string in batch]
+                else:
+                    generated = self._generate_batch(batch)
+        if len(generated) != len(missing):
+            raise ValueError(f'{self.name} returned {len(generated)} responses for {len(missing)} prompts')
+
+        responses = [response for _, response in lookups]
+        for index, response in zip(missing, generated):
+            responses[index] = response
+            key = lookups[index][0]
+            if key is not None:
+                self.cache.set(key, response)
+        self.memory.extend(zip(map(compact_prompt, prompt_strings), responses))
+        if accounting.get_meter() is not None:
+            generated_indices = set(missing)
+            for index, (prompt_string, response) in enumerate(zip(prompt_strings, responses)):
+                accounting.record(self, prompt_string, response, index not in generated_indices)
+        return responses
+
     @validate_call
-    def generate_response_async(self, prompt_string: StrictStr) -> StrictStr:
-        return self.generate_response(prompt_string)
+    def stream_response(self, prompt_string: StrictStr) -> Iterator[StrictStr]:
+        return self._stream_respond(prompt_string)
+
+    def stream_response_async(self, prompt_string: StrictStr) -> AsyncIterator[StrictStr]:
+        return self._astream_respond(prompt_string)
+
+    def _stream_respond(self, prompt_string: str) -> Iterator[str]:
+        key, response = self._lookup(prompt_string)
+        cached = response is not None
+        tracing.annotate(cache_hit=cached)
+        if cached:
+            yield response
+        else:
+            # the chunks are only joined once, when the stream is exhausted
+            chunks = []
+            with LIMITERS.limit(self.limiter_key, prompt_string):
+                if self._overrides_generate_response():
+                    stream = iter([self._generate_overridden(prompt_string)])
+                else:
+                    stream = self._stream(prompt_string)
+                for chunk in stream:
+                    chunks.append(chunk)
+                    yield chunk
+            response = ''.join(chunks)
+            if key is not None:
+                self.cache.set(key, response)
+        self.memory.append((compact_prompt(prompt_string), response))
+        accounting.record(self, prompt_string, response, cached)
+
+    async def _astream_respond(self, prompt_string: str) -> AsyncIterator[str]:
+        key, response = self._lookup(prompt_string)
+        cached = response is not None
+        tracing.annotate(cache_hit=cached)
+        if cached:
+            yield response
+        else:
+            chunks = []
+            async with LIMITERS.alimit(self.limiter_key, prompt_string):
+                if self._overrides_generate_response():
+                    chunks.append(await self._agenerate_overridden(prompt_string))
+                    yield chunks[0]
+                else:
+                    async for chunk in self._astream(prompt_string):
+                        chunks.append(chunk)
+                        yield chunk
+            response = ''.join(chunks)
+            if key is not None:
+                self.cache.set(key, response)
+        self.memory.append((compact_prompt(prompt_string), response))
+        accounting.record(self, prompt_string, response, cached)
+
+    # providers override _generate and, if they have a native async client, _agenerate.
+    # _generate_batch should be overridden when the provider has a batched endpoint, and _stream/_astream
+    # when it can return the response incrementally
+    def _generate(self, prompt_string: str) -> str:
+        return f"Response of {self.name}: to ({prompt_string})"
+
+    def _generate_batch(self, prompt_strings: List[str]) -> List[str]:
+        return [self._generate(prompt_string) for prompt_string in prompt_strings]
+
+    async def _agenerate(self, prompt_string: str) -> str:
+        if type(self)._generate is not LanguageModel._generate:
+            return await asyncio.to_thread(self._generate, prompt_string)
+        return self._generate(prompt_string)
+
+    def _stream(self, prompt_string: str) -> Iterator[str]:
+        yield self._generate(prompt_string)
+
+    async def _astream(self, prompt_string: str) -> AsyncIterator[str]:
+        yield await self._agenerate(prompt_string)
+
+
+@dataclass
+class StreamChunk:
+    # what a callback receives for every piece of a streamed response. done is set on a final, empty chunk
+    component: 'ProbabilisticComponent' = field(repr=False)
+    concept: str
+    index: int
+    text: str
+    done: bool = False
 
 
 @pydantic_dataclass
@@ -121,6 +386,14 @@ class ConceptRegistry:
         if concept.name in self.concepts and self.concepts[concept.name] is not concept:
             warnings.warn(f'Overwrite Warning: \n{self.concepts[concept.name]}\n\n Is being overwritten by:\n {concept}')
         self.concepts[concept.name] = concept
+
+    def copy(self) -> 'ConceptRegistry':
+        # shallow copy: the concepts are shared, only the name -> concept mapping is new. The concepts were
+        # validated when this registry was built, so the copy skips validation
+        registry = object.__new__(ConceptRegistry)
+        registry._initial_concepts = self._initial_concepts
+        registry._concepts = dict(self._concepts)
+        return registry
     #
     # def __repr__(self):
     #     return pprint.pformat(self.__dict__)
@@ -142,20 +415,35 @@ class ConceptRegistry:
         for concept in sorted_concepts:
             lines.append(f"  - {concept.name}:")
             for attr_name, attr_value in vars(concept).items():
+                # a file-backed value shows its file and size, not its text
+                if isinstance(attr_value, LazyText):
+                    attr_value = repr(attr_value)
                 lines.append(f"    {attr_name.capitalize()}: {attr_value}")
         return '\n'.join(lines)
 
 
 class Executable(BaseModel, ABC):
-    memory: List = []
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    memory: MemoryBackend = Field(default_factory=default_memory)
 
     @abstractmethod
     def run(self, concept_registry: ConceptRegistry, callback: Optional = None) -> Concept:
         pass
 
+    async def arun(self, concept_registry: ConceptRegistry, callback: Optional = None) -> Concept:
+        # components without a native coroutine path run in a worker thread
+        return await asyncio.to_thread(self.run, concept_registry, callback)
+
+    def run_batch(self, concept_registries: List[ConceptRegistry], callback: Optional = None) -> List[Concept]:
+        # run hands back the component's own output concept, so every row keeps a copy of it
+        return [copy.copy(self.run(concept_registry, callback)) for concept_registry in concept_registries]
+
 
 class ExecutableOrchestrator(BaseModel, ABC):
     components: List[Union[Executable, 'ExecutableOrchestrator']]
+    # targets of run(targets=...) -> the structure the plan was compiled from, the plan and the components
+    _plans: Dict[tuple, tuple] = PrivateAttr(default_factory=dict)
 
     def __init__(self, components: List[Union[Executable, 'ExecutableOrchestrator']] = None):
         super().__init__(components=components if components else [])
@@ -164,25 +452,226 @@ class ExecutableOrchestrator(BaseModel, ABC):
     def _run(self, concept_registry: ConceptRegistry, callback: Optional = None, level=0) -> ConceptRegistry:
         pass
 
+    async def _arun(self, concept_registry: ConceptRegistry, callback: Optional = None, level=0):
+        return await asyncio.to_thread(self._run, concept_registry, callback, level)
+
+    async def arun(self, concept_registry: ConceptRegistry, callback: Optional = None, level=0,
+                   targets: Optional[List[StrictStr]] = None) -> ConceptRegistry:
+        if targets is not None:
+            return await self._targeted(targets).arun(concept_registry, callback)
+        return (await self._arun(concept_registry, callback, level))[0]
+
+    def compile(self, initial_concepts: Optional[List[StrictStr]] = None, targets: Optional[List[StrictStr]] = None):
+        from .plan import compile_pipeline
+        return compile_pipeline(self, initial_concepts, targets)
+
+    def _targeted(self, targets: List[StrictStr]):
+        # run(targets=...) only runs the components the targets depend on, as a compiled plan. The plan is kept
+        # per targets and compiled again once the tree's wiring or any of its components changed, at any depth
+        leaves = []
+        structure = _structure(self, leaves)
+        cached = self._plans.get(tuple(targets))
+        if cached is not None and cached[0] == structure:
+            plan = cached[1]
+        else:
+            plan = self.compile(targets=targets)
+            # the leaves are kept alive with the plan, so the ids in structure can't be reused by other objects
+            self._plans[tuple(targets)] = (structure, plan, leaves)
+        if plan.skipped:
+            LOGGER.info('Running %d components for %s, skipping %s', len(plan.steps), list(targets), plan.skipped)
+        return plan
+
+
+def _structure(node: Union[Executable, ExecutableOrchestrator], leaves: List) -> tuple:
+    # what a compiled plan of the tree depends on: the components, what they read and write and the Threads pools.
+    # The components are collected in leaves
+    if isinstance(node, ExecutableOrchestrator):
+        return (type(node), getattr(node, 'max_workers', None),
+                tuple(_structure(component, leaves) for component in node.components))
+    leaves.append(node)
+    inputs = tuple(node.input_names()) if hasattr(node, 'input_names') else None
+    output = node.output_name() if hasattr(node, 'output_name') else None
+    return id(node), inputs, output
+
+
+async def _bounded(semaphore: Optional[asyncio.Semaphore], coroutine):
+    if semaphore is None:
+        return await coroutine
+    queued_at = time.perf_counter()
+    async with semaphore:
+        tracing.record_queue_wait(time.perf_counter() - queued_at)
+        return await coroutine
+
+
+async def _notify(callback, chunk: StreamChunk):
+    result = callback(chunk)
+    if inspect.isawaitable(result):
+        await result
+
+
+async def _gather_or_cancel(coroutines: List) -> List:
+    # like asyncio.gather, but the remaining branches are cancelled as soon as one of them fails
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 
 class ProbabilisticComponent(Executable):
     model: LanguageModel
     prompt: Prompt
-
-    def __init__(self, model, prompt):
-        super().__init__(model=model, prompt=prompt)
+    resilience: Optional[ResiliencePolicy] = None
+
+    def __init__(self, model, prompt, memory: Optional[MemoryBackend] = None, timeout: Optional[float] = None,
+                 deadline: Optional[float] = None, retry: Optional[RetryPolicy] = None,
+                 hedge: Optional[HedgePolicy] = None):
+        # timeout bounds each model call, deadline all of them including retries and hedged duplicates
+        resilience = None
+        if any(option is not None for option in (timeout, deadline, retry, hedge)):
+            resilience = ResiliencePolicy(timeout=timeout, deadline=deadline, retry=retry, hedge=hedge)
+        super().__init__(model=model, prompt=prompt, memory=memory if memory is not None else default_memory(),
+                         resilience=resilience)
+
+    def _policy(self) -> Optional[ResiliencePolicy]:
+        # None keeps the direct call, a run deadline alone still bounds the call through DEFAULT_POLICY
+        if self.resilience is None and deadline_active():
+            return DEFAULT_POLICY
+        return self.resilience
+
+    def input_names(self) -> List[StrictStr]:
+        return list(self.prompt.inputs)
+
+    def output_name(self) -> StrictStr:
+        return self.prompt.output.get_name()
+
+    def fingerprint(self) -> StrictStr:
+        # identifies what the component computes, the same inputs give the same output only if this matches
+        return make_cache_key(type(self).__qualname__, self.prompt.template, self.output_name(),
+                              type(self.model).__qualname__, self.model.name, self.model.generation_params())
 
     # @validate_call
     def run(self, concept_registry: ConceptRegistry, callback=None) -> Concept:
-        LOGGER.debug(f'Running object: {self.__dict__}')
+        LOGGER.debug('Running object: %s', self.__dict__)
+
+        return self._run_filled(self.prompt.render(concept_registry.concepts), callback)
 
-        self.prompt.fill(concept_registry.concepts)
-        response = self.model.generate_response(self.prompt.filled_prompt)
-        self.prompt.assign_output_as_string(response)
+    def _run_filled(self, filled_prompt: StrictStr, callback=None) -> Concept:
+        with tracing.traced('component', self.output_name(), model=self.model.name,
+                            prompt_size=len(filled_prompt)) as span, accounting.metered(self.output_name()):
+            policy = self._policy()
+            if callback is None:
+                response = (self.model._respond(filled_prompt) if policy is None
+                            else policy.call(self.model._respond, filled_prompt))
+            else:
+                # chunks already handed to the callback can't be taken back, so streams are neither retried nor hedged
+                check_deadline()
+                response = ''.join(self._forward(self.model._stream_respond(filled_prompt), callback))
+            if span is not None:
+                span.attributes['response_size'] = len(response)
+        return self._assign(response)
+
+    def _assign(self, response: StrictStr) -> Concept:
+        # every run gets its own output concept, so the same component can run on many inputs at once
+        output_concept = self.prompt.assign_output_as_string(response)
 
         # TODO fix what is added to the memory
         self.memory.append(response)
-        return self.prompt.return_output_concept()
+        return output_concept
+
+    def _forward(self, chunks: Iterator[str], callback=None) -> Iterator[str]:
+        index = 0
+        for chunk in chunks:
+            if callback is not None:
+                callback(StreamChunk(self, self.output_name(), index, chunk))
+            index += 1
+            yield chunk
+        if callback is not None:
+            callback(StreamChunk(self, self.output_name(), index, '', done=True))
+
+    async def _aforward(self, chunks: AsyncIterator[str], callback=None) -> AsyncIterator[str]:
+        # callbacks may be plain functions or coroutine functions
+        index = 0
+        async for chunk in chunks:
+            if callback is not None:
+                await _notify(callback, StreamChunk(self, self.output_name(), index, chunk))
+            index += 1
+            yield chunk
+        if callback is not None:
+            await _notify(callback, StreamChunk(self, self.output_name(), index, '', done=True))
+
+    def stream(self, concept_registry: ConceptRegistry, callback=None) -> Iterator[StrictStr]:
+        # yields the response as it is generated, the generator returns the output concept once exhausted
+        LOGGER.debug('Streaming object: %s', self.__dict__)
+
+        filled_prompt = self.prompt.render(concept_registry.concepts)
+        check_deadline()
+        chunks = []
+        with accounting.metered(self.output_name()):
+            for chunk in self._forward(self.model._stream_respond(filled_prompt), callback):
+                chunks.append(chunk)
+                yield chunk
+        return self._assign(''.join(chunks))
+
+    async def astream(self, concept_registry: ConceptRegistry, callback=None,
+                      outputs: Optional[List[Concept]] = None) -> AsyncIterator[StrictStr]:
+        # async generators can't return a value, the output concept is appended to outputs once the stream is
+        # exhausted
+        LOGGER.debug('Streaming object: %s', self.__dict__)
+
+        filled_prompt = self.prompt.render(concept_registry.concepts)
+        check_deadline()
+        chunks = []
+        with accounting.metered(self.output_name()):
+            async for chunk in self._aforward(self.model._astream_respond(filled_prompt), callback):
+                chunks.append(chunk)
+                yield chunk
+        output_concept = self._assign(''.join(chunks))
+        if outputs is not None:
+            outputs.append(output_concept)
+
+    def run_batch(self, concept_registries: List[ConceptRegistry], callback=None) -> List[Concept]:
+        LOGGER.debug('Running object: %s on a batch of %d', self.__dict__, len(concept_registries))
+
+        return self._run_filled_batch([self.prompt.render(concept_registry.concepts)
+                                       for concept_registry in concept_registries])
+
+    def _run_filled_batch(self, filled_prompts: List[StrictStr]) -> List[Concept]:
+        with tracing.traced('component', self.output_name(), model=self.model.name, batch_size=len(filled_prompts),
+                            prompt_size=sum(map(len, filled_prompts))) as span, \
+                accounting.metered(self.output_name()):
+            policy = self._policy()
+            responses = (self.model._respond_batch(filled_prompts) if policy is None
+                         else policy.call(self.model._respond_batch, filled_prompts))
+            if span is not None:
+                span.attributes['response_size'] = sum(map(len, responses))
+
+        output_concepts = [self.prompt.assign_output_as_string(response) for response in responses]
+        self.memory.extend(responses)
+        return output_concepts
+
+    async def arun(self, concept_registry: ConceptRegistry, callback=None) -> Concept:
+        LOGGER.debug('Running object: %s', self.__dict__)
+
+        return await self._arun_filled(self.prompt.render(concept_registry.concepts), callback)
+
+    async def _arun_filled(self, filled_prompt: StrictStr, callback=None) -> Concept:
+        with tracing.traced('component', self.output_name(), model=self.model.name,
+                            prompt_size=len(filled_prompt)) as span, accounting.metered(self.output_name()):
+            policy = self._policy()
+            if callback is None:
+                response = (await self.model._arespond(filled_prompt) if policy is None
+                            else await policy.acall(self.model._arespond, filled_prompt))
+            else:
+                check_deadline()
+                response = ''.join([chunk async for chunk in
+                                    self._aforward(self.model._astream_respond(filled_prompt), callback)])
+            if span is not None:
+                span.attributes['response_size'] = len(response)
+        return self._assign(response)
 
 
 class Chain(ExecutableOrchestrator):
@@ -191,45 +680,183 @@ class Chain(ExecutableOrchestrator):
 
     # @validate_call
     def _run(self, concept_registry: ConceptRegistry, callback=None, level=0):
-        LOGGER.debug(f'Running object: {self.__dict__}')
+        LOGGER.debug('Running object: %s', self.__dict__)
 
-        for component in self.components:
-            if isinstance(component, Executable):
-                output_concept: Concept = component.run(concept_registry, callback)
-                output_concept.level = level
-                concept_registry.update_concepts(output_concept)
-                level += 1
-            elif isinstance(component, ExecutableOrchestrator):
-                concept_registry, level = component._run(concept_registry, callback, level=level)
+        with tracing.traced('orchestrator', 'Chain', size=len(self.components)):
+            for component in self.components:
+                concept_registry, level = self._run_step(component, concept_registry, callback, level)
+
+        return concept_registry, level
+
+    def _run_step(self, component, concept_registry: ConceptRegistry, callback=None, level=0):
+        if isinstance(component, Executable):
+            output_concept: Concept = component.run(concept_registry, callback)
+            output_concept.level = level
+            concept_registry.update_concepts(output_concept)
+            level += 1
+        elif isinstance(component, ExecutableOrchestrator):
+            concept_registry, level = component._run(concept_registry, callback, level=level)
+        return concept_registry, level
+
+    async def _arun_step(self, component, concept_registry: ConceptRegistry, callback=None, level=0):
+        if isinstance(component, Executable):
+            output_concept: Concept = await component.arun(concept_registry, callback)
+            output_concept.level = level
+            concept_registry.update_concepts(output_concept)
+            level += 1
+        elif isinstance(component, ExecutableOrchestrator):
+            concept_registry, level = await component._arun(concept_registry, callback, level=level)
+        return concept_registry, level
+
+    def _check_streamable(self):
+        last = self.components[-1] if self.components else None
+        if isinstance(last, Chain):
+            last._check_streamable()
+        elif not isinstance(last, ProbabilisticComponent):
+            raise TypeError(f'Only a Chain ending in a ProbabilisticComponent can be streamed, this one ends in '
+                            f'{type(last).__name__}')
+
+    def stream(self, concept_registry: ConceptRegistry, callback=None, level=0) -> Iterator[StrictStr]:
+        # runs every step but the last as usual, then yields the last step's response while it is generated
+        self._check_streamable()
+        for component in self.components[:-1]:
+            concept_registry, level = self._run_step(component, concept_registry, callback, level)
+
+        last = self.components[-1]
+        if isinstance(last, Chain):
+            yield from last.stream(concept_registry, callback, level)
+        else:
+            output_concept: Concept = yield from last.stream(concept_registry, callback)
+            output_concept.level = level
+            concept_registry.update_concepts(output_concept)
+
+    async def astream(self, concept_registry: ConceptRegistry, callback=None, level=0) -> AsyncIterator[StrictStr]:
+        self._check_streamable()
+        for component in self.components[:-1]:
+            concept_registry, level = await self._arun_step(component, concept_registry, callback, level)
+
+        last = self.components[-1]
+        if isinstance(last, Chain):
+            async for chunk in last.astream(concept_registry, callback, level):
+                yield chunk
+        else:
+            outputs = []
+            async for chunk in last.astream(concept_registry, callback, outputs):
+                yield chunk
+            output_concept = outputs[0]
+            output_concept.level = level
+            concept_registry.update_concepts(output_concept)
+
+    async def _arun(self, concept_registry: ConceptRegistry, callback=None, level=0):
+        LOGGER.debug('Running object: %s', self.__dict__)
+
+        with tracing.traced('orchestrator', 'Chain', size=len(self.components)):
+            for component in self.components:
+                concept_registry, level = await self._arun_step(component, concept_registry, callback, level)
 
         return concept_registry, level
 
-    def run(self, concept_registry: ConceptRegistry, callback=None, level=0):
+    def run(self, concept_registry: ConceptRegistry, callback=None, level=0, targets: Optional[List[StrictStr]] = None):
+        if targets is not None:
+            return self._targeted(targets).run(concept_registry, callback)
         return self._run(concept_registry, callback, level)[0]
 
 
 class Threads(ExecutableOrchestrator):
-    def __init__(self, components: List[Union[Executable, ExecutableOrchestrator]] = None):
+    max_workers: Optional[int] = None
+
+    def __init__(self, components: List[Union[Executable, ExecutableOrchestrator]] = None,
+                 max_workers: Optional[int] = None):
+        # max_workers=None keeps the sequential behaviour, otherwise the components run in a thread pool
+        if max_workers is not None and max_workers < 1:
+            raise ValueError(f'max_workers must be a positive integer, got {max_workers}')
         super().__init__(components)
+        self.max_workers = max_workers
 
-    # later add async
     # @validate_call
     def _run(self, concept_registry: ConceptRegistry, callback=None, level=0):
-        LOGGER.debug(f'Running object: {self.__dict__}')
+        LOGGER.debug('Running object: %s', self.__dict__)
+
+        with tracing.traced('orchestrator', 'Threads', size=len(self.components)):
+            if self.max_workers is not None:
+                return self._run_concurrently(concept_registry, callback, level)
 
-        # TODO this will run asyncronously all together at some point
+            level += 1
+            outputted_concepts_list = list()
+            for component in self.components:
+                if isinstance(component, Executable):
+                    output_concept: Concept = component.run(concept_registry, callback)
+                    output_concept.level = level
+                    outputted_concepts_list.append(output_concept)
+
+                elif isinstance(component, ExecutableOrchestrator):
+                    concept_registry, level = component._run(concept_registry, callback, level=level)
+
+            for concept in outputted_concepts_list:
+                concept_registry.update_concepts(concept)
+
+            return concept_registry, level
+
+    def run(self, concept_registry: ConceptRegistry, callback=None, level=0, targets: Optional[List[StrictStr]] = None):
+        if targets is not None:
+            return self._targeted(targets).run(concept_registry, callback)
+        return self._run(concept_registry, callback, level)[0]
+
+    def _run_concurrently(self, concept_registry: ConceptRegistry, callback=None, level=0):
         level += 1
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='lexflow-threads') as executor:
+            futures = []
+            for component in self.components:
+                if isinstance(component, Executable):
+                    futures.append(tracing.submit(executor, component.run, concept_registry, callback))
+                elif isinstance(component, ExecutableOrchestrator):
+                    # nested orchestrators write into the registry, so each one gets its own copy
+                    futures.append(tracing.submit(executor, component._run, concept_registry.copy(), callback,
+                                                  level=level))
+
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = [future for future in futures if future in done and future.exception() is not None]
+            if failed:
+                for future in not_done:
+                    future.cancel()
+                raise failed[0].exception()
+
+        return self._merge_branches(concept_registry, [future.result() for future in futures], level)
+
+    async def _arun(self, concept_registry: ConceptRegistry, callback=None, level=0):
+        LOGGER.debug('Running object: %s', self.__dict__)
+
+        with tracing.traced('orchestrator', 'Threads', size=len(self.components)):
+            level += 1
+            # max_workers bounds the number of branches awaiting at once, like the thread pool does
+            semaphore = asyncio.Semaphore(self.max_workers) if self.max_workers is not None else None
+            coroutines = []
+            for component in self.components:
+                if isinstance(component, Executable):
+                    coroutines.append(_bounded(semaphore, component.arun(concept_registry, callback)))
+                elif isinstance(component, ExecutableOrchestrator):
+                    coroutines.append(_bounded(semaphore,
+                                               component._arun(concept_registry.copy(), callback, level=level)))
+
+            results = await _gather_or_cancel(coroutines)
+            return self._merge_branches(concept_registry, results, level)
+
+    def _merge_branches(self, concept_registry: ConceptRegistry, results: List, level: int):
+        # same order as the sequential run: orchestrator outputs first, then the deferred component outputs
         outputted_concepts_list = list()
-        for component in self.components:
+        branch_level = level
+        for component, result in zip(self.components, results):
             if isinstance(component, Executable):
-                output_concept: Concept = component.run(concept_registry, callback)
-                output_concept.level = level
-                outputted_concepts_list.append(output_concept)
-
-            elif isinstance(component, ExecutableOrchestrator):
-                concept_registry, level = component._run(concept_registry, callback, level=level)
+                result.level = level
+                outputted_concepts_list.append(result)
+            else:
+                branch_registry, returned_level = result
+                for name, concept in branch_registry.concepts.items():
+                    if concept_registry.concepts.get(name) is not concept:
+                        concept_registry.update_concepts(concept)
+                branch_level = max(branch_level, returned_level)
 
         for concept in outputted_concepts_list:
             concept_registry.update_concepts(concept)
 
-        return concept_registry, level
+        return concept_registry, branch_level
@@ -0,0 +1,209 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Sequence, Tuple, Union
+import asyncio
+import logging
+
+from . import tracing
+from .executable import (Concept, ConceptRegistry, Executable, ExecutableOrchestrator, Chain, Threads,
+                         _bounded, _gather_or_cancel)
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class GraphNode:
+    index: int
+    component: Executable
+    level: int
+    # input concept name -> index of the node producing it, None when it is read from the initial registry
+    dependencies: Dict[str, Optional[int]] = field(default_factory=dict)
+
+    @property
+    def producers(self) -> List[int]:
+        return sorted({producer for producer in self.dependencies.values() if producer is not None})
+
+    def view(self, concept_registry: ConceptRegistry, outputs: List[Concept]) -> ConceptRegistry:
+        # the registry as this node would see it in a sequential run
+        view = concept_registry.copy()
+        for name, producer in self.dependencies.items():
+            if producer is not None:
+                view.concepts[name] = outputs[producer]
+        return view
+
+
+@dataclass
+class ExecutionGraph:
+    nodes: List[GraphNode]
+    # order in which outputs are written back to the registry, mirrors the order of a sequential run
+    commit_order: List[int]
+
+    @property
+    def external_inputs(self) -> List[str]:
+        names = []
+        for node in self.nodes:
+            for name, producer in node.dependencies.items():
+                if producer is None and name not in names:
+                    names.append(name)
+        return names
+
+    def commit(self, concept_registry: ConceptRegistry, outputs: List[Concept]) -> ConceptRegistry:
+        for index in self.commit_order:
+            outputs[index].level = self.nodes[index].level
+            concept_registry.update_concepts(outputs[index])
+        return concept_registry
+
+    def critical_path_length(self) -> int:
+        depth = []
+        for node in self.nodes:
+            depth.append(1 + max((depth[producer] for producer in node.producers), default=0))
+        return max(depth, default=0)
+
+
+def compile_graph(root: Union[Executable, ExecutableOrchestrator]) -> ExecutionGraph:
+    nodes: List[GraphNode] = []
+    if isinstance(root, Executable):
+        commit_order, _ = _add_component(root, {}, 0, nodes)
+    else:
+        commit_order, _ = _walk(root, {}, 0, nodes)
+    return ExecutionGraph(nodes=nodes, commit_order=commit_order)
+
+
+def prune_graph(graph: ExecutionGraph, targets: Sequence[str]) -> Tuple[ExecutionGraph, List[str]]:
+    # keeps only the nodes the targets transitively depend on. Returns the pruned graph and the outputs of the
+    # nodes that were dropped
+    producers = {}
+    for index in graph.commit_order:
+        # the producer committed last is the one whose value ends up in the registry
+        producers[graph.nodes[index].component.output_name()] = index
+    external_inputs = graph.external_inputs
+    unknown = [name for name in targets if name not in producers and name not in external_inputs]
+    if unknown:
+        raise ValueError(f'Unknown targets {unknown}, the pipeline produces {list(producers)} and reads '
+                         f'{external_inputs}')
+
+    keep = set()
+    pending = [producers[name] for name in targets if name in producers]
+    while pending:
+        index = pending.pop()
+        if index not in keep:
+            keep.add(index)
+            pending.extend(graph.nodes[index].producers)
+
+    kept = sorted(keep)
+    renumbered = {old: new for new, old in enumerate(kept)}
+    nodes = [GraphNode(index=renumbered[old], component=graph.nodes[old].component, level=graph.nodes[old].level,
+                       dependencies={name: None if producer is None else renumbered[producer]
+                                     for name, producer in graph.nodes[old].dependencies.items()})
+             for old in kept]
+    commit_order = [renumbered[index] for index in graph.commit_order if index in keep]
+    skipped = [node.component.output_name() for node in graph.nodes if node.index not in keep]
+    return ExecutionGraph(nodes=nodes, commit_order=commit_order), skipped
+
+
+def _add_component(component: Executable, scope: Dict[str, int], level: int, nodes: List[GraphNode]):
+    if not hasattr(component, 'input_names'):
+        raise TypeError(f'Cannot infer the inputs and output of {type(component).__name__}')
+    node = GraphNode(index=len(nodes), component=component, level=level,
+                     dependencies={name: scope.get(name) for name in component.input_names()})
+    nodes.append(node)
+    return [node.index], node
+
+
+def _walk(orchestrator: ExecutableOrchestrator, scope: Dict[str, int], level: int, nodes: List[GraphNode]):
+    # scope maps every concept name produced so far to its latest producer and is updated in place
+    if isinstance(orchestrator, Chain):
+        commits = []
+        for component in orchestrator.components:
+            if isinstance(component, Executable):
+                added, node = _add_component(component, scope, level, nodes)
+                scope[component.output_name()] = node.index
+                level += 1
+            else:
+                added, level = _walk(component, scope, level, nodes)
+            commits.extend(added)
+        return commits, level
+
+    if isinstance(orchestrator, Threads):
+        # branches are independent: each one only sees what existed before the Threads started
+        level += 1
+        snapshot = dict(scope)
+        branch_level = level
+        branch_commits, component_commits = [], []
+        for component in orchestrator.components:
+            if isinstance(component, Executable):
+                added, _ = _add_component(component, snapshot, level, nodes)
+                component_commits.extend(added)
+            else:
+                branch_scope = dict(snapshot)
+                added, returned_level = _walk(component, branch_scope, level, nodes)
+                branch_commits.extend(added)
+                branch_level = max(branch_level, returned_level)
+        for index in branch_commits + component_commits:
+            scope[nodes[index].component.output_name()] = index
+        return branch_commits + component_commits, branch_level
+
+    raise TypeError(f'Cannot compile orchestrator of type {type(orchestrator).__name__} into a graph')
+
+
+class GraphExecutor:
+    def __init__(self, root: Union[Executable, ExecutableOrchestrator], max_concurrency: int = 8,
+                 targets: Optional[Sequence[str]] = None):
+        # with targets, only the components those concepts depend on run, the others are listed in skipped
+        if max_concurrency < 1:
+            raise ValueError(f'max_concurrency must be a positive integer, got {max_concurrency}')
+        self.graph = compile_graph(root)
+        self.skipped: List[str] = []
+        if targets is not None:
+            self.graph, self.skipped = prune_graph(self.graph, targets)
+        self.max_concurrency = max_concurrency
+
+    def run(self, concept_registry: ConceptRegistry, callback=None) -> ConceptRegistry:
+        nodes = self.graph.nodes
+        outputs: List[Optional[Concept]] = [None] * len(nodes)
+        waiting_on = {node.index: len(node.producers) for node in nodes}
+        dependents = {node.index: [] for node in nodes}
+        for node in nodes:
+            for producer in node.producers:
+                dependents[producer].append(node.index)
+
+        with tracing.traced('pipeline', 'GraphExecutor', size=len(nodes)), \
+                ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='lexflow-graph') as executor:
+            def submit(node):
+                return tracing.submit(executor, node.component.run, node.view(concept_registry, outputs), callback)
+
+            running = {submit(node): node.index for node in nodes if waiting_on[node.index] == 0}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    if future.exception() is not None:
+                        for other in running:
+                            other.cancel()
+                        raise future.exception()
+                    outputs[index] = future.result()
+                    for dependent in dependents[index]:
+                        waiting_on[dependent] -= 1
+                        if waiting_on[dependent] == 0:
+                            running[submit(nodes[dependent])] = dependent
+
+        return self.graph.commit(concept_registry, outputs)
+
+    async def arun(self, concept_registry: ConceptRegistry, callback=None) -> ConceptRegistry:
+        nodes = self.graph.nodes
+        outputs: List[Optional[Concept]] = [None] * len(nodes)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = []
+
+        async def run_node(node: GraphNode):
+            # producers always have a lower index, so their tasks already exist
+            await asyncio.gather(*[tasks[producer] for producer in node.producers])
+            outputs[node.index] = await _bounded(
+                semaphore, node.component.arun(node.view(concept_registry, outputs), callback))
+
+        with tracing.traced('pipeline', 'GraphExecutor', size=len(nodes)):
+            for node in nodes:
+                tasks.append(asyncio.ensure_future(run_node(node)))
+            await _gather_or_cancel(tasks)
+
+        return self.graph.commit(concept_registry, outputs)
@@ -0,0 +1,104 @@
+from dataclasses import dataclass, field
+from typing import List, Optional, Union
+import json
+import logging
+
+from . import tracing
+from .cache import LRUCache, ResponseCache, make_cache_key
+from .executable import Concept, ConceptRegistry, Executable, ExecutableOrchestrator
+from .lazy import LazyText
+from .plan import CompiledPipeline, PlanStep, compile_pipeline
+from .serialization import dump_concept, load_concept
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class IncrementalReport:
+    reused: List[str] = field(default_factory=list)
+    recomputed: List[str] = field(default_factory=list)
+
+
+def _input_state(concept: Concept) -> List:
+    # the raw content rather than get_value, which is random for choice='random'. Files are identified by their
+    # fingerprint, so they are not read just to find out nothing changed
+    content = concept.string_content
+    if isinstance(content, LazyText):
+        content = content.fingerprint()
+    return [concept.type, concept.choice, concept.index, content, concept.list_content]
+
+
+class IncrementalPipeline:
+    # runs a compiled plan, fingerprinting every step from what it computes and the values of its inputs. A
+    # step whose fingerprint was seen before gets the recorded output instead of running, so after changing one
+    # initial concept only the steps whose inputs actually changed run again. Outputs are kept in `cache`, any
+    # ResponseCache, e.g. a SQLiteCache to reuse them across processes. Pass an IncrementalReport to run or arun to
+    # find out which steps were reused, each call fills in its own
+    def __init__(self, pipeline: Union[Executable, ExecutableOrchestrator, CompiledPipeline],
+                 cache: Optional[ResponseCache] = None):
+        self.plan = pipeline if isinstance(pipeline, CompiledPipeline) else compile_pipeline(pipeline)
+        self.cache = cache if cache is not None else LRUCache(max_entries=max(1024, 8 * len(self.plan.steps)))
+        # steps that can't be fingerprinted always run
+        self._fingerprints = [step.component.fingerprint() if hasattr(step.component, 'fingerprint') else None
+                              for step in self.plan.steps]
+
+    def _key(self, index: int, step: PlanStep, slots: List[Concept]) -> Optional[str]:
+        if self._fingerprints[index] is None:
+            return None
+        return make_cache_key(self._fingerprints[index], [_input_state(slots[slot]) for slot in step.input_slots],
+                              list(step.input_names))
+
+    def _reuse(self, key: Optional[str], step: PlanStep, report: IncrementalReport) -> Optional[Concept]:
+        if key is None:
+            return None
+        stored = self.cache.get(key)
+        if stored is None:
+            return None
+        report.reused.append(step.component.output_name())
+        return load_concept(json.loads(stored), step.output_template())
+
+    def _record(self, key: Optional[str], step: PlanStep, output_concept: Concept,
+                report: IncrementalReport) -> Concept:
+        output_concept.level = step.level
+        if key is not None:
+            self.cache.set(key, json.dumps(dump_concept(output_concept, strict=False)))
+        report.recomputed.append(step.component.output_name())
+        return output_concept
+
+    def run(self, concept_registry: ConceptRegistry, callback=None,
+            report: Optional[IncrementalReport] = None) -> ConceptRegistry:
+        slots = self.plan._load(concept_registry)
+        report = report if report is not None else IncrementalReport()
+
+        def execute(index: int, step: PlanStep) -> Concept:
+            key = self._key(index, step, slots)
+            output_concept = self._reuse(key, step, report)
+            if output_concept is None:
+                output_concept = self._record(key, step, step.execute(slots, concept_registry, callback), report)
+            return output_concept
+
+        with tracing.traced('pipeline', 'IncrementalPipeline', size=len(self.plan.steps)) as span:
+            self.plan.schedule(slots, execute)
+            if span is not None:
+                span.attributes.update(reused=len(report.reused), recomputed=len(report.recomputed))
+        LOGGER.debug('Reused %s, recomputed %s', report.reused, report.recomputed)
+        return self.plan._commit(concept_registry, slots)
+
+    async def arun(self, concept_registry: ConceptRegistry, callback=None,
+                   report: Optional[IncrementalReport] = None) -> ConceptRegistry:
+        slots = self.plan._load(concept_registry)
+        report = report if report is not None else IncrementalReport()
+
+        async def execute(index: int, step: PlanStep) -> Concept:
+            key = self._key(index, step, slots)
+            output_concept = self._reuse(key, step, report)
+            if output_concept is None:
+                output_concept = self._record(key, step, await step.aexecute(slots, concept_registry, callback),
+                                              report)
+            return output_concept
+
+        with tracing.traced('pipeline', 'IncrementalPipeline', size=len(self.plan.steps)) as span:
+            await self.plan.aschedule(slots, execute)
+            if span is not None:
+                span.attributes.update(reused=len(report.reused), recomputed=len(report.recomputed))
+        return self.plan._commit(concept_registry, slots)
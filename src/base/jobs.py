@@ -0,0 +1,461 @@
+# Runs pipelines on worker processes, on this machine or on any machine that can open the queue:
+#
+#     python -m base.jobs --queue jobs.db --processes 4 --cache-dir .lexflow-cache
+#
+#     executor = DistributedExecutor(SQLiteJobQueue('jobs.db'))
+#     run_id = executor.submit(chain, [{'subject': 'computer'}, {'subject': 'cat'}])
+#     rows = executor.results(run_id, timeout=600)
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from . import tracing
+from .batch import registry_to_row, row_value
+from .cache import make_cache_key
+from .executable import Concept, ConceptRegistry, Executable, ExecutableOrchestrator, LanguageModel
+from .plan import CompiledPipeline, compile_pipeline
+from .serialization import (dump_concept, load_concept, load_object, load_pipeline, pipeline_from_dict,
+                            pipeline_to_dict)
+
+LOGGER = logging.getLogger(__name__)
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+class JobFailedError(RuntimeError):
+    pass
+
+
+@dataclass
+class Job:
+    job_id: int
+    run_id: str
+    # the key of the serialized pipeline in the queue
+    pipeline: str
+    targets: Optional[List[str]]
+    # the initial concepts, and in result once done the concepts the run ended with, encoded like the concepts
+    # of a pipeline file, so index, choice and listify_func survive the trip
+    concepts: List[Dict]
+    status: str = PENDING
+    attempts: int = 0
+    worker: Optional[str] = None
+    result: Optional[List[Dict]] = None
+    error: Optional[str] = None
+
+
+class JobQueue(ABC):
+    # a claimed job is leased to its worker for `lease` seconds, and the worker renews the lease while it runs
+    # the job. A job whose lease ran out, because its worker died or lost the connection, goes to the next worker
+    # to claim a job, until it was claimed max_attempts times. Errors raised by the pipeline fail the job right
+    # away, transient model errors are for the components' resilience policies to retry
+    def __init__(self, lease: float = 60.0, max_attempts: int = 3):
+        if lease <= 0:
+            raise ValueError(f'lease must be positive, got {lease}')
+        if max_attempts < 1:
+            raise ValueError(f'max_attempts must be a positive integer, got {max_attempts}')
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+    @abstractmethod
+    def add_pipeline(self, key: str, data: Dict):
+        pass
+
+    @abstractmethod
+    def pipeline(self, key: str) -> Dict:
+        pass
+
+    @abstractmethod
+    def submit(self, run_id: str, pipeline: str, targets: Optional[List[str]], concepts: List[List[Dict]]) -> int:
+        # one job per list of initial concepts, returns the number of jobs added
+        pass
+
+    @abstractmethod
+    def claim(self, worker: str) -> Optional[Job]:
+        pass
+
+    @abstractmethod
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        # False once the job is no longer leased to the worker
+        pass
+
+    @abstractmethod
+    def complete(self, job_id: int, worker: str, result: List[Dict]) -> bool:
+        pass
+
+    @abstractmethod
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        pass
+
+    @abstractmethod
+    def jobs(self, run_id: str) -> List[Job]:
+        pass
+
+    @abstractmethod
+    def delete(self, run_id: str) -> int:
+        pass
+
+    def status(self, run_id: str) -> Dict[str, int]:
+        counts = dict.fromkeys((PENDING, RUNNING, DONE, FAILED), 0)
+        for job in self.jobs(run_id):
+            counts[job.status] += 1
+        return counts
+
+
+_COLUMNS = 'id, run_id, pipeline, targets, concepts, status, attempts, worker, result, error'
+
+
+class SQLiteJobQueue(JobQueue):
+    # every process opens the database itself, so the queue can be handed to worker processes. Workers on other
+    # machines need the file on a filesystem with working SQLite locking, otherwise implement JobQueue for a
+    # real broker
+    def __init__(self, path: str, lease: float = 60.0, max_attempts: int = 3):
+        super().__init__(lease, max_attempts)
+        self.path = path
+        self._lock = threading.RLock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        with self._transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS pipelines (key TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                               'run_id TEXT NOT NULL, pipeline TEXT NOT NULL, targets TEXT, concepts TEXT NOT NULL, '
+                               'status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, worker TEXT, '
+                               'lease_until REAL, result TEXT, error TEXT, submitted_at REAL, finished_at REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_run ON jobs (run_id)')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection inherited through fork is not safe to use, the child opens its own
+        if self._connection is None or self._pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # a commit lost to a power cut only sends its job around again once the lease runs out
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers never claim the same job
+        with self._lock:
+            connection = self._connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+
+    def add_pipeline(self, key: str, data: Dict):
+        with self._transaction() as connection:
+            connection.execute('INSERT OR IGNORE INTO pipelines VALUES (?, ?)', (key, json.dumps(data)))
+
+    def pipeline(self, key: str) -> Dict:
+        with self._lock:
+            row = self._connect().execute('SELECT data FROM pipelines WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(f'No pipeline {key!r} in the queue {self.path}')
+        return json.loads(row[0])
+
+    def submit(self, run_id: str, pipeline: str, targets: Optional[List[str]], concepts: List[List[Dict]]) -> int:
+        now = time.time()
+        targets = json.dumps(targets) if targets is not None else None
+        with self._transaction() as connection:
+            connection.executemany(
+                'INSERT INTO jobs (run_id, pipeline, targets, concepts, status, submitted_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(run_id, pipeline, targets, json.dumps(job_concepts), PENDING, now) for job_concepts in concepts])
+        return len(concepts)
+
+    def claim(self, worker: str) -> Optional[Job]:
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE jobs SET status = ?, error = 'Lost its worker ' || attempts || ' times', finished_at = ? "
+                'WHERE status = ? AND lease_until < ? AND attempts >= ?',
+                (FAILED, now, RUNNING, now, self.max_attempts))
+            row = connection.execute(f'SELECT {_COLUMNS} FROM jobs WHERE status = ? OR (status = ? AND '
+                                     'lease_until < ?) ORDER BY id LIMIT 1', (PENDING, RUNNING, now)).fetchone()
+            if row is None:
+                return None
+            job = _job(row)
+            if job.status == RUNNING:
+                LOGGER.warning('Job %d of run %s lost its worker %s, retrying it', job.job_id, job.run_id, job.worker)
+            connection.execute('UPDATE jobs SET status = ?, worker = ?, attempts = attempts + 1, lease_until = ? '
+                               'WHERE id = ?', (RUNNING, worker, now + self.lease, job.job_id))
+        job.status, job.worker, job.attempts = RUNNING, worker, job.attempts + 1
+        return job
+
+    def heartbeat(self, job_id: int, worker: str) -> bool:
+        with self._transaction() as connection:
+            return connection.execute('UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = ?',
+                                      (time.time() + self.lease, job_id, worker, RUNNING)).rowcount == 1
+
+    def _finish(self, job_id: int, worker: str, status: str, result: Optional[str], error: Optional[str]) -> bool:
+        # a worker whose lease ran out may still finish, its result is dropped if another worker took the job over
+        with self._transaction() as connection:
+            return connection.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, lease_until = NULL, finished_at = ? '
+                'WHERE id = ? AND worker = ? AND status = ?',
+                (status, result, error, time.time(), job_id, worker, RUNNING)).rowcount == 1
+
+    def complete(self, job_id: int, worker: str, result: List[Dict]) -> bool:
+        return self._finish(job_id, worker, DONE, json.dumps(result), None)
+
+    def fail(self, job_id: int, worker: str, error: str) -> bool:
+        return self._finish(job_id, worker, FAILED, None, error)
+
+    def jobs(self, run_id: str) -> List[Job]:
+        with self._lock:
+            rows = self._connect().execute(f'SELECT {_COLUMNS} FROM jobs WHERE run_id = ? ORDER BY id',
+                                           (run_id,)).fetchall()
+        return [_job(row) for row in rows]
+
+    def status(self, run_id: str) -> Dict[str, int]:
+        counts = dict.fromkeys((PENDING, RUNNING, DONE, FAILED), 0)
+        with self._lock:
+            rows = self._connect().execute('SELECT status, COUNT(*) FROM jobs WHERE run_id = ? GROUP BY status',
+                                           (run_id,)).fetchall()
+        counts.update(rows)
+        return counts
+
+    def delete(self, run_id: str) -> int:
+        with self._transaction() as connection:
+            return connection.execute('DELETE FROM jobs WHERE run_id = ?', (run_id,)).rowcount
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+
+    def __reduce__(self):
+        return SQLiteJobQueue, (self.path, self.lease, self.max_attempts)
+
+
+def _job(row: Tuple) -> Job:
+    job_id, run_id, pipeline, targets, concepts, status, attempts, worker, result, error = row
+    return Job(job_id, run_id, pipeline, json.loads(targets) if targets is not None else None, json.loads(concepts),
+               status, attempts, worker, json.loads(result) if result is not None else None, error)
+
+
+def _initial_concepts(position: int, row: Union[Dict, ConceptRegistry]) -> List[Dict]:
+    if isinstance(row, ConceptRegistry):
+        concepts = row.concepts.values()
+    else:
+        values = {name: row_value(position, name, value) for name, value in row.items()}
+        concepts = [Concept(name=name, type='list', list_content=value) if isinstance(value, list)
+                    else Concept(name=name, string_content=value) for name, value in values.items()]
+    return [dump_concept(concept) for concept in concepts]
+
+
+class DistributedExecutor:
+    # submits pipeline runs to a JobQueue, one job per row, and collects their results by run id. The pipeline
+    # travels in its serialized form, workers only need the models it names
+    def __init__(self, queue: JobQueue, poll_interval: float = 0.1):
+        self.queue = queue
+        self.poll_interval = poll_interval
+
+    def submit(self, pipeline: Union[Executable, ExecutableOrchestrator], rows, run_id: Optional[str] = None,
+               targets: Optional[Sequence[str]] = None) -> str:
+        # rows are {concept name: value} dicts, ConceptRegistries or anything with iterrows. A single component
+        # is a pipeline too
+        compile_pipeline(pipeline, targets=targets)
+        data = pipeline_to_dict(pipeline)
+        key = make_cache_key(data)
+        self.queue.add_pipeline(key, data)
+        run_id = run_id if run_id is not None else uuid.uuid4().hex
+        if hasattr(rows, 'iterrows'):
+            rows = (row.to_dict() for _, row in rows.iterrows())
+        concepts = [_initial_concepts(position, row) for position, row in enumerate(rows)]
+        count = self.queue.submit(run_id, key, list(targets) if targets is not None else None, concepts)
+        LOGGER.info('Submitted %d jobs as run %s', count, run_id)
+        return run_id
+
+    def status(self, run_id: str) -> Dict[str, int]:
+        return self.queue.status(run_id)
+
+    def wait(self, run_id: str, timeout: Optional[float] = None) -> List[Job]:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            status = self.queue.status(run_id)
+            if not any(status.values()):
+                raise KeyError(f'No jobs for run {run_id!r}')
+            if not status[PENDING] and not status[RUNNING]:
+                return self.queue.jobs(run_id)
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f'Run {run_id!r} not finished after {timeout}s: {status}')
+            time.sleep(self.poll_interval)
+
+    def results(self, run_id: str, timeout: Optional[float] = None) -> List[Dict[str, Union[str, List[str], None]]]:
+        # the rows in submission order, like run_batch
+        jobs = self.wait(run_id, timeout)
+        failed = [job for job in jobs if job.status == FAILED]
+        if failed:
+            raise JobFailedError(f'{len(failed)} of {len(jobs)} jobs of run {run_id!r} failed, job '
+                                 f'{failed[0].job_id}: {failed[0].error}')
+        return [registry_to_row(ConceptRegistry([load_concept(data) for data in job.result])) for job in jobs]
+
+
+class Worker:
+    # pulls jobs off a queue and runs them with the pipeline's own run, one at a time; run more workers, or
+    # processes with start_workers, to use more cores. Model names can be mapped to local instances with
+    # `models`, and with cache_dir pipelines are loaded through load_pipeline's cache, so a restarted worker
+    # doesn't validate them again
+    def __init__(self, queue: JobQueue, models: Optional[Dict[str, LanguageModel]] = None,
+                 cache_dir: Optional[str] = None, poll_interval: float = 0.5, worker_id: Optional[str] = None):
+        self.queue = queue
+        self.models = models
+        self.cache_dir = cache_dir
+        self.poll_interval = poll_interval
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.completed = 0
+        self.failed = 0
+        self._roots: Dict[str, Union[Executable, ExecutableOrchestrator]] = {}
+        self._plans: Dict[Tuple, CompiledPipeline] = {}
+        self._current: Optional[Job] = None
+        self._stopped = threading.Event()
+
+    def _load(self, key: str) -> Union[Executable, ExecutableOrchestrator]:
+        data = self.queue.pipeline(key)
+        if self.cache_dir is None:
+            return pipeline_from_dict(data, self.models)
+        path = os.path.join(self.cache_dir, f'{key}.json')
+        if not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temporary = f'{path}.{os.getpid()}.tmp'
+            with open(temporary, 'w') as file:
+                json.dump(data, file)
+            os.replace(temporary, path)
+        return load_pipeline(path, models=self.models, cache_dir=self.cache_dir)
+
+    def _plan(self, job: Job) -> CompiledPipeline:
+        key = (job.pipeline, tuple(job.targets) if job.targets is not None else None)
+        plan = self._plans.get(key)
+        if plan is None:
+            root = self._roots.get(job.pipeline)
+            if root is None:
+                root = self._roots[job.pipeline] = self._load(job.pipeline)
+            plan = self._plans[key] = compile_pipeline(root, targets=job.targets)
+        return plan
+
+    def _execute(self, job: Job):
+        try:
+            with tracing.traced('job', 'Worker', run_id=job.run_id, job_id=job.job_id, attempt=job.attempts):
+                registry = ConceptRegistry([load_concept(data) for data in job.concepts])
+                registry = self._plan(job).run(registry)
+        except Exception as e:
+            LOGGER.warning('Job %d of run %s failed: %s: %s', job.job_id, job.run_id, type(e).__name__, e)
+            self.failed += 1
+            self.queue.fail(job.job_id, self.worker_id, f'{type(e).__name__}: {e}')
+            return
+        self.completed += 1
+        if not self.queue.complete(job.job_id, self.worker_id, [dump_concept(concept)
+                                                                for concept in registry.concepts.values()]):
+            LOGGER.warning('Job %d of run %s was taken over by another worker, dropping its result', job.job_id,
+                           job.run_id)
+
+    def _heartbeats(self):
+        while not self._stopped.wait(self.queue.lease / 3):
+            job = self._current
+            if job is not None and not self.queue.heartbeat(job.job_id, self.worker_id):
+                LOGGER.warning('Lost the lease on job %d of run %s', job.job_id, job.run_id)
+
+    def run(self, max_jobs: Optional[int] = None, idle_timeout: Optional[float] = None) -> int:
+        # until stop() is called, max_jobs were run or no job showed up for idle_timeout seconds. Returns the
+        # number of jobs run
+        self._stopped.clear()
+        heartbeats = threading.Thread(target=self._heartbeats, name='lexflow-heartbeat', daemon=True)
+        heartbeats.start()
+        count = 0
+        idle_since = time.monotonic()
+        try:
+            while not self._stopped.is_set() and (max_jobs is None or count < max_jobs):
+                job = self.queue.claim(self.worker_id)
+                if job is None:
+                    if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                        break
+                    self._stopped.wait(self.poll_interval)
+                    continue
+                self._current = job
+                try:
+                    self._execute(job)
+                finally:
+                    self._current = None
+                count += 1
+                idle_since = time.monotonic()
+        finally:
+            self._stopped.set()
+            heartbeats.join()
+        return count
+
+    def stop(self):
+        # the job in progress is finished first
+        self._stopped.set()
+
+
+def _work(queue: JobQueue, options: Dict):
+    options = dict(options)
+    idle_timeout = options.pop('idle_timeout', None)
+    try:
+        Worker(queue, **options).run(idle_timeout=idle_timeout)
+    except KeyboardInterrupt:
+        pass
+
+
+def start_workers(queue: JobQueue, processes: int, idle_timeout: Optional[float] = None,
+                  **options) -> List[multiprocessing.Process]:
+    # the options are passed to Worker, the queue and them have to be picklable where processes are spawned
+    if processes < 1:
+        raise ValueError(f'processes must be a positive integer, got {processes}')
+    workers = []
+    for index in range(processes):
+        process = multiprocessing.Process(target=_work, args=(queue, {**options, 'idle_timeout': idle_timeout}),
+                                          name=f'lexflow-worker-{index}', daemon=True)
+        process.start()
+        workers.append(process)
+    return workers
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Run pipeline jobs from a queue')
+    parser.add_argument('--queue', required=True, help='path of the SQLite job queue')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--models', metavar='MODULE:ATTRIBUTE', help='a dict of model name to LanguageModel to use '
+                                                                     'instead of the models the pipelines describe')
+    parser.add_argument('--cache-dir', help='where pipelines are cached for faster start-up')
+    parser.add_argument('--lease', type=float, default=60.0, help='seconds before a silent worker\'s job is retried')
+    parser.add_argument('--max-attempts', type=int, default=3)
+    parser.add_argument('--poll-interval', type=float, default=0.5)
+    parser.add_argument('--idle-timeout', type=float, help='exit after this many seconds without jobs')
+    options = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    queue = SQLiteJobQueue(options.queue, options.lease, options.max_attempts)
+    worker_options = {'models': load_object(options.models) if options.models else None,
+                      'cache_dir': options.cache_dir, 'poll_interval': options.poll_interval}
+    if options.processes == 1:
+        _work(queue, {**worker_options, 'idle_timeout': options.idle_timeout})
+        return
+    workers = start_workers(queue, options.processes, options.idle_timeout, **worker_options)
+    try:
+        for process in workers:
+            process.join()
+    except KeyboardInterrupt:
+        for process in workers:
+            process.terminate()
+
+
+if __name__ == '__main__':
+    main()
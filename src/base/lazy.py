@@ -0,0 +1,172 @@
+from typing import Any, Iterator, List, Optional
+import mmap
+import os
+import threading
+
+from pydantic_core import core_schema
+
+
+class _MappedFile:
+    # one read-only memory map per LazyText and all the views sliced from it, opened on the first read
+    def __init__(self, path: str):
+        self.path = path
+        self._map: Optional[mmap.mmap] = None
+        self._lock = threading.Lock()
+
+    def _mapped(self) -> mmap.mmap:
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    with open(self.path, 'rb') as file:
+                        self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def read(self, start: int, end: int) -> bytes:
+        if start == end:
+            return b''
+        return self._mapped()[start:end]
+
+    def find(self, sub: bytes, start: int, end: int) -> int:
+        return self._mapped().find(sub, start, end)
+
+    def byte(self, position: int) -> int:
+        return self._mapped()[position]
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+
+class LazyText:
+    # a concept value backed by a byte range of a file. Nothing is read until the text is needed, i.e. when a
+    # prompt using it is rendered, and repr, memory and logs show the file and the size instead of the text.
+    # Offsets are in bytes, for UTF-8 files slices and windows are moved to the next character boundary
+    __slots__ = ('path', 'start', 'end', 'encoding', '_source')
+
+    def __init__(self, path: str, start: int = 0, end: Optional[int] = None, encoding: str = 'utf-8'):
+        path = os.fspath(path)
+        size = os.path.getsize(path)
+        end = size if end is None else min(end, size)
+        if not 0 <= start <= end:
+            raise ValueError(f'Invalid byte range {start}:{end} of {path}, which has {size} bytes')
+        self._set(path, start, end, encoding, _MappedFile(path))
+
+    def _set(self, path: str, start: int, end: int, encoding: str, source: _MappedFile):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.encoding = encoding
+        self._source = source
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+    def read(self) -> str:
+        return self._source.read(self.start, self.end).decode(self.encoding)
+
+    def _boundary(self, position: int) -> int:
+        # skips UTF-8 continuation bytes so a view never starts or ends inside a character
+        if self.encoding.replace('-', '').lower() == 'utf8':
+            while position < self.end and self._source.byte(position) & 0xC0 == 0x80:
+                position += 1
+        return position
+
+    def slice(self, start: int = 0, end: Optional[int] = None) -> 'LazyText':
+        # start and end are byte offsets into this view
+        end = self.size if end is None else min(end, self.size)
+        if not 0 <= start <= end:
+            raise ValueError(f'Invalid byte range {start}:{end} of a view of {self.size} bytes')
+        view = LazyText.__new__(LazyText)
+        view._set(self.path, self._boundary(self.start + start), self._boundary(self.start + end), self.encoding,
+                  self._source)
+        return view
+
+    def windows(self, size: int, overlap: int = 0) -> Iterator['LazyText']:
+        if size < 1:
+            raise ValueError(f'size must be a positive integer, got {size}')
+        if not 0 <= overlap < size:
+            raise ValueError(f'overlap must be at least 0 and smaller than size, got {overlap}')
+        start = 0
+        while True:
+            window = self.slice(start, start + size)
+            yield window
+            if window.end >= self.end:
+                return
+            start = max(window.end - self.start - overlap, start + 1)
+
+    def lines(self) -> Iterator[str]:
+        # decodes one line at a time, for views too large to split in one go
+        position = self.start
+        while position < self.end:
+            newline = self._source.find(b'\n', position, self.end)
+            stop = self.end if newline == -1 else newline
+            yield self._source.read(position, stop).decode(self.encoding)
+            position = stop + 1
+
+    def fingerprint(self) -> List:
+        # identifies the content without reading it, changes whenever the file is modified
+        stat = os.stat(self.path)
+        return [self.path, self.start, self.end, self.encoding, stat.st_size, stat.st_mtime_ns]
+
+    def to_dict(self) -> dict:
+        return {'path': self.path, 'start': self.start, 'end': self.end, 'encoding': self.encoding}
+
+    def close(self):
+        # unmaps the file for this view and every view sliced from it, they map it again when read
+        self._source.close()
+
+    def __getitem__(self, item) -> 'LazyText':
+        if not isinstance(item, slice) or item.step not in (None, 1):
+            raise TypeError('LazyText only supports byte slices without a step, e.g. text[:4096]')
+        return self.slice(item.start or 0, item.stop)
+
+    def __str__(self) -> str:
+        return self.read()
+
+    def __format__(self, format_spec: str) -> str:
+        return format(self.read(), format_spec)
+
+    def __bool__(self) -> bool:
+        return self.end > self.start
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, LazyText):
+            return NotImplemented
+        return (self.path, self.start, self.end, self.encoding) == (other.path, other.start, other.end, other.encoding)
+
+    def __hash__(self) -> int:
+        return hash((self.path, self.start, self.end, self.encoding))
+
+    def __reduce__(self):
+        return LazyText, (self.path, self.start, self.end, self.encoding)
+
+    def __repr__(self) -> str:
+        return f'LazyText({self.path!r}, {self.start}:{self.end}, {_human_size(self.size)})'
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source: Any, handler) -> core_schema.CoreSchema:
+        return core_schema.is_instance_schema(cls)
+
+
+def _human_size(size: int) -> str:
+    if size < 1024:
+        return f'{size} B'
+    if size < 1 << 20:
+        return f'{size / 1024:.1f} KiB'
+    return f'{size / (1 << 20):.1f} MiB'
+
+
+class RenderedPrompt(str):
+    # a filled prompt with file-backed values in it. It is the full text for the model, `reference` is the
+    # same prompt with those values replaced by their repr, which is what model memory keeps
+    def __new__(cls, text: str, reference: str):
+        prompt = super().__new__(cls, text)
+        prompt.reference = reference
+        return prompt
+
+
+def compact_prompt(prompt_string: str) -> str:
+    return prompt_string.reference if type(prompt_string) is RenderedPrompt else prompt_string
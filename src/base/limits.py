@@ -0,0 +1,200 @@
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from typing import Dict, Optional
+import asyncio
+import logging
+import threading
+import time
+
+from .accounting import estimate_tokens
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _TokenBucket:
+    # reservation based: a request takes its share straight away and waits for the deficit to refill. Requests
+    # reserve in arrival order, so waiting is first come first served
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / self.rate
+
+
+class _AsyncWaiter:
+    __slots__ = ('loop', 'future')
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+    def set(self):
+        self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class RateLimiter:
+    def __init__(self, name: str, max_in_flight: Optional[int] = None, requests_per_second: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        if max_in_flight is not None and max_in_flight < 1:
+            raise ValueError(f'max_in_flight must be a positive integer, got {max_in_flight}')
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self._requests = _TokenBucket(requests_per_second, requests_per_second) if requests_per_second else None
+        self._tokens = _TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+
+        self._lock = threading.Lock()
+        # waiters for an in-flight slot, threading.Event for threads and _AsyncWaiter for tasks, in arrival order
+        self._waiters = deque()
+        self._in_flight = 0
+        self._queued = 0
+        self._acquired = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @property
+    def counts_tokens(self) -> bool:
+        return self._tokens is not None
+
+    def _try_acquire_slot(self, waiter) -> bool:
+        with self._lock:
+            self._queued += 1
+            if self.max_in_flight is None or (self._in_flight < self.max_in_flight and not self._waiters):
+                self._in_flight += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _release_slot(self):
+        with self._lock:
+            if self._waiters:
+                # the slot is handed over directly, so a newcomer can't jump the queue
+                self._waiters.popleft().set()
+            else:
+                self._in_flight -= 1
+
+    def _reserve(self, tokens: int) -> float:
+        now = time.monotonic()
+        with self._lock:
+            delay = self._requests.reserve(1, now) if self._requests is not None else 0.0
+            if self._tokens is not None and tokens:
+                delay = max(delay, self._tokens.reserve(tokens, now))
+        return delay
+
+    def _record(self, waited: float):
+        with self._lock:
+            self._queued -= 1
+            self._acquired += 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+
+    def acquire(self, tokens: int = 0):
+        started = time.perf_counter()
+        waiter = threading.Event()
+        if not self._try_acquire_slot(waiter):
+            waiter.wait()
+        delay = self._reserve(tokens)
+        if delay:
+            time.sleep(delay)
+        self._record(time.perf_counter() - started)
+
+    async def acquire_async(self, tokens: int = 0):
+        started = time.perf_counter()
+        waiter = _AsyncWaiter()
+        if not self._try_acquire_slot(waiter):
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                with self._lock:
+                    granted = waiter not in self._waiters
+                    if not granted:
+                        self._waiters.remove(waiter)
+                    self._queued -= 1
+                if granted:
+                    self._release_slot()
+                raise
+        delay = self._reserve(tokens)
+        if delay:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                # the slot is held by now, the rate reservation is spent either way
+                with self._lock:
+                    self._queued -= 1
+                self._release_slot()
+                raise
+        self._record(time.perf_counter() - started)
+
+    def release(self):
+        self._release_slot()
+
+    @contextmanager
+    def limit(self, tokens: int = 0):
+        self.acquire(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def alimit(self, tokens: int = 0):
+        await self.acquire_async(tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {'in_flight': self._in_flight, 'queue_depth': self._queued, 'acquired': self._acquired,
+                    'total_wait': self._total_wait, 'max_wait': self._max_wait,
+                    'mean_wait': self._total_wait / self._acquired if self._acquired else 0.0}
+
+
+class LimiterRegistry:
+    # limiters keyed by provider (or model) name, shared by every LanguageModel with that key
+    def __init__(self):
+        self._limiters: Dict[str, RateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, key: str, max_in_flight: Optional[int] = None, requests_per_second: Optional[float] = None,
+                  tokens_per_minute: Optional[float] = None) -> RateLimiter:
+        limiter = RateLimiter(key, max_in_flight, requests_per_second, tokens_per_minute)
+        with self._lock:
+            self._limiters[key] = limiter
+        return limiter
+
+    def get(self, key: str) -> Optional[RateLimiter]:
+        return self._limiters.get(key)
+
+    def remove(self, key: str):
+        with self._lock:
+            self._limiters.pop(key, None)
+
+    def limit(self, key: str, text: str = ''):
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            return nullcontext()
+        return limiter.limit(estimate_tokens(text) if limiter.counts_tokens else 0)
+
+    def alimit(self, key: str, text: str = ''):
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            return nullcontext()
+        return limiter.alimit(estimate_tokens(text) if limiter.counts_tokens else 0)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {key: limiter.stats() for key, limiter in list(self._limiters.items())}
+
+
+LIMITERS = LimiterRegistry()
@@ -0,0 +1,180 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from typing import List, Optional, Union
+import asyncio
+import copy
+import logging
+
+from pydantic import StrictInt, StrictStr
+
+from . import tracing
+from .executable import (Concept, ConceptRegistry, Executable, ExecutableOrchestrator, _bounded,
+                         _gather_or_cancel)
+from .cache import make_cache_key
+from .graph import compile_graph
+from .memory import MemoryBackend, default_memory
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MapReduce(Executable):
+    # runs mapper on every element of the list concept `source`, each run sees its element as the concept
+    # `item`. Without a reducer the output is a list concept holding the mapper results in order. With one,
+    # the results are folded fan_in at a time, each group handed to the reducer as the list concept
+    # `reduce_input`, until a single value is left
+    source: StrictStr
+    mapper: Union[Executable, ExecutableOrchestrator]
+    output: Concept
+    item: StrictStr = 'item'
+    result: Optional[StrictStr] = None
+    reducer: Optional[Executable] = None
+    reduce_input: StrictStr = 'results'
+    fan_in: StrictInt = 8
+    max_concurrency: StrictInt = 8
+
+    def __init__(self, source: StrictStr, mapper: Union[Executable, ExecutableOrchestrator], output: Concept,
+                 item: StrictStr = 'item', result: Optional[StrictStr] = None, reducer: Optional[Executable] = None,
+                 reduce_input: StrictStr = 'results', fan_in: int = 8, max_concurrency: int = 8,
+                 memory: Optional[MemoryBackend] = None):
+        if result is None:
+            if not isinstance(mapper, Executable):
+                raise ValueError(f'result must name the concept produced by the {type(mapper).__name__} mapper')
+            result = mapper.output_name()
+        if reducer is None and output.type != 'list':
+            raise ValueError(f'Without a reducer the output concept {output.name!r} must be a list concept')
+        if fan_in < 2:
+            raise ValueError(f'fan_in must be at least 2, got {fan_in}')
+        if max_concurrency < 1:
+            raise ValueError(f'max_concurrency must be a positive integer, got {max_concurrency}')
+        super().__init__(source=source, mapper=mapper, output=output, item=item, result=result, reducer=reducer,
+                         reduce_input=reduce_input, fan_in=fan_in, max_concurrency=max_concurrency,
+                         memory=memory if memory is not None else default_memory())
+
+    def input_names(self) -> List[StrictStr]:
+        names = [self.source]
+        for name in _external_inputs(self.mapper):
+            if name != self.item and name not in names:
+                names.append(name)
+        if self.reducer is not None:
+            for name in self.reducer.input_names():
+                if name != self.reduce_input and name not in names:
+                    names.append(name)
+        return names
+
+    def output_name(self) -> StrictStr:
+        return self.output.get_name()
+
+    def fingerprint(self) -> Optional[StrictStr]:
+        mapper = _fingerprints(self.mapper)
+        reducer = _fingerprints(self.reducer) if self.reducer is not None else []
+        if mapper is None or reducer is None:
+            return None
+        return make_cache_key(type(self).__qualname__, self.source, self.item, self.result, self.reduce_input,
+                              self.fan_in, self.output.name, self.output.type, mapper, reducer)
+
+    def _element_registry(self, concept_registry: ConceptRegistry, name: str, value) -> ConceptRegistry:
+        registry = concept_registry.copy()
+        if isinstance(value, list):
+            registry.concepts[name] = Concept(name=name, type='list', choice='stringify', list_content=value)
+        else:
+            registry.concepts[name] = Concept(name=name, string_content=value)
+        return registry
+
+    def _apply(self, component, result: str, concept_registry: ConceptRegistry, name: str, value,
+               callback=None) -> str:
+        registry = self._element_registry(concept_registry, name, value)
+        if isinstance(component, Executable):
+            return component.run(registry, callback).string_content
+        return component.run(registry, callback).concepts[result].string_content
+
+    async def _aapply(self, component, result: str, concept_registry: ConceptRegistry, name: str, value,
+                      callback=None) -> str:
+        registry = self._element_registry(concept_registry, name, value)
+        if isinstance(component, Executable):
+            return (await component.arun(registry, callback)).string_content
+        return (await component.arun(registry, callback)).concepts[result].string_content
+
+    def _map(self, executor, component, result: str, concept_registry: ConceptRegistry, name: str,
+             values: List, callback=None) -> List[str]:
+        futures = [tracing.submit(executor, self._apply, component, result, concept_registry, name, value, callback)
+                   for value in values]
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = [future for future in futures if future in done and future.exception() is not None]
+        if failed:
+            for future in not_done:
+                future.cancel()
+            raise failed[0].exception()
+        return [future.result() for future in futures]
+
+    async def _amap(self, semaphore, component, result: str, concept_registry: ConceptRegistry, name: str,
+                    values: List, callback=None) -> List[str]:
+        return await _gather_or_cancel([_bounded(semaphore, self._aapply(component, result, concept_registry,
+                                                                         name, value, callback))
+                                        for value in values])
+
+    def _groups(self, results: List[str]) -> List[List[str]]:
+        # an empty list is still reduced once, so the output always comes from the reducer
+        return [results[start:start + self.fan_in] for start in range(0, len(results), self.fan_in)] or [[]]
+
+    def _finish(self, results: List[str]) -> Concept:
+        output_concept = copy.copy(self.output)
+        if self.reducer is None:
+            # may be empty, get_value would refuse that
+            output_concept.assign_list_content(results)
+            self.memory.append(results)
+        else:
+            output_concept.assign_string_content(results[0])
+            self.memory.append(results[0])
+        return output_concept
+
+    def run(self, concept_registry: ConceptRegistry, callback=None) -> Concept:
+        LOGGER.debug('Running object: %s', self.__dict__)
+
+        elements = concept_registry.concepts[self.source].as_list()
+        with tracing.traced('orchestrator', 'MapReduce', size=len(elements)), \
+                ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='lexflow-map') as executor:
+            results = self._map(executor, self.mapper, self.result, concept_registry, self.item, elements, callback)
+            if self.reducer is not None:
+                # a tree of reductions, so no prompt ever holds more than fan_in results
+                results = self._map(executor, self.reducer, self.reducer.output_name(), concept_registry,
+                                    self.reduce_input, self._groups(results), callback)
+                while len(results) > 1:
+                    results = self._map(executor, self.reducer, self.reducer.output_name(), concept_registry,
+                                        self.reduce_input, self._groups(results), callback)
+        return self._finish(results)
+
+    async def arun(self, concept_registry: ConceptRegistry, callback=None) -> Concept:
+        LOGGER.debug('Running object: %s', self.__dict__)
+
+        elements = concept_registry.concepts[self.source].as_list()
+        with tracing.traced('orchestrator', 'MapReduce', size=len(elements)):
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            results = await self._amap(semaphore, self.mapper, self.result, concept_registry, self.item, elements,
+                                       callback)
+            if self.reducer is not None:
+                results = await self._amap(semaphore, self.reducer, self.reducer.output_name(), concept_registry,
+                                           self.reduce_input, self._groups(results), callback)
+                while len(results) > 1:
+                    results = await self._amap(semaphore, self.reducer, self.reducer.output_name(),
+                                               concept_registry, self.reduce_input, self._groups(results), callback)
+        return self._finish(results)
+
+
+def _fingerprints(component: Union[Executable, ExecutableOrchestrator]) -> Optional[List]:
+    # None when some component can't be fingerprinted
+    if isinstance(component, Executable):
+        nodes = [(component, {})]
+    else:
+        nodes = [(node.component, node.dependencies) for node in compile_graph(component).nodes]
+    fingerprints = []
+    for node_component, dependencies in nodes:
+        fingerprint = node_component.fingerprint() if hasattr(node_component, 'fingerprint') else None
+        if fingerprint is None:
+            return None
+        fingerprints.append([fingerprint, dependencies])
+    return fingerprints
+
+
+def _external_inputs(component: Union[Executable, ExecutableOrchestrator]) -> List[str]:
+    if isinstance(component, Executable):
+        return component.input_names()
+    return compile_graph(component).external_inputs
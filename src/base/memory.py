@@ -0,0 +1,156 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Iterable, Iterator
+import json
+import logging
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_SIZE = 1000
+
+
+class MemoryBackend(ABC):
+    # reads behave like a list of the entries still held in memory, oldest first
+
+    @abstractmethod
+    def append(self, entry: Any):
+        pass
+
+    @abstractmethod
+    def __iter__(self) -> Iterator[Any]:
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abstractmethod
+    def clear(self):
+        pass
+
+    def extend(self, entries: Iterable[Any]):
+        for entry in entries:
+            self.append(entry)
+
+    def __getitem__(self, index):
+        return list(self)[index]
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}({list(self)!r})'
+
+
+class RingBufferMemory(MemoryBackend):
+    def __init__(self, max_entries: int = DEFAULT_MEMORY_SIZE):
+        if max_entries < 1:
+            raise ValueError(f'max_entries must be a positive integer, got {max_entries}')
+        self.max_entries = max_entries
+        self._entries = deque(maxlen=max_entries)
+
+    def append(self, entry: Any):
+        self._entries.append(entry)
+
+    def extend(self, entries: Iterable[Any]):
+        self._entries.extend(entries)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class UnboundedMemory(MemoryBackend):
+    # the historical behaviour: keeps everything, only suitable for short-lived or interactive use
+    def __init__(self):
+        self._entries = []
+
+    def append(self, entry: Any):
+        self._entries.append(entry)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class SpillingMemory(MemoryBackend):
+    # keeps the most recent entries in memory and appends older ones to a JSON lines log once
+    # the in-memory entries exceed max_bytes
+    def __init__(self, path: str, max_bytes: int = 1 << 20):
+        if max_bytes < 0:
+            raise ValueError(f'max_bytes must not be negative, got {max_bytes}')
+        self.path = path
+        self.max_bytes = max_bytes
+        self.spilled = 0
+        self._entries = deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def append(self, entry: Any):
+        line = json.dumps(entry, default=str) + '\n'
+        size = len(line.encode('utf-8'))
+        with self._lock:
+            self._entries.append((entry, line, size))
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._spill()
+
+    def _spill(self):
+        with open(self.path, 'a', encoding='utf-8') as log:
+            while self._entries and self._bytes > self.max_bytes:
+                _, line, size = self._entries.popleft()
+                log.write(line)
+                self._bytes -= size
+                self.spilled += 1
+
+    def read_spilled(self) -> Iterator[Any]:
+        try:
+            with open(self.path, encoding='utf-8') as log:
+                for line in log:
+                    yield json.loads(line)
+        except FileNotFoundError:
+            return
+
+    def __iter__(self) -> Iterator[Any]:
+        with self._lock:
+            return iter([entry for entry, _, _ in self._entries])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class NullMemory(MemoryBackend):
+    def append(self, entry: Any):
+        pass
+
+    def extend(self, entries: Iterable[Any]):
+        pass
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(())
+
+    def __len__(self) -> int:
+        return 0
+
+    def clear(self):
+        pass
+
+
+def default_memory() -> MemoryBackend:
+    return RingBufferMemory(DEFAULT_MEMORY_SIZE)
@@ -0,0 +1,226 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, List, Optional, Sequence, Tuple, Union
+import asyncio
+import logging
+
+from . import tracing
+from .executable import (Concept, ConceptRegistry, Executable, ExecutableOrchestrator, ProbabilisticComponent, Threads,
+                         _bounded, _gather_or_cancel)
+from .graph import compile_graph, prune_graph
+
+LOGGER = logging.getLogger(__name__)
+
+
+class PipelineCompileError(ValueError):
+    pass
+
+
+class PlanStep:
+    __slots__ = ('component', 'level', 'input_names', 'input_slots', 'output_slot', 'template')
+
+    def __init__(self, component: Executable, level: int, input_names: Tuple[str, ...],
+                 input_slots: Tuple[int, ...], output_slot: int):
+        self.component = component
+        self.level = level
+        self.input_names = input_names
+        self.input_slots = input_slots
+        self.output_slot = output_slot
+        # prompt components are filled straight from the slot values, anything else gets a registry view
+        self.template = component.prompt._compiled if isinstance(component, ProbabilisticComponent) else None
+
+    def output_template(self) -> Optional[Concept]:
+        # the concept the component writes, for outputs restored from a checkpoint or a cache
+        component = self.component
+        if hasattr(component, 'prompt'):
+            return component.prompt.output
+        output = getattr(component, 'output', None)
+        return output if isinstance(output, Concept) else None
+
+    def _view(self, slots: List[Concept], concept_registry: ConceptRegistry) -> ConceptRegistry:
+        view = concept_registry.copy()
+        for name, slot in zip(self.input_names, self.input_slots):
+            view.concepts[name] = slots[slot]
+        return view
+
+    def execute(self, slots: List[Concept], concept_registry: ConceptRegistry, callback=None) -> Concept:
+        if self.template is None:
+            return self.component.run(self._view(slots, concept_registry), callback)
+        filled_prompt = self.template.render([slots[slot].get_value() for slot in self.input_slots])
+        return self.component._run_filled(filled_prompt, callback)
+
+    async def aexecute(self, slots: List[Concept], concept_registry: ConceptRegistry, callback=None,
+                       call: Optional[Callable] = None) -> Concept:
+        if self.template is None:
+            return await self.component.arun(self._view(slots, concept_registry), callback)
+        filled_prompt = self.template.render([slots[slot].get_value() for slot in self.input_slots])
+        if call is not None:
+            return await call(self.component, filled_prompt)
+        return await self.component._arun_filled(filled_prompt, callback)
+
+
+class CompiledPipeline:
+    # a flat execution plan. Slots 0..len(required_inputs)-1 hold the initial concepts and every step writes
+    # its output to its own slot, so a run needs no name lookups or tree walking. With max_concurrency above 1,
+    # a step starts as soon as the steps it reads from finished, with at most max_concurrency steps running at
+    # once. Otherwise, or when every step waits on the one before it anyway, a run is a plain loop over the steps
+    def __init__(self, steps: List[PlanStep], required_inputs: Tuple[str, ...], commit_order: List[int],
+                 skipped: Optional[List[str]] = None, max_concurrency: int = 1):
+        if max_concurrency < 1:
+            raise ValueError(f'max_concurrency must be a positive integer, got {max_concurrency}')
+        self.steps = steps
+        self.required_inputs = required_inputs
+        self.commit_order = commit_order
+        # outputs of the components left out because no target needed them
+        self.skipped = skipped if skipped is not None else []
+        self.max_concurrency = max_concurrency
+        # producers always have a lower index than the steps reading from them
+        offset = len(required_inputs)
+        self._producers = [tuple(sorted({slot - offset for slot in step.input_slots if slot >= offset}))
+                           for step in steps]
+        self._dependents: List[List[int]] = [[] for _ in steps]
+        for index, producers in enumerate(self._producers):
+            for producer in producers:
+                self._dependents[producer].append(index)
+        self._concurrent = max_concurrency > 1 and _widest(self._producers) > 1
+
+    def _load(self, concept_registry: ConceptRegistry) -> List[Optional[Concept]]:
+        concepts = concept_registry.concepts
+        missing = [name for name in self.required_inputs if name not in concepts]
+        if missing:
+            raise PipelineCompileError(f'Missing initial concepts {missing}, available concepts are '
+                                       f'{list(concepts.keys())}')
+        return [concepts[name] for name in self.required_inputs] + [None] * len(self.steps)
+
+    def _commit(self, concept_registry: ConceptRegistry, slots: List[Concept]) -> ConceptRegistry:
+        for index in self.commit_order:
+            step = self.steps[index]
+            output_concept = slots[step.output_slot]
+            output_concept.level = step.level
+            concept_registry.update_concepts(output_concept)
+        return concept_registry
+
+    def schedule(self, slots: List[Optional[Concept]], execute: Callable[[int, PlanStep], Concept]):
+        # fills every step's output slot with execute(index, step), which may read the slots of the step's inputs
+        if not self._concurrent:
+            for index, step in enumerate(self.steps):
+                slots[step.output_slot] = execute(index, step)
+            return
+
+        waiting_on = [len(producers) for producers in self._producers]
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='lexflow-plan') as executor:
+            def submit(index):
+                return tracing.submit(executor, execute, index, self.steps[index])
+
+            running = {submit(index): index for index, count in enumerate(waiting_on) if count == 0}
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    if future.exception() is not None:
+                        for other in running:
+                            other.cancel()
+                        raise future.exception()
+                    slots[self.steps[index].output_slot] = future.result()
+                    for dependent in self._dependents[index]:
+                        waiting_on[dependent] -= 1
+                        if waiting_on[dependent] == 0:
+                            running[submit(dependent)] = dependent
+
+    async def aschedule(self, slots: List[Optional[Concept]],
+                        execute: Callable[[int, PlanStep], Awaitable[Concept]]):
+        if not self._concurrent:
+            for index, step in enumerate(self.steps):
+                slots[step.output_slot] = await execute(index, step)
+            return
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = []
+
+        async def run_step(index: int, step: PlanStep):
+            await asyncio.gather(*[tasks[producer] for producer in self._producers[index]])
+            slots[step.output_slot] = await _bounded(semaphore, execute(index, step))
+
+        for index, step in enumerate(self.steps):
+            tasks.append(asyncio.ensure_future(run_step(index, step)))
+        await _gather_or_cancel(tasks)
+
+    def run(self, concept_registry: ConceptRegistry, callback=None) -> ConceptRegistry:
+        slots = self._load(concept_registry)
+        with tracing.traced('pipeline', 'CompiledPipeline', size=len(self.steps), skipped=len(self.skipped)):
+            self.schedule(slots, lambda index, step: step.execute(slots, concept_registry, callback))
+        return self._commit(concept_registry, slots)
+
+    async def arun(self, concept_registry: ConceptRegistry, callback=None,
+                   call: Optional[Callable] = None) -> ConceptRegistry:
+        # call(component, filled_prompt) replaces the model call of prompt steps, e.g. with server.MicroBatcher
+        slots = self._load(concept_registry)
+        with tracing.traced('pipeline', 'CompiledPipeline', size=len(self.steps), skipped=len(self.skipped)):
+            await self.aschedule(slots, lambda index, step: step.aexecute(slots, concept_registry, callback, call))
+        return self._commit(concept_registry, slots)
+
+    def __len__(self) -> int:
+        return len(self.steps)
+
+    def __repr__(self):
+        lines = [f'CompiledPipeline (initial concepts {list(self.required_inputs)}):']
+        if self.skipped:
+            lines[0] = f'CompiledPipeline (initial concepts {list(self.required_inputs)}, skipping {self.skipped}):'
+        for index, step in enumerate(self.steps):
+            lines.append(f'  - [{index}] {step.component.output_name()} <- {list(step.input_names)} '
+                         f'(level {step.level})')
+        return '\n'.join(lines)
+
+
+def _widest(producers: List[Tuple[int, ...]]) -> int:
+    # the most steps sharing a depth in the dependency graph, 1 for a plain chain
+    depths = []
+    for step_producers in producers:
+        depths.append(1 + max((depths[producer] for producer in step_producers), default=0))
+    return max((depths.count(depth) for depth in set(depths)), default=0)
+
+
+def _max_workers(node) -> int:
+    # the largest Threads pool in the tree. Threads without max_workers run sequentially, like Chains
+    bound = node.max_workers or 1 if isinstance(node, Threads) else 1
+    for component in getattr(node, 'components', ()):
+        bound = max(bound, _max_workers(component))
+    return bound
+
+
+def compile_pipeline(root: Union[Executable, ExecutableOrchestrator], initial_concepts: Optional[Sequence[str]] = None,
+                     targets: Optional[Sequence[str]] = None,
+                     max_concurrency: Optional[int] = None) -> CompiledPipeline:
+    # with targets, the plan only holds the components the target concepts transitively depend on. Steps run
+    # concurrently up to max_concurrency, by default the largest max_workers of any Threads in the pipeline
+    try:
+        graph = compile_graph(root)
+        skipped = None
+        if targets is not None:
+            graph, skipped = prune_graph(graph, targets)
+    except (TypeError, ValueError) as e:
+        raise PipelineCompileError(str(e)) from e
+
+    required_inputs = tuple(graph.external_inputs)
+    if initial_concepts is not None:
+        _check_satisfiable(graph, required_inputs, set(initial_concepts))
+
+    steps = []
+    for node in graph.nodes:
+        names = tuple(node.dependencies)
+        slots = tuple(len(required_inputs) + node.dependencies[name] if node.dependencies[name] is not None
+                      else required_inputs.index(name) for name in names)
+        steps.append(PlanStep(node.component, node.level, names, slots, len(required_inputs) + node.index))
+    return CompiledPipeline(steps, required_inputs, graph.commit_order, skipped,
+                            max_concurrency if max_concurrency is not None else _max_workers(root))
+
+
+def _check_satisfiable(graph, required_inputs: Tuple[str, ...], initial_concepts: set):
+    problems = []
+    for node in graph.nodes:
+        missing = [name for name, producer in node.dependencies.items()
+                   if producer is None and name not in initial_concepts]
+        if missing:
+            problems.append(f'{type(node.component).__name__} producing {node.component.output_name()!r} needs '
+                            f'{missing}, which are neither initial concepts nor produced upstream')
+    if problems:
+        raise PipelineCompileError('Pipeline cannot be satisfied:\n  ' + '\n  '.join(problems))
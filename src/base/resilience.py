@@ -0,0 +1,337 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple, Type
+import asyncio
+import logging
+import math
+import random
+import threading
+import time
+
+from . import tracing
+from .singleflight import fresh_calls
+
+LOGGER = logging.getLogger(__name__)
+
+# absolute time.monotonic() by which the current run has to finish. Being a ContextVar it follows the run into
+# Threads branches, graph workers (tracing.submit copies the context) and asyncio tasks
+_DEADLINE: ContextVar[Optional[float]] = ContextVar('lexflow_deadline', default=None)
+
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+class TransientError(Exception):
+    # providers raise this (or a subclass) for errors worth retrying, e.g. rate limiting or a 503
+    pass
+
+
+class AttemptTimeout(TimeoutError):
+    pass
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def deadline(seconds: float):
+    # with deadline(5): chain.run(registry). Nested deadlines can only shorten the enclosing one
+    expires = time.monotonic() + seconds
+    current = _DEADLINE.get()
+    token = _DEADLINE.set(expires if current is None else min(current, expires))
+    try:
+        yield
+    finally:
+        _DEADLINE.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    expires = _DEADLINE.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+def deadline_active() -> bool:
+    return _DEADLINE.get() is not None
+
+
+def check_deadline():
+    left = remaining_time()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded('Deadline exceeded')
+
+
+def _executor() -> ThreadPoolExecutor:
+    # blocking calls that can time out or be hedged run here. A call that loses a race or times out can't be
+    # interrupted, it finishes in the background and its result is dropped
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                _EXECUTOR = ThreadPoolExecutor(max_workers=64, thread_name_prefix='lexflow-resilience')
+    return _EXECUTOR
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    max_attempts: int = 3
+    base_delay: float = 0.1
+    max_delay: float = 10.0
+    multiplier: float = 2.0
+    retry_on: Tuple[Type[BaseException], ...] = (TransientError, TimeoutError, ConnectionError)
+
+    def __post_init__(self):
+        if self.max_attempts < 1:
+            raise ValueError(f'max_attempts must be a positive integer, got {self.max_attempts}')
+
+    def should_retry(self, error: BaseException, attempt: int) -> bool:
+        return (attempt + 1 < self.max_attempts and isinstance(error, self.retry_on)
+                and not isinstance(error, DeadlineExceeded))
+
+    def backoff(self, attempt: int) -> float:
+        # full jitter, so clients that failed together don't retry together
+        return random.uniform(0, min(self.max_delay, self.base_delay * self.multiplier ** attempt))
+
+
+class HedgePolicy:
+    # sends a duplicate request once a call has been running longer than the given percentile of recent
+    # latencies. Until min_samples calls have been observed nothing is hedged
+    def __init__(self, percentile: float = 95.0, min_samples: int = 20, window: int = 256,
+                 min_delay: float = 0.0, max_hedges: int = 1):
+        if not 0 < percentile < 100:
+            raise ValueError(f'percentile must be between 0 and 100, got {percentile}')
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_hedges = max_hedges
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency: float):
+        with self._lock:
+            self._latencies.append(latency)
+
+    def delay(self) -> Optional[float]:
+        with self._lock:
+            if len(self._latencies) < max(1, self.min_samples):
+                return None
+            latencies = sorted(self._latencies)
+        index = min(len(latencies) - 1, math.ceil(self.percentile / 100 * len(latencies)) - 1)
+        return max(self.min_delay, latencies[index])
+
+
+class ResiliencePolicy:
+    # timeout bounds a single attempt, deadline bounds the whole call including retries and hedges
+    def __init__(self, timeout: Optional[float] = None, deadline: Optional[float] = None,
+                 retry: Optional[RetryPolicy] = None, hedge: Optional[HedgePolicy] = None):
+        for name, value in (('timeout', timeout), ('deadline', deadline)):
+            if value is not None and value <= 0:
+                raise ValueError(f'{name} must be positive, got {value}')
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retry = retry
+        self.hedge = hedge
+        self._counts = {'calls': 0, 'attempts': 0, 'retries': 0, 'timeouts': 0, 'deadline_exceeded': 0,
+                        'hedges': 0, 'hedge_wins': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._counts[name] += amount
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+    def _attempt_timeout(self) -> Optional[float]:
+        left = remaining_time()
+        if left is not None and left <= 0:
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded('Deadline exceeded before the call could be made')
+        if left is None:
+            return self.timeout
+        return left if self.timeout is None else min(self.timeout, left)
+
+    def _next_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        # None means give up and raise the error
+        left = remaining_time()
+        if left is not None and left <= 0:
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded(f'Deadline exceeded after {attempt + 1} attempts') from error
+        if self.retry is None or not self.retry.should_retry(error, attempt):
+            return None
+        delay = self.retry.backoff(attempt)
+        if left is not None and delay >= left:
+            return None
+        self._count('retries')
+        LOGGER.debug('Retrying after %r in %.3fs (attempt %d)', error, delay, attempt + 1)
+        return delay
+
+    def _hedge_delay(self, timeout: Optional[float]) -> Optional[float]:
+        delay = self.hedge.delay() if self.hedge is not None else None
+        if delay is None or (timeout is not None and delay >= timeout):
+            return None
+        return delay
+
+    def _timed(self, fn: Callable, args: tuple, fresh: bool = False):
+        started = time.perf_counter()
+        if fresh:
+            with fresh_calls():
+                result = fn(*args)
+        else:
+            result = fn(*args)
+        if self.hedge is not None:
+            self.hedge.record(time.perf_counter() - started)
+        return result
+
+    def call(self, fn: Callable, *args):
+        if self.deadline is not None:
+            with deadline(self.deadline):
+                return self._call(fn, args)
+        return self._call(fn, args)
+
+    def _call(self, fn: Callable, args: tuple):
+        self._count('calls')
+        attempt = 0
+        while True:
+            timeout = self._attempt_timeout()
+            self._count('attempts')
+            try:
+                result = self._attempt(fn, args, timeout, attempt > 0)
+                if attempt:
+                    tracing.annotate(retries=attempt)
+                return result
+            except Exception as e:
+                delay = self._next_delay(e, attempt)
+                if delay is None:
+                    raise
+            time.sleep(delay)
+            attempt += 1
+
+    def _attempt(self, fn: Callable, args: tuple, timeout: Optional[float], fresh: bool):
+        # retries and hedges are fresh calls, see singleflight
+        hedge_delay = self._hedge_delay(timeout)
+        if timeout is None and hedge_delay is None:
+            return self._timed(fn, args, fresh)
+
+        expires = None if timeout is None else time.perf_counter() + timeout
+        executor = _executor()
+        futures = [tracing.submit(executor, self._timed, fn, args, fresh)]
+        try:
+            while hedge_delay is not None and len(futures) <= self.hedge.max_hedges:
+                done, _ = wait(futures, timeout=hedge_delay, return_when=FIRST_COMPLETED)
+                if done or (expires is not None and time.perf_counter() + hedge_delay >= expires):
+                    break
+                self._count('hedges')
+                tracing.annotate(hedged=True)
+                futures.append(tracing.submit(executor, self._timed, fn, args, True))
+
+            index, result = self._first_result(futures, expires)
+        finally:
+            for future in futures:
+                future.cancel()
+        if index:
+            self._count('hedge_wins')
+        return result
+
+    def _first_result(self, futures: List, expires: Optional[float]):
+        # the first request to succeed wins, an error is only raised once every request has failed
+        pending, error = set(futures), None
+        while pending:
+            timeout = None if expires is None else max(0.0, expires - time.perf_counter())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                self._count('timeouts')
+                raise AttemptTimeout(f'Call did not finish within {self._timeout_description()}')
+            for index, future in enumerate(futures):
+                if future in done:
+                    if future.exception() is None:
+                        return index, future.result()
+                    error = error if error is not None else future.exception()
+        raise error
+
+    def _timeout_description(self) -> str:
+        return f'{self.timeout}s' if self.timeout is not None else 'the deadline'
+
+    async def acall(self, fn: Callable, *args):
+        # fn is a coroutine function, timed out and losing requests are cancelled
+        if self.deadline is not None:
+            with deadline(self.deadline):
+                return await self._acall(fn, args)
+        return await self._acall(fn, args)
+
+    async def _acall(self, fn: Callable, args: tuple):
+        self._count('calls')
+        attempt = 0
+        while True:
+            timeout = self._attempt_timeout()
+            self._count('attempts')
+            try:
+                result = await self._aattempt(fn, args, timeout, attempt > 0)
+                if attempt:
+                    tracing.annotate(retries=attempt)
+                return result
+            except Exception as e:
+                delay = self._next_delay(e, attempt)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _atimed(self, fn: Callable, args: tuple, fresh: bool = False):
+        started = time.perf_counter()
+        if fresh:
+            with fresh_calls():
+                result = await fn(*args)
+        else:
+            result = await fn(*args)
+        if self.hedge is not None:
+            self.hedge.record(time.perf_counter() - started)
+        return result
+
+    async def _aattempt(self, fn: Callable, args: tuple, timeout: Optional[float], fresh: bool):
+        hedge_delay = self._hedge_delay(timeout)
+        if timeout is None and hedge_delay is None:
+            return await self._atimed(fn, args, fresh)
+
+        expires = None if timeout is None else time.perf_counter() + timeout
+        tasks = [asyncio.ensure_future(self._atimed(fn, args, fresh))]
+        try:
+            while hedge_delay is not None and len(tasks) <= self.hedge.max_hedges:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if done or (expires is not None and time.perf_counter() + hedge_delay >= expires):
+                    break
+                self._count('hedges')
+                tracing.annotate(hedged=True)
+                tasks.append(asyncio.ensure_future(self._atimed(fn, args, True)))
+
+            index, result = await self._afirst_result(tasks, expires)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if index:
+            self._count('hedge_wins')
+        return result
+
+    async def _afirst_result(self, tasks: List, expires: Optional[float]):
+        pending, error = set(tasks), None
+        while pending:
+            timeout = None if expires is None else max(0.0, expires - time.perf_counter())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                self._count('timeouts')
+                raise AttemptTimeout(f'Call did not finish within {self._timeout_description()}')
+            for index, task in enumerate(tasks):
+                if task in done:
+                    if task.exception() is None:
+                        return index, task.result()
+                    error = error if error is not None else task.exception()
+        raise error
+
+
+# used for components without a policy of their own while a run deadline is set
+DEFAULT_POLICY = ResiliencePolicy()
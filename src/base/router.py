@@ -0,0 +1,92 @@
+from typing import Dict, List, Optional, Union
+import copy
+import logging
+
+from pydantic import PrivateAttr, StrictStr
+
+from . import tracing
+from .cache import make_cache_key
+from .executable import Concept, ConceptRegistry, Executable, ExecutableOrchestrator
+from .memory import MemoryBackend, default_memory
+from .plan import CompiledPipeline, PipelineCompileError, compile_pipeline
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Router(Executable):
+    # runs one of `routes`, picked by the value of the concept `on`, e.g. the output of a classifying component,
+    # and outputs the concept `output` that route produces. Each route is compiled down to what `output` needs,
+    # so the routes not taken, and the parts of the taken one that don't lead to `output`, never run. A value
+    # matching no route takes the `default` route, or raises a ValueError without one
+    on: StrictStr
+    routes: Dict[StrictStr, Union[Executable, ExecutableOrchestrator]]
+    output: StrictStr
+    default: Optional[StrictStr] = None
+    _plans: Dict[str, CompiledPipeline] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, on: StrictStr, routes: Dict[StrictStr, Union[Executable, ExecutableOrchestrator]],
+                 output: StrictStr, default: Optional[StrictStr] = None, memory: Optional[MemoryBackend] = None):
+        if not routes:
+            raise ValueError('A Router needs at least one route')
+        if default is not None and default not in routes:
+            raise ValueError(f'The default route {default!r} is not one of the routes {list(routes)}')
+        super().__init__(on=on, routes=routes, output=output, default=default,
+                         memory=memory if memory is not None else default_memory())
+        for name, route in routes.items():
+            try:
+                self._plans[name] = compile_pipeline(route, targets=[output])
+            except PipelineCompileError as e:
+                raise PipelineCompileError(f'Route {name!r} of the Router producing {output!r}: {e}') from e
+
+    def input_names(self) -> List[StrictStr]:
+        # every route's inputs, which route runs is only known at run time
+        names = [self.on]
+        for plan in self._plans.values():
+            for name in plan.required_inputs:
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def output_name(self) -> StrictStr:
+        return self.output
+
+    def fingerprint(self) -> Optional[StrictStr]:
+        routes = {}
+        for name, plan in self._plans.items():
+            steps = []
+            for step in plan.steps:
+                fingerprint = step.component.fingerprint() if hasattr(step.component, 'fingerprint') else None
+                if fingerprint is None:
+                    return None
+                steps.append([fingerprint, list(step.input_names), list(step.input_slots)])
+            routes[name] = steps
+        return make_cache_key(type(self).__qualname__, self.on, self.output, self.default, routes)
+
+    def select(self, concept_registry: ConceptRegistry) -> StrictStr:
+        value = str(concept_registry.concepts[self.on].get_value()).strip()
+        if value in self.routes:
+            return value
+        if self.default is not None:
+            return self.default
+        raise ValueError(f'No route for {self.on}={value!r}, the routes are {list(self.routes)}')
+
+    def _output(self, concept_registry: ConceptRegistry, route: str) -> Concept:
+        self.memory.append(route)
+        return copy.copy(concept_registry.concepts[self.output])
+
+    def run(self, concept_registry: ConceptRegistry, callback=None) -> Concept:
+        LOGGER.debug('Running object: %s', self.__dict__)
+
+        route = self.select(concept_registry)
+        with tracing.traced('orchestrator', 'Router', route=route, skipped=len(self.routes) - 1):
+            # the route works on a copy, only its output concept comes back
+            route_registry = self._plans[route].run(concept_registry.copy(), callback)
+        return self._output(route_registry, route)
+
+    async def arun(self, concept_registry: ConceptRegistry, callback=None) -> Concept:
+        LOGGER.debug('Running object: %s', self.__dict__)
+
+        route = self.select(concept_registry)
+        with tracing.traced('orchestrator', 'Router', route=route, skipped=len(self.routes) - 1):
+            route_registry = await self._plans[route].arun(concept_registry.copy(), callback)
+        return self._output(route_registry, route)
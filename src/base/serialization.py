@@ -0,0 +1,374 @@
+from typing import Callable, Dict, List, Optional, Union
+import dataclasses
+import hashlib
+import importlib
+import io
+import json
+import logging
+import os
+import pickle
+import platform
+
+import pydantic
+
+from .executable import (Chain, Concept, Executable, ExecutableOrchestrator, LanguageModel, ProbabilisticComponent,
+                         Prompt, Threads, split_lines)
+from .lazy import LazyText
+from .mapreduce import MapReduce
+from .plan import CompiledPipeline, compile_pipeline
+from .resilience import HedgePolicy, ResiliencePolicy, RetryPolicy
+from .router import Router
+
+LOGGER = logging.getLogger(__name__)
+
+FORMAT = 'lexflow/pipeline'
+FORMAT_VERSION = 1
+
+# bumped whenever what the warm load cache pickles changes shape
+_CACHE_VERSION = 2
+
+
+class PipelineFormatError(ValueError):
+    pass
+
+
+def load_object(spec: str):
+    # 'package.module:attribute'
+    module_name, _, attribute = spec.partition(':')
+    if not attribute:
+        raise ValueError(f'Expected module:attribute, got {spec!r}')
+    target = importlib.import_module(module_name)
+    for part in attribute.split('.'):
+        target = getattr(target, part)
+    return target
+
+
+def object_spec(target) -> str:
+    # the inverse of load_object, for classes and module level functions
+    module = getattr(target, '__module__', None) or getattr(getattr(target, '__objclass__', None), '__module__', None)
+    qualname = getattr(target, '__qualname__', '')
+    if module is None or not qualname or '<' in qualname:
+        raise PipelineFormatError(f'{target!r} is not importable by name, only classes and module level functions '
+                                  f'can be serialized')
+    return f'{module}:{qualname}'
+
+
+def _yaml():
+    # PyYAML is only needed, and only imported, for YAML files
+    try:
+        import yaml
+    except ImportError as e:
+        raise ImportError('Reading and writing YAML pipelines needs PyYAML, pip install pyyaml') from e
+    return yaml
+
+
+class _Encoder:
+    def __init__(self):
+        self.models: Dict[str, Dict] = {}
+        self._model_keys: Dict[int, str] = {}
+
+    def model(self, model: LanguageModel) -> str:
+        # models are written once and referenced by key, so components sharing a model still do after loading
+        key = self._model_keys.get(id(model))
+        if key is None:
+            key = model.name
+            suffix = 1
+            while key in self.models:
+                suffix += 1
+                key = f'{model.name}#{suffix}'
+            self._model_keys[id(model)] = key
+            self.models[key] = {'class': object_spec(type(model)),
+                                **model.model_dump(exclude={'memory', 'cache'}, exclude_defaults=True)}
+        return key
+
+    def node(self, node: Union[Executable, ExecutableOrchestrator]) -> Dict:
+        if isinstance(node, Chain):
+            return {'kind': 'chain', 'components': [self.node(component) for component in node.components]}
+        if isinstance(node, Threads):
+            data = {'kind': 'threads', 'components': [self.node(component) for component in node.components]}
+            if node.max_workers is not None:
+                data['max_workers'] = node.max_workers
+            return data
+        if isinstance(node, ProbabilisticComponent):
+            data = {'kind': 'component', 'model': self.model(node.model),
+                    'prompt': {'template': node.prompt.template, 'output': dump_concept(node.prompt.output)}}
+            if type(node) is not ProbabilisticComponent:
+                data['class'] = object_spec(type(node))
+            if node.resilience is not None:
+                data['resilience'] = _dump_resilience(node.resilience)
+            return data
+        if isinstance(node, MapReduce):
+            data = {'kind': 'map_reduce', 'source': node.source, 'mapper': self.node(node.mapper),
+                    'output': dump_concept(node.output), 'item': node.item, 'result': node.result,
+                    'reduce_input': node.reduce_input, 'fan_in': node.fan_in, 'max_concurrency': node.max_concurrency}
+            if node.reducer is not None:
+                data['reducer'] = self.node(node.reducer)
+            return data
+        if isinstance(node, Router):
+            data = {'kind': 'router', 'on': node.on, 'output': node.output,
+                    'routes': {name: self.node(route) for name, route in node.routes.items()}}
+            if node.default is not None:
+                data['default'] = node.default
+            return data
+        raise PipelineFormatError(f'Cannot serialize {type(node).__name__}')
+
+
+def dump_concept(concept: Concept, strict: bool = True) -> Dict:
+    # the codec for concepts in pipeline files, checkpoints and jobs. Files are referenced, not copied. strict=False
+    # records a listify_func that can't be serialized as None, for load_concept to take from a template
+    data = {'name': concept.name}
+    if concept.type != 'identity':
+        data['type'] = concept.type
+    if concept.choice != 'all':
+        data['choice'] = concept.choice
+    if concept.index:
+        data['index'] = concept.index
+    if concept.level:
+        data['level'] = concept.level
+    if concept.listify_func is not split_lines:
+        try:
+            data['listify_func'] = object_spec(concept.listify_func)
+        except PipelineFormatError:
+            if strict:
+                raise
+            data['listify_func'] = None
+    if isinstance(concept.string_content, LazyText):
+        data['file'] = concept.string_content.to_dict()
+    elif concept.string_content is not None:
+        data['string'] = concept.string_content
+    if concept.list_content is not None:
+        data['list'] = concept.list_content
+    return data
+
+
+def _listify_func(data: Dict, template: Optional[Concept]) -> Callable:
+    spec = data.get('listify_func', split_lines)
+    if spec is None:
+        if template is None:
+            raise PipelineFormatError(f'The listify_func of the concept {data["name"]!r} was not serialized')
+        return template.listify_func
+    return spec if spec is split_lines else load_object(spec)
+
+
+def load_concept(data: Dict, template: Optional[Concept] = None) -> Concept:
+    # template is the concept the data was written for, e.g. a component's output concept. It stands in for a
+    # listify_func that could not be serialized
+    content = {}
+    if 'file' in data:
+        content['string_content'] = LazyText(**data['file'])
+    elif 'string' in data:
+        content['string_content'] = data['string']
+    if 'list' in data:
+        content['list_content'] = data['list']
+    return Concept(name=data['name'], type=data.get('type', 'identity'), choice=data.get('choice', 'all'),
+                   index=data.get('index', 0), level=data.get('level', 0),
+                   listify_func=_listify_func(data, template), **content)
+
+
+def _dump_resilience(policy: ResiliencePolicy) -> Dict:
+    data = {}
+    if policy.timeout is not None:
+        data['timeout'] = policy.timeout
+    if policy.deadline is not None:
+        data['deadline'] = policy.deadline
+    if policy.retry is not None:
+        retry = dataclasses.asdict(policy.retry)
+        retry['retry_on'] = [object_spec(error) for error in policy.retry.retry_on]
+        data['retry'] = retry
+    if policy.hedge is not None:
+        hedge = policy.hedge
+        data['hedge'] = {'percentile': hedge.percentile, 'min_samples': hedge.min_samples,
+                         'window': hedge._latencies.maxlen, 'min_delay': hedge.min_delay,
+                         'max_hedges': hedge.max_hedges}
+    return data
+
+
+def _resilience_options(data: Dict) -> Dict:
+    options = {'timeout': data.get('timeout'), 'deadline': data.get('deadline')}
+    if 'retry' in data:
+        retry = dict(data['retry'])
+        retry['retry_on'] = tuple(load_object(spec) for spec in retry.get('retry_on', ()))
+        options['retry'] = RetryPolicy(**retry)
+    if 'hedge' in data:
+        options['hedge'] = HedgePolicy(**data['hedge'])
+    return options
+
+
+def _load_model(data: Dict) -> LanguageModel:
+    fields = dict(data)
+    model_class = load_object(fields.pop('class'))
+    return model_class(**fields)
+
+
+class _Decoder:
+    def __init__(self, models: Dict[str, LanguageModel]):
+        self.models = models
+
+    def node(self, data: Dict) -> Union[Executable, ExecutableOrchestrator]:
+        kind = data.get('kind')
+        if kind == 'chain':
+            return Chain([self.node(component) for component in data['components']])
+        if kind == 'threads':
+            return Threads([self.node(component) for component in data['components']],
+                           max_workers=data.get('max_workers'))
+        if kind == 'component':
+            if data['model'] not in self.models:
+                raise PipelineFormatError(f'Unknown model {data["model"]!r}, the models are {list(self.models)}')
+            component_class = load_object(data['class']) if 'class' in data else ProbabilisticComponent
+            prompt = Prompt(data['prompt']['template'], load_concept(data['prompt']['output']))
+            return component_class(self.models[data['model']], prompt,
+                                   **_resilience_options(data.get('resilience', {})))
+        if kind == 'map_reduce':
+            return MapReduce(data['source'], self.node(data['mapper']), load_concept(data['output']),
+                             item=data['item'], result=data['result'],
+                             reducer=self.node(data['reducer']) if 'reducer' in data else None,
+                             reduce_input=data['reduce_input'], fan_in=data['fan_in'],
+                             max_concurrency=data['max_concurrency'])
+        if kind == 'router':
+            return Router(data['on'], {name: self.node(route) for name, route in data['routes'].items()},
+                          data['output'], default=data.get('default'))
+        raise PipelineFormatError(f'Unknown pipeline node kind {kind!r}')
+
+
+def pipeline_to_dict(root: Union[Executable, ExecutableOrchestrator]) -> Dict:
+    # models are described by their class and fields, their caches and memory are runtime state and left out
+    encoder = _Encoder()
+    tree = encoder.node(root)
+    return {'format': FORMAT, 'version': FORMAT_VERSION, 'models': encoder.models, 'pipeline': tree}
+
+
+def _models(data: Dict, models: Optional[Dict[str, LanguageModel]]) -> Dict[str, LanguageModel]:
+    # models passed in, e.g. clients configured with credentials, replace the ones of the same key in the file
+    models = models if models is not None else {}
+    return {key: models[key] if key in models else _load_model(spec) for key, spec in data['models'].items()}
+
+
+def _check_format(data: Dict):
+    if not isinstance(data, dict) or data.get('format') != FORMAT:
+        raise PipelineFormatError(f'Not a serialized pipeline, expected format {FORMAT!r}')
+    if data.get('version') != FORMAT_VERSION:
+        raise PipelineFormatError(f'Unsupported pipeline format version {data.get("version")!r}, this version of '
+                                  f'lexflow reads version {FORMAT_VERSION}')
+
+
+def pipeline_from_dict(data: Dict, models: Optional[Dict[str, LanguageModel]] = None
+                       ) -> Union[Executable, ExecutableOrchestrator]:
+    _check_format(data)
+    return _Decoder(_models(data, models)).node(data['pipeline'])
+
+
+def dump_pipeline(root: Union[Executable, ExecutableOrchestrator], format: str = 'json') -> str:
+    data = pipeline_to_dict(root)
+    if format == 'yaml':
+        return _yaml().safe_dump(data, sort_keys=False)
+    if format == 'json':
+        return json.dumps(data, indent=2, ensure_ascii=False)
+    raise ValueError(f'Unknown format {format!r}, expected json or yaml')
+
+
+def _parse(text: Union[str, bytes], format: str) -> Dict:
+    if format == 'yaml':
+        return _yaml().safe_load(text)
+    if format == 'json':
+        return json.loads(text)
+    raise ValueError(f'Unknown format {format!r}, expected json or yaml')
+
+
+def _format_of(path: str) -> str:
+    return 'yaml' if path.endswith(('.yaml', '.yml')) else 'json'
+
+
+def save_pipeline(root: Union[Executable, ExecutableOrchestrator], path: str):
+    # the format follows the extension, .yaml/.yml or JSON otherwise
+    text = dump_pipeline(root, _format_of(path))
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(text)
+
+
+class _CachePickler(pickle.Pickler):
+    # models and resilience policies hold clients and locks. They are pickled as references and rebuilt from
+    # their description on load, so a warm load can still take models passed in
+    def __init__(self, file, model_keys: Dict[int, str]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.model_keys = model_keys
+        self.policies: List[Dict] = []
+        self._policy_ids: Dict[int, int] = {}
+
+    def persistent_id(self, obj):
+        if isinstance(obj, LanguageModel):
+            return 'model', self.model_keys[id(obj)]
+        if isinstance(obj, ResiliencePolicy):
+            if id(obj) not in self._policy_ids:
+                self._policy_ids[id(obj)] = len(self.policies)
+                self.policies.append(_dump_resilience(obj))
+            return 'resilience', self._policy_ids[id(obj)]
+        return None
+
+
+class _CacheUnpickler(pickle.Unpickler):
+    def __init__(self, file, models: Dict[str, LanguageModel], policies: List[Dict]):
+        super().__init__(file)
+        self.models = models
+        self.policies = [ResiliencePolicy(**_resilience_options(policy)) for policy in policies]
+
+    def persistent_load(self, pid):
+        kind, key = pid
+        return self.models[key] if kind == 'model' else self.policies[key]
+
+
+def _cache_path(cache_dir: str, source: bytes, compiled: bool) -> str:
+    digest = hashlib.sha256(source)
+    digest.update(f'{_CACHE_VERSION}:{compiled}:{platform.python_version()}:{pydantic.VERSION}'.encode())
+    return os.path.join(cache_dir, f'{digest.hexdigest()}.pickle')
+
+
+def _read_cache(path: str, models: Optional[Dict[str, LanguageModel]]):
+    try:
+        with open(path, 'rb') as file:
+            payload = pickle.load(file)
+        return _CacheUnpickler(io.BytesIO(payload['pipeline']), _models(payload, models), payload['policies']).load()
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        LOGGER.warning('Ignoring the unreadable pipeline cache %s: %r', path, e)
+        return None
+
+
+def _write_cache(path: str, root, data: Dict, models: Dict[str, LanguageModel]):
+    buffer = io.BytesIO()
+    pickler = _CachePickler(buffer, {id(model): key for key, model in models.items()})
+    try:
+        pickler.dump(root)
+    except Exception as e:
+        # e.g. a listify_func that is a lambda. The pipeline still loads, just without the warm start
+        LOGGER.warning('Not caching the pipeline, it cannot be pickled: %r', e)
+        return
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+        pickle.dump({'models': data['models'], 'pipeline': buffer.getvalue(), 'policies': pickler.policies}, file,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def load_pipeline(path: str, models: Optional[Dict[str, LanguageModel]] = None, cache_dir: Optional[str] = None,
+                  compiled: bool = False) -> Union[Executable, ExecutableOrchestrator, CompiledPipeline]:
+    # with cache_dir, the built (or with compiled=True the compiled) pipeline is pickled there, keyed by the file
+    # contents, and later loads of an unchanged file unpickle it instead of validating every object again
+    with open(path, 'rb') as file:
+        source = file.read()
+    if cache_dir is not None:
+        cache_path = _cache_path(cache_dir, source, compiled)
+        cached = _read_cache(cache_path, models)
+        if cached is not None:
+            return cached
+
+    data = _parse(source, _format_of(path))
+    _check_format(data)
+    resolved = _models(data, models)
+    root = _Decoder(resolved).node(data['pipeline'])
+    if compiled:
+        root = compile_pipeline(root)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_cache(cache_path, root, data, resolved)
+    return root
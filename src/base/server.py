@@ -0,0 +1,279 @@
+# Serves compiled pipelines over HTTP/JSON on localhost:
+#
+#     python -m base.server --pipeline jokes=my_package.pipelines:chain --port 8080
+#     python -m base.server --pipeline jokes=jokes.json --cache-dir .lexflow-cache
+#
+#     POST /pipelines/<name>   {"concepts": {"subject": "computer"}}  ->  {"concepts": {...}}
+#     GET  /pipelines          names of the loaded pipelines and their initial concepts
+#     GET  /stats              request, rejection and batching counters
+from typing import Dict, List, Optional, Tuple, Union
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+from .batch import registry_to_row
+from .executable import Concept, ConceptRegistry, Executable, ExecutableOrchestrator, ProbabilisticComponent
+from .plan import CompiledPipeline, PipelineCompileError, compile_pipeline
+from .serialization import load_object, load_pipeline
+
+LOGGER = logging.getLogger(__name__)
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large',
+            500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+
+class MicroBatcher:
+    # coalesces concurrent calls to the same component into one batched model call. A batch is sent once it
+    # holds max_batch_size prompts or max_wait seconds after its first prompt arrived, whichever comes first.
+    # Pass it as CompiledPipeline.arun(..., call=batcher)
+    def __init__(self, max_batch_size: int = 16, max_wait: float = 0.005):
+        if max_batch_size < 1:
+            raise ValueError(f'max_batch_size must be a positive integer, got {max_batch_size}')
+        if max_wait < 0:
+            raise ValueError(f'max_wait must not be negative, got {max_wait}')
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        # id(component) -> (component, [(filled prompt, future)])
+        self._pending: Dict[int, Tuple[ProbabilisticComponent, List]] = {}
+        self._timers: Dict[int, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self._counts = {'calls': 0, 'batches': 0, 'largest_batch': 0}
+
+    async def __call__(self, component: ProbabilisticComponent, filled_prompt: str) -> Concept:
+        future = asyncio.get_running_loop().create_future()
+        key = id(component)
+        batch = self._pending.setdefault(key, (component, []))[1]
+        batch.append((filled_prompt, future))
+        self._counts['calls'] += 1
+        if len(batch) >= self.max_batch_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.max_wait, self._flush, key)
+        return await future
+
+    def _flush(self, key: int):
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        component, batch = self._pending.pop(key, (None, None))
+        if not batch:
+            return
+        self._counts['batches'] += 1
+        self._counts['largest_batch'] = max(self._counts['largest_batch'], len(batch))
+        task = asyncio.ensure_future(self._run(component, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, component: ProbabilisticComponent, batch: List):
+        try:
+            output_concepts = await asyncio.to_thread(component._run_filled_batch, [prompt for prompt, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), output_concept in zip(batch, output_concepts):
+            # requests that gave up in the meantime have a cancelled future
+            if not future.done():
+                future.set_result(output_concept)
+
+    def stats(self) -> Dict[str, float]:
+        stats = dict(self._counts)
+        stats['mean_batch_size'] = stats['calls'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+
+def _initial_concept(name: str, value: Union[str, List[str]]) -> Concept:
+    if isinstance(value, list):
+        return Concept(name=name, type='list', list_content=value)
+    return Concept(name=name, string_content=value)
+
+
+class _HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class PipelineServer:
+    # at most max_pending requests are worked on at once, any request beyond that is answered with a 503 right
+    # away instead of queueing up. Within a request independent steps run concurrently, up to step_concurrency
+    # at once, by default the largest Threads max_workers of the pipeline
+    def __init__(self, pipelines: Dict[str, Union[Executable, ExecutableOrchestrator, CompiledPipeline]],
+                 host: str = '127.0.0.1', port: int = 8080, max_batch_size: int = 16, max_wait: float = 0.005,
+                 max_pending: int = 256, request_timeout: Optional[float] = None, max_body: int = 1 << 20,
+                 step_concurrency: Optional[int] = None):
+        if max_pending < 1:
+            raise ValueError(f'max_pending must be a positive integer, got {max_pending}')
+        self.pipelines = {name: pipeline if isinstance(pipeline, CompiledPipeline)
+                          else compile_pipeline(pipeline, max_concurrency=step_concurrency)
+                          for name, pipeline in pipelines.items()}
+        self.host = host
+        self.port = port
+        self.max_pending = max_pending
+        self.request_timeout = request_timeout
+        self.max_body = max_body
+        self.batcher = MicroBatcher(max_batch_size, max_wait)
+        self._server: Optional[asyncio.AbstractServer] = None
+        # open connections and their handler tasks, so stop() can close idle keep-alive connections
+        self._connections: Dict[asyncio.StreamWriter, asyncio.Task] = {}
+        self._pending = 0
+        self._counts = {'requests': 0, 'completed': 0, 'rejected': 0, 'failed': 0, 'timed_out': 0}
+
+    async def run_pipeline(self, name: str, concepts: Dict[str, Union[str, List[str]]]) -> Dict:
+        # the request handling without the HTTP around it
+        if name not in self.pipelines:
+            raise _HttpError(404, f'Unknown pipeline {name!r}, available pipelines are {list(self.pipelines)}')
+        if not isinstance(concepts, dict):
+            raise _HttpError(400, '"concepts" must be an object of concept name to value')
+        try:
+            registry = ConceptRegistry([_initial_concept(concept_name, value)
+                                        for concept_name, value in concepts.items()])
+        except Exception as e:
+            raise _HttpError(400, f'Invalid concepts: {e}')
+        try:
+            registry = await self.pipelines[name].arun(registry, call=self.batcher)
+        except PipelineCompileError as e:
+            raise _HttpError(400, str(e))
+        return {'concepts': registry_to_row(registry)}
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Dict]:
+        if path == '/pipelines' and method == 'GET':
+            return 200, {'pipelines': {name: list(plan.required_inputs) for name, plan in self.pipelines.items()}}
+        if path == '/stats' and method == 'GET':
+            return 200, self.stats()
+        if not path.startswith('/pipelines/'):
+            raise _HttpError(404, f'Unknown path {path}')
+        if method != 'POST':
+            raise _HttpError(405, f'{method} is not allowed on {path}')
+
+        self._counts['requests'] += 1
+        if self._pending >= self.max_pending:
+            self._counts['rejected'] += 1
+            raise _HttpError(503, f'Overloaded, {self._pending} requests in progress')
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError as e:
+            raise _HttpError(400, f'Invalid JSON: {e}')
+        if not isinstance(payload, dict):
+            raise _HttpError(400, 'Expected a JSON object with a "concepts" object')
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            name = path[len('/pipelines/'):]
+            result = await asyncio.wait_for(self.run_pipeline(name, payload.get('concepts', {})), self.request_timeout)
+        except asyncio.TimeoutError:
+            self._counts['timed_out'] += 1
+            raise _HttpError(504, f'Pipeline did not finish within {self.request_timeout}s')
+        finally:
+            self._pending -= 1
+        self._counts['completed'] += 1
+        result['elapsed'] = time.perf_counter() - started
+        return 200, result
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # HTTP/1.1 with keep-alive, one request at a time per connection
+        self._connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length', 0))
+                try:
+                    if length > self.max_body:
+                        raise _HttpError(413, f'Request body larger than {self.max_body} bytes')
+                    status, payload = await self._dispatch(method, path.split('?', 1)[0],
+                                                           await reader.readexactly(length))
+                except _HttpError as e:
+                    status, payload = e.status, {'error': e.message}
+                except Exception as e:
+                    LOGGER.exception('Request %s %s failed', method, path)
+                    self._counts['failed'] += 1
+                    status, payload = 500, {'error': repr(e)}
+
+                close = headers.get('connection', '').lower() == 'close' or status == 413
+                body = json.dumps(payload).encode()
+                head = [f'HTTP/1.1 {status} {_REASONS[status]}', 'Content-Type: application/json',
+                        f'Content-Length: {len(body)}', f'Connection: {"close" if close else "keep-alive"}']
+                if status == 503:
+                    head.append('Retry-After: 1')
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + body)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self._connections.pop(writer, None)
+            writer.close()
+
+    def stats(self) -> Dict:
+        return {**self._counts, 'pending': self._pending, 'batching': self.batcher.stats()}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        LOGGER.info('Serving %s on http://%s:%d', list(self.pipelines), self.host, self.port)
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            handlers = list(self._connections.values())
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Serve compiled pipelines over HTTP/JSON on localhost')
+    parser.add_argument('--pipeline', action='append', required=True, metavar='NAME=MODULE:ATTRIBUTE|FILE',
+                        help='an object to import, or a .json/.yaml file written by serialization.save_pipeline')
+    parser.add_argument('--cache-dir', help='where pipeline files are cached for faster start-up')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-wait', type=float, default=0.005, help='seconds a batch waits to fill up')
+    parser.add_argument('--max-pending', type=int, default=256, help='requests in progress before answering 503')
+    parser.add_argument('--request-timeout', type=float)
+    parser.add_argument('--step-concurrency', type=int, help='steps of one request running at once, by default '
+                                                             'the largest Threads max_workers of the pipeline')
+    options = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    pipelines = {}
+    for entry in options.pipeline:
+        name, _, spec = entry.partition('=')
+        if spec.endswith(('.json', '.yaml', '.yml')):
+            # compiled here only with the pipeline's own concurrency, the server compiles it otherwise
+            pipelines[name] = load_pipeline(spec, cache_dir=options.cache_dir,
+                                            compiled=options.step_concurrency is None)
+        else:
+            pipelines[name] = load_object(spec)
+    server = PipelineServer(pipelines, options.host, options.port, options.max_batch_size, options.max_wait,
+                            options.max_pending, options.request_timeout, step_concurrency=options.step_concurrency)
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == '__main__':
+    main()
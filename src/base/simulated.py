@@ -0,0 +1,125 @@
+from typing import AsyncIterator, Dict, Iterator, Literal, Optional
+import asyncio
+import hashlib
+import math
+import random
+import threading
+import time
+
+from pydantic import StrictStr
+
+from .cache import ResponseCache
+from .executable import LanguageModel
+from .memory import MemoryBackend
+from .resilience import TransientError
+
+_WORDS = ('alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'iota', 'kappa', 'lambda', 'mu')
+
+
+class SimulatedModel(LanguageModel):
+    # a stand-in provider for tests and benchmarks. The response only depends on the seed and the prompt, latency
+    # and failures also on how often that prompt was asked before, never on thread or task scheduling
+    latency: Literal['constant', 'uniform', 'exponential', 'lognormal'] = 'constant'
+    mean_latency: float = 0.0
+    error_rate: float = 0.0
+    response_size: int = 64
+    chunk_size: int = 16
+    seed: int = 0
+
+    def __init__(self, name: StrictStr, latency: str = 'constant', mean_latency: float = 0.0, error_rate: float = 0.0,
+                 response_size: int = 64, chunk_size: int = 16, seed: int = 0,
+                 cache: Optional[ResponseCache] = None, memory: Optional[MemoryBackend] = None,
+                 provider: Optional[StrictStr] = None, coalesce: bool = True):
+        if mean_latency < 0:
+            raise ValueError(f'mean_latency must not be negative, got {mean_latency}')
+        if latency not in ('constant', 'uniform', 'exponential', 'lognormal'):
+            raise ValueError(f'Unknown latency distribution {latency!r}')
+        if not 0 <= error_rate <= 1:
+            raise ValueError(f'error_rate must be between 0 and 1, got {error_rate}')
+        super().__init__(name, cache=cache, memory=memory, provider=provider, coalesce=coalesce)
+        self.latency = latency
+        self.mean_latency = mean_latency
+        self.error_rate = error_rate
+        self.response_size = response_size
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self._calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def generation_params(self) -> Dict:
+        return {'seed': self.seed, 'response_size': self.response_size}
+
+    def _rng(self, *parts) -> random.Random:
+        return random.Random(hashlib.sha256(':'.join(map(str, (self.seed, self.name) + parts)).encode()).digest())
+
+    def _draw(self, prompt_string: str):
+        # one generator per (prompt, attempt), so a retry of a failed prompt gets a fresh outcome
+        with self._lock:
+            attempt = self._calls.get(prompt_string, 0)
+            self._calls[prompt_string] = attempt + 1
+        rng = self._rng(attempt, prompt_string)
+        return self._sample_latency(rng), rng.random() < self.error_rate
+
+    def _sample_latency(self, rng: random.Random) -> float:
+        if self.mean_latency == 0 or self.latency == 'constant':
+            return self.mean_latency
+        if self.latency == 'uniform':
+            return rng.uniform(0, 2 * self.mean_latency)
+        if self.latency == 'exponential':
+            return rng.expovariate(1 / self.mean_latency)
+        # sigma 1 gives the long right tail real providers show, the mean stays mean_latency
+        return rng.lognormvariate(0, 1) * self.mean_latency / math.exp(0.5)
+
+    def _response(self, prompt_string: str) -> str:
+        rng = self._rng(prompt_string)
+        prefix = f'{self.name}[{hashlib.sha256(prompt_string.encode()).hexdigest()[:8]}]'
+        words = []
+        size = len(prefix)
+        while size < self.response_size:
+            word = rng.choice(_WORDS)
+            words.append(word)
+            size += len(word) + 1
+        return ' '.join([prefix] + words)[:max(self.response_size, len(prefix))]
+
+    def _fail(self, prompt_string: str):
+        raise TransientError(f'{self.name} failed on a prompt of {len(prompt_string)} characters (simulated)')
+
+    def _generate(self, prompt_string: str) -> str:
+        latency, failed = self._draw(prompt_string)
+        if latency:
+            time.sleep(latency)
+        if failed:
+            self._fail(prompt_string)
+        return self._response(prompt_string)
+
+    async def _agenerate(self, prompt_string: str) -> str:
+        latency, failed = self._draw(prompt_string)
+        if latency:
+            await asyncio.sleep(latency)
+        if failed:
+            self._fail(prompt_string)
+        return self._response(prompt_string)
+
+    def _chunks(self, response: str):
+        return [response[start:start + self.chunk_size] for start in range(0, len(response), self.chunk_size)]
+
+    def _stream(self, prompt_string: str) -> Iterator[str]:
+        # the latency is spread evenly over the chunks
+        latency, failed = self._draw(prompt_string)
+        chunks = self._chunks(self._response(prompt_string))
+        for index, chunk in enumerate(chunks):
+            if latency:
+                time.sleep(latency / len(chunks))
+            if failed and index == len(chunks) // 2:
+                self._fail(prompt_string)
+            yield chunk
+
+    async def _astream(self, prompt_string: str) -> AsyncIterator[str]:
+        latency, failed = self._draw(prompt_string)
+        chunks = self._chunks(self._response(prompt_string))
+        for index, chunk in enumerate(chunks):
+            if latency:
+                await asyncio.sleep(latency / len(chunks))
+            if failed and index == len(chunks) // 2:
+                self._fail(prompt_string)
+            yield chunk
@@ -0,0 +1,111 @@
+from concurrent.futures import CancelledError, Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+import asyncio
+import threading
+
+# set for calls that must not wait on an identical call in flight. Hedges and retries exist to get away from a
+# call that is slow or failed, joining that very call would defeat them
+_FRESH: ContextVar[bool] = ContextVar('lexflow_fresh_call', default=False)
+
+_MISSING = object()
+
+
+@contextmanager
+def fresh_calls():
+    token = _FRESH.set(True)
+    try:
+        yield
+    finally:
+        _FRESH.reset(token)
+
+
+class SingleFlight:
+    # coalesces identical calls in flight: the first caller for a key runs the call, callers arriving before it
+    # finished wait for it and share its result or its exception. Waiters wait on a concurrent.futures.Future, so
+    # threads and event loops can share the same call
+    def __init__(self):
+        # key -> the future the waiters wait on, or None until a second caller shows up. Most calls are never
+        # shared and don't pay for a future
+        self._flights: Dict[Hashable, Optional[Future]] = {}
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._saved = 0
+
+    def _join(self, key: Hashable) -> Optional[Future]:
+        # None for the caller that runs the call, the future to wait on for the others
+        with self._lock:
+            self._calls += 1
+            future = self._flights.get(key, _MISSING)
+            if future is _MISSING:
+                self._flights[key] = None
+                return None
+            if future is None:
+                future = self._flights[key] = Future()
+            self._saved += 1
+            return future
+
+    def _settle(self, key: Hashable, result: Any = None, error: Optional[BaseException] = None):
+        with self._lock:
+            future = self._flights.pop(key)
+        if future is None:
+            return
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # the caller running the call was cancelled or interrupted, which says nothing about the call itself.
+            # The waiters start over
+            future.cancel()
+
+    def do(self, key: Hashable, fn: Callable, *args) -> Tuple[Any, bool]:
+        # returns the result and whether it was shared from another caller's call
+        if _FRESH.get():
+            return fn(*args), False
+        while True:
+            future = self._join(key)
+            if future is None:
+                try:
+                    result = fn(*args)
+                except BaseException as e:
+                    self._settle(key, error=e)
+                    raise
+                self._settle(key, result)
+                return result, False
+            try:
+                return future.result(), True
+            except CancelledError:
+                continue
+
+    async def ado(self, key: Hashable, fn: Callable[..., Awaitable], *args) -> Tuple[Any, bool]:
+        if _FRESH.get():
+            return await fn(*args), False
+        while True:
+            future = self._join(key)
+            if future is None:
+                try:
+                    result = await fn(*args)
+                except BaseException as e:
+                    self._settle(key, error=e)
+                    raise
+                self._settle(key, result)
+                return result, False
+            try:
+                # shielded, so a waiter being cancelled doesn't cancel the call the other waiters share
+                return await asyncio.shield(asyncio.wrap_future(future)), True
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'calls': self._calls, 'saved': self._saved, 'in_flight': len(self._flights)}
+
+    def reset_stats(self):
+        with self._lock:
+            self._calls = self._saved = 0
+
+
+FLIGHTS = SingleFlight()
@@ -0,0 +1,109 @@
+from string import Formatter
+from typing import Any, List, Mapping, Sequence, Tuple
+
+from .lazy import LazyText, RenderedPrompt
+
+_CONVERSIONS = {'r': repr, 's': str, 'a': ascii}
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class CompiledTemplate:
+    # a template parsed once into literal parts with holes at the slot positions. Filling copies the
+    # part list, drops the values into the holes and joins, so concept values are never re-parsed or
+    # concatenated pairwise
+    __slots__ = ('template', 'inputs', '_parts', '_slots')
+
+    def __init__(self, template: str, inputs: Tuple[str, ...], parts: List[str], slots: Tuple[Tuple, ...]):
+        self.template = template
+        self.inputs = inputs
+        self._parts = parts
+        # (position in parts, index into inputs, conversion, format spec)
+        self._slots = slots
+
+    def render(self, values: Sequence[Any]) -> str:
+        # values are aligned with self.inputs
+        parts = self._parts.copy()
+        lazy = False
+        for position, input_index, conversion, format_spec in self._slots:
+            value = values[input_index]
+            if conversion is not None:
+                value = _CONVERSIONS[conversion](value)
+            if format_spec or not isinstance(value, str):
+                lazy = lazy or isinstance(value, LazyText)
+                value = format(value, format_spec)
+            parts[position] = value
+        if lazy:
+            return RenderedPrompt(''.join(parts), self._render_reference(values))
+        return ''.join(parts)
+
+    def _render_reference(self, values: Sequence[Any]) -> str:
+        # file-backed values are shown by their repr rather than read
+        parts = self._parts.copy()
+        for position, input_index, conversion, format_spec in self._slots:
+            value = values[input_index]
+            if isinstance(value, LazyText):
+                parts[position] = repr(value)
+                continue
+            if conversion is not None:
+                value = _CONVERSIONS[conversion](value)
+            if format_spec or not isinstance(value, str):
+                value = format(value, format_spec)
+            parts[position] = value
+        return ''.join(parts)
+
+    def render_mapping(self, values: Mapping[str, Any]) -> str:
+        return self.render([values[name] for name in self.inputs])
+
+    def __repr__(self) -> str:
+        return f'CompiledTemplate({self.template!r})'
+
+
+def compile_template(template: str) -> CompiledTemplate:
+    try:
+        parsed = list(Formatter().parse(template))
+    except ValueError as e:
+        raise TemplateError(f'Malformed template {template!r}: {e}. Literal braces must be escaped as {{{{ and }}}}')
+
+    inputs: List[str] = []
+    parts: List[str] = []
+    slots = []
+    for literal, field_name, format_spec, conversion in parsed:
+        if literal:
+            # escaped braces come back as separate literals, merge them with the previous one
+            if parts and not _is_hole(parts, slots):
+                parts[-1] += literal
+            else:
+                parts.append(literal)
+        if field_name is None:
+            continue
+        _validate_field(template, field_name, format_spec, conversion)
+        if field_name not in inputs:
+            inputs.append(field_name)
+        slots.append((len(parts), inputs.index(field_name), conversion, format_spec))
+        parts.append('')
+
+    return CompiledTemplate(template, tuple(inputs), parts, tuple(slots))
+
+
+def _is_hole(parts: List[str], slots: List[Tuple]) -> bool:
+    return bool(slots) and slots[-1][0] == len(parts) - 1
+
+
+def _validate_field(template: str, field_name: str, format_spec: str, conversion):
+    if not field_name:
+        raise TemplateError(f'Empty placeholder {{}} in template {template!r}, placeholders must name a concept')
+    if field_name.isdigit():
+        raise TemplateError(f'Positional placeholder {{{field_name}}} in template {template!r}, '
+                            f'placeholders must name a concept')
+    if '.' in field_name or '[' in field_name:
+        raise TemplateError(f'Attribute or index access in placeholder {{{field_name}}} of template {template!r} '
+                            f'is not supported')
+    if conversion is not None and conversion not in _CONVERSIONS:
+        raise TemplateError(f'Unknown conversion !{conversion} for placeholder {{{field_name}}} in template '
+                            f'{template!r}')
+    if format_spec and ('{' in format_spec or '}' in format_spec):
+        raise TemplateError(f'Nested placeholders in the format spec of {{{field_name}}} in template {template!r} '
+                            f'are not supported')
@@ -0,0 +1,199 @@
+from abc import ABC, abstractmethod
+from contextvars import ContextVar, copy_context
+from dataclasses import dataclass, field, asdict
+from itertools import count
+from typing import Any, Callable, Dict, List, Optional
+import json
+import logging
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# None means tracing is off, every hook then returns straight away
+_TRACER: Optional['Tracer'] = None
+_CURRENT_SPAN: ContextVar[Optional['Span']] = ContextVar('lexflow_current_span', default=None)
+_QUEUE_WAIT: ContextVar[float] = ContextVar('lexflow_queue_wait', default=0.0)
+_SPAN_IDS = count(1)
+
+
+@dataclass
+class Span:
+    kind: str
+    name: str
+    span_id: int
+    parent_id: Optional[int]
+    start_time: float
+    queue_wait: float = 0.0
+    duration: Optional[float] = None
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class SpanExporter(ABC):
+    @abstractmethod
+    def export(self, span: Span):
+        pass
+
+
+class Tracer:
+    def __init__(self, exporters: List[SpanExporter] = None):
+        self.exporters = exporters if exporters else []
+
+    def finish(self, span: Span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception:
+                LOGGER.warning('Span exporter %s failed', type(exporter).__name__, exc_info=True)
+
+
+class _SpanScope:
+    __slots__ = ('tracer', 'span', 'token', 'started')
+
+    def __init__(self, tracer: Tracer, kind: str, name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        parent = _CURRENT_SPAN.get()
+        queue_wait = _QUEUE_WAIT.get()
+        if queue_wait:
+            _QUEUE_WAIT.set(0.0)
+        self.span = Span(kind=kind, name=name, span_id=next(_SPAN_IDS),
+                         parent_id=parent.span_id if parent is not None else None,
+                         start_time=time.time(), queue_wait=queue_wait, attributes=attributes)
+
+    def __enter__(self) -> Span:
+        self.token = _CURRENT_SPAN.set(self.span)
+        self.started = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.span.duration = time.perf_counter() - self.started
+        if exc is not None:
+            self.span.error = repr(exc)
+        _CURRENT_SPAN.reset(self.token)
+        self.tracer.finish(self.span)
+        return False
+
+
+class _NoopScope:
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NOOP_SCOPE = _NoopScope()
+
+
+def traced(kind: str, name: str, **attributes):
+    # with traced('component', 'joke', prompt_size=...) as span: ... span is None when tracing is off
+    tracer = _TRACER
+    if tracer is None:
+        return _NOOP_SCOPE
+    return _SpanScope(tracer, kind, name, attributes)
+
+
+def annotate(**attributes):
+    # adds attributes to the innermost open span, e.g. cache hits recorded by the model
+    if _TRACER is None:
+        return
+    span = _CURRENT_SPAN.get()
+    if span is not None:
+        span.attributes.update(attributes)
+
+
+def record_queue_wait(seconds: float):
+    if _TRACER is not None:
+        _QUEUE_WAIT.set(seconds)
+
+
+def submit(executor, fn: Callable, *args, **kwargs):
+    # executor.submit that carries the caller's context (current span, deadlines) into the worker thread
+    # and records how long the task waited for a worker
+    context = copy_context()
+    submitted_at = time.perf_counter()
+
+    def call():
+        record_queue_wait(time.perf_counter() - submitted_at)
+        return fn(*args, **kwargs)
+
+    return executor.submit(context.run, call)
+
+
+def set_tracer(tracer: Optional[Tracer]) -> Optional[Tracer]:
+    global _TRACER
+    previous, _TRACER = _TRACER, tracer
+    return previous
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _TRACER
+
+
+class InMemoryStats(SpanExporter):
+    # aggregates spans per kind and name. A batched component span stands for batch_size calls, so calls and
+    # cache_hits count prompts, not spans
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        key = f'{span.kind}:{span.name}'
+        with self._lock:
+            stats = self._stats.setdefault(key, {'count': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0,
+                                                 'total_queue_wait': 0.0, 'prompt_size': 0, 'response_size': 0,
+                                                 'calls': 0, 'cache_hits': 0})
+            stats['count'] += 1
+            stats['errors'] += span.error is not None
+            stats['total_time'] += span.duration
+            stats['max_time'] = max(stats['max_time'], span.duration)
+            stats['total_queue_wait'] += span.queue_wait
+            stats['prompt_size'] += span.attributes.get('prompt_size', 0)
+            stats['response_size'] += span.attributes.get('response_size', 0)
+            stats['calls'] += span.attributes.get('batch_size', 1)
+            if 'cache_hits' in span.attributes:
+                stats['cache_hits'] += span.attributes['cache_hits']
+            else:
+                stats['cache_hits'] += bool(span.attributes.get('cache_hit'))
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            snapshot = {key: dict(stats) for key, stats in self._stats.items()}
+        for stats in snapshot.values():
+            stats['mean_time'] = stats['total_time'] / stats['count']
+            stats['cache_hit_rate'] = stats['cache_hits'] / stats['calls'] if stats['calls'] else 0.0
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class JsonLinesExporter(SpanExporter):
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class CallbackExporter(SpanExporter):
+    def __init__(self, callback: Callable[[Span], Any]):
+        self.callback = callback
+
+    def export(self, span: Span):
+        self.callback(span)
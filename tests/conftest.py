@@ -0,0 +1,11 @@
+import pytest
+
+from base import LIMITERS
+
+
+@pytest.fixture
+def limiter_key(request):
+    # limiters are process wide, every test gets its own key and removes it afterwards
+    key = f'test-{request.node.name}'
+    yield key
+    LIMITERS.remove(key)
@@ -0,0 +1,15 @@
+from base import Concept, ConceptRegistry, ProbabilisticComponent, Prompt
+from base.simulated import SimulatedModel
+
+
+def registry(**values) -> ConceptRegistry:
+    return ConceptRegistry([Concept(name=name, type='list', list_content=value) if isinstance(value, list)
+                            else Concept(name=name, string_content=value) for name, value in values.items()])
+
+
+def step(name: str, template: str, output: str, **model_options) -> ProbabilisticComponent:
+    return ProbabilisticComponent(SimulatedModel(name, **model_options), Prompt(template, Concept(output)))
+
+
+def values(concept_registry: ConceptRegistry) -> dict:
+    return {name: concept.get_value() for name, concept in concept_registry.concepts.items()}
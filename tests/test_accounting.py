@@ -0,0 +1,56 @@
+import pytest
+
+from base import Chain, LRUCache, ModelPrice, UsageMeter, estimate_tokens, set_meter
+from helpers import registry, step
+
+
+@pytest.fixture
+def meter():
+    meter = UsageMeter(prices={'first': ModelPrice(prompt_per_1k=1.0, response_per_1k=2.0)}, tokenizer=len)
+    previous = set_meter(meter)
+    yield meter
+    set_meter(previous)
+
+
+def test_usage_is_attributed_to_components_and_models(meter):
+    first = step('first', 'first {subject}', 'a', response_size=20)
+    Chain([first, step('second', 'second {a}', 'b', response_size=10)]).run(registry(subject='cats'))
+    snapshot = meter.snapshot()
+    assert set(snapshot['components']) == {'a', 'b'}
+    assert snapshot['models']['first'] == snapshot['components']['a']
+    usage = snapshot['components']['a']
+    assert (usage['calls'], usage['prompt_tokens'], usage['response_tokens']) == (1, 10, 20)
+    assert usage['cost'] == pytest.approx((10 * 1.0 + 20 * 2.0) / 1000)
+    assert snapshot['components']['b']['cost'] == 0
+    assert snapshot['total']['calls'] == 2
+
+
+def test_cache_hits_are_counted_but_cost_nothing(meter):
+    component = step('first', 'first {subject}', 'a', cache=LRUCache())
+    component.run(registry(subject='cats'))
+    component.run(registry(subject='cats'))
+    usage = meter.snapshot()['components']['a']
+    assert (usage['calls'], usage['cache_hits']) == (2, 1)
+    # the cost of a single call
+    single = UsageMeter(prices=meter.prices, tokenizer=len)
+    set_meter(single)
+    step('first', 'first {subject}', 'a').run(registry(subject='cats'))
+    assert usage['cost'] == pytest.approx(single.snapshot()['total']['cost'])
+
+
+def test_calls_outside_components_are_direct_calls(meter):
+    step('first', 'first {subject}', 'a').model.generate_response('cats')
+    assert list(meter.snapshot()['components']) == ['(direct)']
+
+
+def test_prometheus_export_has_a_sample_per_component(meter):
+    step('first', 'first {subject}', 'a').run(registry(subject='cats'))
+    text = meter.prometheus()
+    assert '# TYPE lexflow_calls_total counter' in text
+    assert 'lexflow_calls_total{component="a",model="first"} 1' in text
+    assert '# TYPE lexflow_max_prompt_tokens gauge' in text
+
+
+def test_tokens_are_estimated_without_a_tokenizer():
+    assert estimate_tokens('') == 1
+    assert estimate_tokens('x' * 40) == 10
@@ -0,0 +1,42 @@
+import pytest
+
+from base import run_batch
+from base.jobs import DistributedExecutor, SQLiteJobQueue, Worker
+from helpers import registry, step
+
+
+def pipeline():
+    return step('summary', 'summarise {text} in {words} words', 'summary')
+
+
+def test_batch_matches_single_runs_in_input_order():
+    rows = [{'text': f'text {i}', 'words': i} for i in range(10)]
+    results = list(run_batch(pipeline(), rows, chunk_size=3, max_workers=2))
+    assert [result['summary'] for result in results] == \
+        [pipeline().run(registry(text=f'text {i}', words=str(i))).get_value() for i in range(10)]
+
+
+def test_list_values_become_list_concepts():
+    results = list(run_batch(step('joined', 'join {parts}', 'joined'), [{'parts': ['a', 'b']}]))
+    assert results[0]['parts'] == ['a', 'b']
+
+
+@pytest.mark.parametrize('value', [None, float('nan')])
+def test_missing_values_are_an_error(value):
+    with pytest.raises(ValueError, match="Row 1 has no value for 'words'"):
+        list(run_batch(pipeline(), [{'text': 'a', 'words': 1}, {'text': 'b', 'words': value}]))
+
+
+def test_other_values_are_a_type_error():
+    with pytest.raises(TypeError, match="Row 0 has a dict for 'words'"):
+        list(run_batch(pipeline(), [{'text': 'a', 'words': {}}]))
+
+
+def test_distributed_results_match_run_batch(tmp_path):
+    queue = SQLiteJobQueue(str(tmp_path / 'jobs.db'))
+    executor = DistributedExecutor(queue, poll_interval=0.01)
+    rows = [{'text': f'text {i}', 'words': i} for i in range(3)] + [registry(text='text 3', words='3')]
+    run_id = executor.submit(pipeline(), rows)
+    assert Worker(queue, poll_interval=0.01).run(idle_timeout=0.05) == 4
+    expected = list(run_batch(pipeline(), rows[:3] + [{'text': 'text 3', 'words': '3'}]))
+    assert executor.results(run_id, timeout=5) == expected
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from base import LRUCache, SQLiteCache, TieredCache, make_cache_key
+from helpers import registry, step
+
+
+def test_lru_cache_evicts_the_least_recently_used_entry():
+    cache = LRUCache(max_entries=2)
+    cache.set('a', '1')
+    cache.set('b', '2')
+    assert cache.get('a') == '1'
+    cache.set('c', '3')
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == ('1', '3')
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1, 'size': 2}
+
+
+def test_lru_cache_rejects_an_empty_size():
+    with pytest.raises(ValueError):
+        LRUCache(max_entries=0)
+
+
+def test_expired_entries_are_evicted():
+    for cache in (LRUCache(ttl=0.01), SQLiteCache(':memory:', ttl=0.01)):
+        cache.set('a', '1')
+        assert cache.get('a') == '1'
+        time.sleep(0.02)
+        assert cache.get('a') is None
+        assert cache.evictions == 1
+
+
+def test_sqlite_cache_persists_and_bounds_its_entries(tmp_path):
+    path = str(tmp_path / 'responses.db')
+    cache = SQLiteCache(path, max_entries=2)
+    for key in 'abc':
+        cache.set(key, key.upper())
+    assert len(cache) == 2
+    assert cache.evictions == 1
+    cache.close()
+    reopened = SQLiteCache(path)
+    assert (reopened.get('a'), reopened.get('b'), reopened.get('c')) == (None, 'B', 'C')
+    reopened.close()
+
+
+def test_tiered_cache_promotes_disk_hits_to_memory():
+    disk = SQLiteCache(':memory:')
+    disk.set('a', '1')
+    cache = TieredCache(LRUCache(), disk)
+    assert cache.get('a') == '1'
+    assert cache.memory.get('a') == '1'
+    cache.set('b', '2')
+    assert disk.get('b') == '2'
+    stats = cache.stats()
+    assert (stats['hits'], stats['disk_hits'], stats['memory_hits']) == (1, 2, 1)
+
+
+def test_cache_keys_depend_on_every_part():
+    assert make_cache_key('model', 'prompt') == make_cache_key('model', 'prompt')
+    assert make_cache_key('model', 'prompt') != make_cache_key('other', 'prompt')
+
+
+def test_a_cached_model_answers_repeated_prompts_once():
+    component = step('summary', 'summarise {text}', 'summary', cache=LRUCache())
+    first = component.run(registry(text='a')).get_value()
+    assert component.run(registry(text='a')).get_value() == first
+    assert sum(component.model._calls.values()) == 1
+    assert component.model.cache.stats()['hits'] == 1
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from base import Chain, CheckpointedPipeline, CheckpointStore, Concept, ConceptRegistry, TransientError
+from helpers import registry, step, values
+
+
+def pipeline():
+    return Chain([step('first', 'first {subject}', 'a'),
+                  step('second', 'second {a}', 'b'),
+                  step('third', 'third {b}', 'c')])
+
+
+def calls(chain: Chain):
+    return [sum(component.model._calls.values()) for component in chain.components]
+
+
+def test_resume_only_reruns_the_steps_that_did_not_complete(tmp_path):
+    chain = pipeline()
+    expected = values(pipeline().run(registry(subject='cats')))
+    checkpointed = CheckpointedPipeline(chain, CheckpointStore(str(tmp_path)))
+    chain.components[2].model.error_rate = 1.0
+    with pytest.raises(TransientError):
+        checkpointed.run(registry(subject='cats'), 'run')
+    assert calls(chain) == [1, 1, 1]
+
+    chain.components[2].model.error_rate = 0.0
+    assert values(checkpointed.run(registry(subject='cats'), 'run')) == expected
+    assert calls(chain) == [1, 1, 2]
+    # finished runs are deleted unless keep=True
+    assert checkpointed.store.load('run') is None
+
+
+def test_async_resume_from_the_stored_inputs(tmp_path):
+    chain = pipeline()
+    expected = values(pipeline().run(registry(subject='cats')))
+    checkpointed = CheckpointedPipeline(chain, CheckpointStore(str(tmp_path)), keep=True)
+    chain.components[1].model.error_rate = 1.0
+    with pytest.raises(TransientError):
+        asyncio.run(checkpointed.arun(registry(subject='cats'), 'run'))
+
+    chain.components[1].model.error_rate = 0.0
+    assert values(checkpointed.resume('run')) == expected
+    assert calls(chain) == [1, 2, 1]
+    assert checkpointed.store.run_ids() == ['run']
+
+
+def test_restored_concepts_keep_every_field(tmp_path):
+    split = step('split', 'split {subject}', 'parts')
+    # a lambda can't be written to the checkpoint, the restored concept takes it from the component
+    split.prompt.output = Concept('parts', type='list', choice='index', index=2, listify_func=lambda text: text.split())
+    chain = Chain([split, step('last', 'last {parts}', 'last')])
+    expected = values(chain.run(registry(subject='cats')))
+    checkpointed = CheckpointedPipeline(chain, CheckpointStore(str(tmp_path)))
+    chain.components[1].model.error_rate = 1.0
+    with pytest.raises(TransientError):
+        checkpointed.run(registry(subject='cats'), 'run')
+
+    chain.components[1].model.error_rate = 0.0
+    result = checkpointed.resume('run')
+    # the second step only sees the third word of the restored output if choice, index and listify_func survived
+    assert values(result) == expected
+    # one call each for the reference run, the failed run and the resume, split is not called again
+    assert calls(chain) == [2, 3]
+    parts = result.concepts['parts']
+    assert (parts.choice, parts.index, parts.listify_func) == ('index', 2, split.prompt.output.listify_func)
+
+
+def test_a_changed_pipeline_does_not_resume(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    chain = pipeline()
+    chain.components[2].model.error_rate = 1.0
+    with pytest.raises(TransientError):
+        CheckpointedPipeline(chain, store).run(registry(subject='cats'), 'run')
+
+    changed = pipeline()
+    changed.components[1].prompt.template = 'changed {a}'
+    with pytest.raises(ValueError, match='different pipeline'):
+        CheckpointedPipeline(changed, store).run(registry(subject='cats'), 'run')
+
+
+def test_changed_inputs_do_not_resume(tmp_path):
+    store = CheckpointStore(str(tmp_path))
+    chain = pipeline()
+    chain.components[2].model.error_rate = 1.0
+    with pytest.raises(TransientError):
+        CheckpointedPipeline(chain, store).run(registry(subject='cats'), 'run')
+
+    with pytest.raises(ValueError, match='different value'):
+        CheckpointedPipeline(pipeline(), store).run(ConceptRegistry([Concept('subject', string_content='dogs')]),
+                                                    'run')
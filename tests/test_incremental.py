@@ -0,0 +1,74 @@
+import asyncio
+import threading
+
+from base import Chain, Concept, IncrementalPipeline, IncrementalReport, Prompt, SQLiteCache, Threads
+from helpers import registry, step, values
+
+
+def pipeline():
+    return Chain([Threads([step('first', 'first {subject}', 'a'), step('second', 'second {topic}', 'b')],
+                          max_workers=2),
+                  step('third', 'third {a} {b}', 'c')])
+
+
+def calls(chain: Chain):
+    branches, last = chain.components
+    return [sum(component.model._calls.values()) for component in branches.components + [last]]
+
+
+def test_only_the_steps_downstream_of_a_change_run_again():
+    chain = pipeline()
+    incremental = IncrementalPipeline(chain)
+    first = IncrementalReport()
+    incremental.run(registry(subject='cats', topic='food'), report=first)
+    assert sorted(first.recomputed) == ['a', 'b', 'c']
+    assert first.reused == []
+
+    second = IncrementalReport()
+    result = incremental.run(registry(subject='cats', topic='sleep'), report=second)
+    assert sorted(second.reused) == ['a']
+    assert sorted(second.recomputed) == ['b', 'c']
+    assert calls(chain) == [1, 2, 2]
+    assert values(result) == values(pipeline().run(registry(subject='cats', topic='sleep')))
+
+
+def test_an_unchanged_run_reuses_every_step():
+    chain = pipeline()
+    incremental = IncrementalPipeline(chain)
+    incremental.run(registry(subject='cats', topic='food'))
+    report = IncrementalReport()
+    result = asyncio.run(incremental.arun(registry(subject='cats', topic='food'), report=report))
+    assert sorted(report.reused) == ['a', 'b', 'c']
+    assert calls(chain) == [1, 1, 1]
+    assert values(result) == values(pipeline().run(registry(subject='cats', topic='food')))
+
+
+def test_a_changed_prompt_is_recomputed():
+    cache = SQLiteCache(':memory:')
+    IncrementalPipeline(pipeline(), cache).run(registry(subject='cats', topic='food'))
+    changed = pipeline()
+    changed.components[1].prompt = Prompt('changed {a} {b}', Concept('c'))
+    report = IncrementalReport()
+    IncrementalPipeline(changed, cache).run(registry(subject='cats', topic='food'), report=report)
+    assert sorted(report.reused) == ['a', 'b']
+    assert report.recomputed == ['c']
+
+
+def test_concurrent_runs_keep_their_own_report():
+    incremental = IncrementalPipeline(pipeline())
+    incremental.run(registry(subject='cats', topic='food'))
+    reports = {topic: IncrementalReport() for topic in ('food', 'sleep', 'play', 'naps')}
+    barrier = threading.Barrier(len(reports))
+
+    def run(topic: str):
+        barrier.wait()
+        incremental.run(registry(subject='cats', topic=topic), report=reports[topic])
+
+    threads = [threading.Thread(target=run, args=(topic,)) for topic in reports]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(reports['food'].reused) == ['a', 'b', 'c']
+    for topic in ('sleep', 'play', 'naps'):
+        assert sorted(reports[topic].recomputed) == ['b', 'c']
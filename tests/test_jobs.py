@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from base import Chain
+from base.jobs import DONE, FAILED, PENDING, RUNNING, DistributedExecutor, JobFailedError, SQLiteJobQueue, Worker
+from base.simulated import SimulatedModel
+from helpers import registry, step, values
+
+
+def pipeline():
+    return Chain([step('first', 'first {subject}', 'a'), step('second', 'second {a}', 'b')])
+
+
+def submitted(tmp_path, rows, **options):
+    queue = SQLiteJobQueue(str(tmp_path / 'jobs.db'), **options)
+    executor = DistributedExecutor(queue, poll_interval=0.01)
+    return queue, executor, executor.submit(pipeline(), rows, run_id='run')
+
+
+def test_a_job_whose_lease_ran_out_goes_to_the_next_worker(tmp_path):
+    queue, _, run_id = submitted(tmp_path, [{'subject': 'cats'}], lease=0.05)
+    job = queue.claim('first')
+    assert (job.status, job.worker, job.attempts) == (RUNNING, 'first', 1)
+    assert queue.claim('second') is None
+    time.sleep(0.06)
+    retried = queue.claim('second')
+    assert (retried.job_id, retried.attempts) == (job.job_id, 2)
+    # the first worker is too late, its result is dropped
+    assert not queue.complete(job.job_id, 'first', [])
+    assert not queue.heartbeat(job.job_id, 'first')
+    assert queue.complete(retried.job_id, 'second', [])
+    assert queue.status(run_id) == {PENDING: 0, RUNNING: 0, DONE: 1, FAILED: 0}
+
+
+def test_a_job_that_keeps_losing_its_worker_fails(tmp_path):
+    queue, executor, run_id = submitted(tmp_path, [{'subject': 'cats'}], lease=0.01, max_attempts=2)
+    for worker in ('first', 'second'):
+        assert queue.claim(worker) is not None
+        time.sleep(0.02)
+    assert queue.claim('third') is None
+    with pytest.raises(JobFailedError, match='Lost its worker 2 times'):
+        executor.results(run_id, timeout=1)
+
+
+def test_pipeline_errors_fail_the_job(tmp_path):
+    queue, executor, run_id = submitted(tmp_path, [{'subject': 'cats'}, {'subject': 'dogs'}])
+    worker = Worker(queue, models={'first': SimulatedModel('first', error_rate=1.0)}, poll_interval=0.01)
+    assert worker.run(idle_timeout=0.05) == 2
+    assert (worker.completed, worker.failed) == (0, 2)
+    assert queue.status(run_id)[FAILED] == 2
+    with pytest.raises(JobFailedError, match='2 of 2 jobs'):
+        executor.results(run_id, timeout=1)
+    assert queue.delete(run_id) == 2
+    with pytest.raises(KeyError):
+        executor.wait(run_id, timeout=1)
+
+
+def test_targeted_jobs_only_run_what_the_targets_need(tmp_path):
+    queue = SQLiteJobQueue(str(tmp_path / 'jobs.db'))
+    executor = DistributedExecutor(queue, poll_interval=0.01)
+    run_id = executor.submit(pipeline(), [{'subject': 'cats'}], targets=['a'])
+    Worker(queue, poll_interval=0.01).run(max_jobs=1)
+    expected = values(pipeline().run(registry(subject='cats'), targets=['a']))
+    assert executor.results(run_id, timeout=1) == [expected]
+
+
+def test_queue_options_are_validated(tmp_path):
+    with pytest.raises(ValueError):
+        SQLiteJobQueue(str(tmp_path / 'jobs.db'), lease=0)
+    with pytest.raises(ValueError):
+        SQLiteJobQueue(str(tmp_path / 'jobs.db'), max_attempts=0)
@@ -0,0 +1,51 @@
+import pytest
+
+from base import Concept, ConceptRegistry, LazyText, Prompt, RingBufferMemory, RenderedPrompt, compact_prompt
+from helpers import step
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / 'document.txt'
+    path.write_text('first line\nsecond line\nthird line', encoding='utf-8')
+    return str(path)
+
+
+def test_views_read_their_byte_range(document):
+    text = LazyText(document)
+    assert text.size == 33
+    assert text[:10].read() == 'first line'
+    assert text.slice(11, 22).read() == 'second line'
+    assert list(text.lines()) == ['first line', 'second line', 'third line']
+    assert [window.read() for window in text.windows(16, overlap=4)] == \
+        ['first line\nsecon', 'econd line\nthird', 'hird line']
+    with pytest.raises(ValueError):
+        LazyText(document, start=40)
+
+
+def test_utf8_views_stay_on_character_boundaries(tmp_path):
+    path = tmp_path / 'accents.txt'
+    path.write_text('é' * 4, encoding='utf-8')
+    text = LazyText(str(path))
+    assert [window.read() for window in text.windows(3)] == ['éé', 'éé']
+
+
+def test_repr_and_logs_do_not_read_the_file(document):
+    text = LazyText(document)
+    assert repr(text) == f'LazyText({document!r}, 0:33, 33 B)'
+    concepts = ConceptRegistry([Concept('document', string_content=text)])
+    assert 'first line' not in repr(concepts)
+    assert text._source._map is None
+
+
+def test_prompts_read_the_text_and_memory_keeps_the_reference(document):
+    text = LazyText(document)[:10]
+    prompt = Prompt('summarise {document}', Concept('summary'))
+    rendered = prompt.render({'document': Concept('document', string_content=text)})
+    assert isinstance(rendered, RenderedPrompt)
+    assert rendered == 'summarise first line'
+    assert compact_prompt(rendered) == f'summarise {text!r}'
+
+    component = step('summary', 'summarise {document}', 'summary', memory=RingBufferMemory(8))
+    component.run(ConceptRegistry([Concept('document', string_content=text)]))
+    assert [entry[0] for entry in component.model.memory] == [f'summarise {text!r}']
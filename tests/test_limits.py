@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from base import LIMITERS
+
+
+def wait_for_queue(limiter, depth: int):
+    deadline = time.monotonic() + 5
+    while limiter.stats()['queue_depth'] < depth:
+        assert time.monotonic() < deadline, 'the waiter never queued'
+        time.sleep(0.001)
+
+
+def test_rejects_a_non_positive_in_flight_limit(limiter_key):
+    with pytest.raises(ValueError):
+        LIMITERS.configure(limiter_key, max_in_flight=0)
+
+
+def test_unconfigured_keys_are_not_limited(limiter_key):
+    with LIMITERS.limit(limiter_key, 'prompt'):
+        pass
+    assert LIMITERS.get(limiter_key) is None
+
+
+def test_threads_get_the_slot_in_arrival_order(limiter_key):
+    limiter = LIMITERS.configure(limiter_key, max_in_flight=1)
+    order = []
+
+    def worker(number: int):
+        with limiter.limit():
+            order.append(number)
+
+    limiter.acquire()
+    threads = []
+    for number in range(5):
+        thread = threading.Thread(target=worker, args=(number,))
+        thread.start()
+        threads.append(thread)
+        # the holder counts as queued until it was recorded, so the first waiter makes it two
+        wait_for_queue(limiter, number + 1)
+    limiter.release()
+    for thread in threads:
+        thread.join()
+    assert order == list(range(5))
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_tasks_get_the_slot_in_arrival_order(limiter_key):
+    limiter = LIMITERS.configure(limiter_key, max_in_flight=1)
+    order = []
+
+    async def worker(number: int):
+        async with limiter.alimit():
+            order.append(number)
+            await asyncio.sleep(0)
+
+    async def main():
+        await limiter.acquire_async()
+        tasks = []
+        for number in range(5):
+            tasks.append(asyncio.ensure_future(worker(number)))
+            await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == list(range(5))
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_in_flight_never_exceeds_the_limit(limiter_key):
+    limiter = LIMITERS.configure(limiter_key, max_in_flight=2)
+    peak = []
+    lock = threading.Lock()
+    active = [0]
+
+    def worker():
+        with limiter.limit():
+            with lock:
+                active[0] += 1
+                peak.append(active[0])
+            time.sleep(0.005)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+    assert limiter.stats()['acquired'] == 8
+
+
+def test_cancelled_waiter_gives_up_its_place(limiter_key):
+    limiter = LIMITERS.configure(limiter_key, max_in_flight=1)
+
+    async def main():
+        await limiter.acquire_async()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        limiter.release()
+        await asyncio.wait_for(limiter.acquire_async(), 1)
+        limiter.release()
+
+    asyncio.run(main())
+    assert limiter.stats()['in_flight'] == 0
+    assert limiter.stats()['queue_depth'] == 0
+
+
+def test_cancelled_waiter_releases_a_slot_it_was_handed(limiter_key):
+    limiter = LIMITERS.configure(limiter_key, max_in_flight=1)
+
+    async def main():
+        await limiter.acquire_async()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.01)
+        # the slot goes to the waiter, which is cancelled before it gets to run
+        limiter.release()
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.wait_for(limiter.acquire_async(), 1)
+        limiter.release()
+
+    asyncio.run(main())
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_cancelled_rate_wait_releases_the_slot(limiter_key):
+    limiter = LIMITERS.configure(limiter_key, max_in_flight=1, requests_per_second=1)
+
+    async def main():
+        async with LIMITERS.alimit(limiter_key):
+            pass
+        # the bucket is empty, the second request holds the slot while it waits for the rate
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.05)
+        assert limiter.stats()['in_flight'] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(main())
+    assert limiter.stats()['in_flight'] == 0
+    assert limiter.stats()['queue_depth'] == 0
+
+
+def test_requests_per_second_spaces_out_requests(limiter_key):
+    limiter = LIMITERS.configure(limiter_key, requests_per_second=20)
+    started = time.perf_counter()
+    for _ in range(25):
+        with limiter.limit():
+            pass
+    # a full bucket of 20, then 5 more at 20 per second
+    assert time.perf_counter() - started >= 0.2
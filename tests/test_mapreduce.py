@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from base import Chain, Concept, MapReduce, TransientError
+from helpers import registry, step
+
+
+def summaries(**options) -> MapReduce:
+    return MapReduce('sections', step('mapper', 'summarise {item}', 'summary', latency='uniform',
+                                      mean_latency=0.002), Concept('summaries', type='list'), **options)
+
+
+def test_map_results_keep_the_input_order():
+    sections = [f'section {i}' for i in range(8)]
+    expected = [step('mapper', 'summarise {item}', 'summary').run(registry(item=section)).get_value()
+                for section in sections]
+    assert summaries(max_concurrency=4).run(registry(sections=sections)).list_content == expected
+    assert asyncio.run(summaries(max_concurrency=4).arun(registry(sections=sections))).list_content == expected
+
+
+def test_reduction_is_a_tree_of_at_most_fan_in_results():
+    reducer = step('reducer', 'combine {summaries}', 'combined')
+    mapper = MapReduce('sections', step('mapper', 'summarise {item}', 'summary'), Concept('combined'),
+                       reducer=reducer, reduce_input='summaries', fan_in=2, max_concurrency=4)
+    result = mapper.run(registry(sections=[f'section {i}' for i in range(5)]))
+    # 5 results reduce to 3, then 2, then 1
+    assert sum(reducer.model._calls.values()) == 6
+    assert result.get_value().startswith('reducer[')
+
+
+def test_mapper_errors_propagate():
+    mapper = MapReduce('sections', step('mapper', 'summarise {item}', 'summary', error_rate=1.0),
+                       Concept('summaries', type='list'))
+    with pytest.raises(TransientError):
+        mapper.run(registry(sections=['a', 'b']))
+    with pytest.raises(TransientError):
+        asyncio.run(mapper.arun(registry(sections=['a', 'b'])))
+
+
+def test_callbacks_reach_the_mapper():
+    chunks = []
+    pipeline = Chain([summaries(max_concurrency=2)])
+    pipeline.run(registry(sections=['a', 'b']), callback=chunks.append)
+    assert sum(chunk.done for chunk in chunks) == 2
+    assert {chunk.concept for chunk in chunks} == {'summary'}
+
+    async def main():
+        received = []
+
+        async def callback(chunk):
+            received.append(chunk)
+
+        await pipeline.arun(registry(sections=['a', 'b', 'c']), callback=callback)
+        return received
+
+    assert sum(chunk.done for chunk in asyncio.run(main())) == 3
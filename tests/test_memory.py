@@ -0,0 +1,25 @@
+import pytest
+
+from base import RingBufferMemory, SpillingMemory
+
+
+def test_ring_buffer_keeps_the_latest_entries():
+    memory = RingBufferMemory(max_entries=3)
+    memory.extend(range(5))
+    assert list(memory) == [2, 3, 4]
+
+
+def test_spilling_memory_spills_the_oldest_entries(tmp_path):
+    # every entry is the 6 bytes of '"abc"\n'
+    memory = SpillingMemory(str(tmp_path / 'log.jsonl'), max_bytes=12)
+    memory.extend(['abc', 'def'])
+    assert memory.spilled == 0
+    memory.append('ghi')
+    assert memory.spilled == 1
+    assert list(memory.read_spilled()) == ['abc']
+    assert list(memory) == ['def', 'ghi']
+
+
+def test_spilling_memory_rejects_a_negative_limit(tmp_path):
+    with pytest.raises(ValueError):
+        SpillingMemory(str(tmp_path / 'log.jsonl'), max_bytes=-1)
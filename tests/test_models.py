@@ -0,0 +1,88 @@
+import asyncio
+
+from base import Concept, LanguageModel, LRUCache, ProbabilisticComponent, Prompt, UsageMeter, set_meter
+from helpers import registry
+
+
+class Shouting(LanguageModel):
+    # wraps the base behaviour
+    def generate_response(self, prompt_string: str) -> str:
+        return super().generate_response(prompt_string).upper()
+
+
+class Replacing(LanguageModel):
+    # replaces the base behaviour
+    def __init__(self, name: str, **options):
+        super().__init__(name, **options)
+        self._calls = []
+
+    def generate_response(self, prompt_string: str) -> str:
+        self._calls.append(prompt_string)
+        return f'replaced {prompt_string}'
+
+
+def component(model: LanguageModel) -> ProbabilisticComponent:
+    return ProbabilisticComponent(model, Prompt('about {subject}', Concept('answer')))
+
+
+def test_an_override_calling_super_does_not_recurse():
+    model = Shouting('shouting')
+    assert model.generate_response('cats') == 'RESPONSE OF SHOUTING: TO (CATS)'
+    assert component(model).run(registry(subject='cats')).get_value() == 'RESPONSE OF SHOUTING: TO (ABOUT CATS)'
+    assert asyncio.run(component(model).arun(registry(subject='cats'))).get_value() == \
+        'RESPONSE OF SHOUTING: TO (ABOUT CATS)'
+    assert model.generate_batch(['a', 'b']) == ['RESPONSE OF SHOUTING: TO (A)', 'RESPONSE OF SHOUTING: TO (B)']
+    assert ''.join(model.stream_response('cats')) == 'RESPONSE OF SHOUTING: TO (CATS)'
+
+
+def test_a_direct_call_applies_the_layers_once():
+    model = Shouting('shouting', cache=LRUCache())
+    model.generate_response('cats')
+    assert list(model.memory) == [('cats', 'Response of shouting: to (cats)')]
+    assert model.cache.get(model.cache_key('cats')) == 'Response of shouting: to (cats)'
+
+
+def test_components_run_overrides_inside_the_layers():
+    model = Replacing('replacing', cache=LRUCache())
+    meter = UsageMeter()
+    previous = set_meter(meter)
+    try:
+        for _ in range(2):
+            assert component(model).run(registry(subject='cats')).get_value() == 'replaced about cats'
+    finally:
+        set_meter(previous)
+    assert model._calls == ['about cats']
+    assert len(model.memory) == 2
+    assert meter.snapshot()['total']['cache_hits'] == 1
+
+
+def test_async_runs_of_overrides_use_the_cache():
+    model = Replacing('replacing', cache=LRUCache())
+
+    async def main():
+        for _ in range(2):
+            await component(model).arun(registry(subject='cats'))
+        return [chunk async for chunk in model.stream_response_async('about cats')]
+
+    assert asyncio.run(main()) == ['replaced about cats']
+    assert model._calls == ['about cats']
+
+
+def test_outputs_are_copies_of_the_prompt_template():
+    prompt = Prompt('about {subject}', Concept('answer'))
+    first, second = prompt.assign_output_as_string('one'), prompt.assign_output_as_string('two')
+    assert (first.get_value(), second.get_value()) == ('one', 'two')
+    assert prompt.output.string_content is None
+
+
+def test_one_component_serves_concurrent_runs():
+    shared = component(LanguageModel('shared'))
+
+    async def main():
+        return await asyncio.gather(*[shared.arun(registry(subject=subject)) for subject in ('cats', 'dogs')])
+
+    assert [output.get_value() for output in asyncio.run(main())] == \
+        ['Response of shared: to (about cats)', 'Response of shared: to (about dogs)']
+    assert [output.get_value() for output in shared.run_batch([registry(subject='owls'), registry(subject='bats')])] \
+        == ['Response of shared: to (about owls)', 'Response of shared: to (about bats)']
+    assert shared.prompt.output.string_content is None
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+from base import Chain, Concept, GraphExecutor, MapReduce, Prompt, Threads, TransientError, compile_pipeline
+from helpers import registry, step, values
+
+
+def nested(latency: float = 0.0, max_workers: int = 4):
+    # uniform latencies, so concurrent runs finish their branches in a different order than they were listed
+    def model_options(seed):
+        return {'latency': 'uniform', 'mean_latency': latency, 'seed': seed}
+    branches = Threads([step('a', 'a {subject}', 'a', **model_options(1)),
+                        Chain([step('b', 'b {subject}', 'b', **model_options(2)),
+                               step('c', 'c {b}', 'c', **model_options(3))]),
+                        step('d', 'd {subject}', 'd', **model_options(4))], max_workers=max_workers)
+    return Chain([branches, step('e', 'e {a} {c} {d}', 'e', **model_options(5))])
+
+
+def sequential_values():
+    return values(nested(max_workers=None).run(registry(subject='cats')))
+
+
+def test_threads_match_a_sequential_run():
+    assert values(nested(latency=0.005).run(registry(subject='cats'))) == sequential_values()
+
+
+def test_async_threads_match_a_sequential_run():
+    result = asyncio.run(nested(latency=0.005).arun(registry(subject='cats')))
+    assert values(result) == sequential_values()
+
+
+def test_graph_executor_matches_a_sequential_run():
+    executor = GraphExecutor(nested(latency=0.005), max_concurrency=4)
+    assert values(executor.run(registry(subject='cats'))) == sequential_values()
+    assert values(asyncio.run(executor.arun(registry(subject='cats')))) == sequential_values()
+
+
+def test_compiled_plan_matches_a_sequential_run_in_order():
+    expected = nested(max_workers=None).run(registry(subject='cats'))
+    plan = compile_pipeline(nested(latency=0.005))
+    for result in (plan.run(registry(subject='cats')), asyncio.run(plan.arun(registry(subject='cats')))):
+        assert values(result) == values(expected)
+        assert list(result.concepts) == list(expected.concepts)
+
+
+def test_compiled_plan_runs_threads_concurrently():
+    branches = Threads([step(f'm{i}', '{subject}', f'o{i}', mean_latency=0.1) for i in range(4)], max_workers=4)
+    plan = compile_pipeline(branches)
+    assert plan.max_concurrency == 4
+    started = time.perf_counter()
+    plan.run(registry(subject='cats'))
+    assert time.perf_counter() - started < 0.3
+
+
+def test_compiled_plan_keeps_sequential_threads_sequential():
+    branches = Threads([step(f'm{i}', '{subject}', f'o{i}') for i in range(4)])
+    assert compile_pipeline(branches).max_concurrency == 1
+
+
+def test_targeted_run_only_runs_what_the_targets_need(caplog):
+    with caplog.at_level(logging.INFO, logger='base.executable'):
+        result = nested().run(registry(subject='cats'), targets=['c'])
+    assert sorted(result.concepts) == ['b', 'c', 'subject']
+    assert "skipping ['a', 'd', 'e']" in caplog.text
+    assert nested().compile(targets=['c']).skipped == ['a', 'd', 'e']
+
+
+def test_targeted_runs_notice_changes_deep_in_the_tree():
+    pipeline = nested()
+    pipeline.run(registry(subject='cats'), targets=['c'])
+    inner = pipeline.components[0].components[1]
+    inner.components[1] = step('c', 'c {subject}', 'c')
+    assert sorted(pipeline.run(registry(subject='cats'), targets=['c']).concepts) == ['c', 'subject']
+    inner.components[1].prompt = Prompt('c {b}', Concept('c'))
+    assert sorted(pipeline.run(registry(subject='cats'), targets=['c']).concepts) == ['b', 'c', 'subject']
+
+
+def test_targeted_runs_use_the_components_they_were_given():
+    pipeline = nested()
+    pipeline.run(registry(subject='cats'), targets=['a'])
+    for seed in range(5):
+        # the replaced component may be collected and its id reused, the plan must still follow the new one
+        pipeline.components[0].components[0] = step('a', 'a {subject}', 'a', seed=seed)
+        expected = pipeline.components[0].components[0].run(registry(subject='cats')).get_value()
+        assert pipeline.run(registry(subject='cats'), targets=['a']).concepts['a'].get_value() == expected
+
+
+def failing_threads():
+    return Threads([step('slow', '{subject}', 'slow', mean_latency=0.5),
+                    step('broken', '{subject}', 'broken', error_rate=1.0)], max_workers=2)
+
+
+@pytest.mark.parametrize('runner', ['interpreted', 'compiled', 'graph'])
+def test_errors_propagate(runner):
+    pipeline = failing_threads()
+    run = {'interpreted': pipeline.run, 'compiled': compile_pipeline(pipeline).run,
+           'graph': GraphExecutor(pipeline, max_concurrency=2).run}[runner]
+    with pytest.raises(TransientError):
+        run(registry(subject='cats'))
+
+
+@pytest.mark.parametrize('runner', ['interpreted', 'compiled', 'graph'])
+def test_async_errors_cancel_the_other_branches(runner):
+    pipeline = failing_threads()
+    arun = {'interpreted': pipeline.arun, 'compiled': compile_pipeline(pipeline).arun,
+            'graph': GraphExecutor(pipeline, max_concurrency=2).arun}[runner]
+    started = time.perf_counter()
+    with pytest.raises(TransientError):
+        asyncio.run(arun(registry(subject='cats')))
+    assert time.perf_counter() - started < 0.4
+
+
+def test_cancelling_an_async_run_cancels_its_steps():
+    plan = compile_pipeline(Threads([step(f'm{i}', '{subject}', f'o{i}', mean_latency=5.0) for i in range(3)],
+                                    max_workers=3))
+
+    async def main():
+        task = asyncio.ensure_future(plan.arun(registry(subject='cats')))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return [other for other in asyncio.all_tasks() if other is not asyncio.current_task()]
+
+    started = time.perf_counter()
+    assert asyncio.run(main()) == []
+    assert time.perf_counter() - started < 1.0
+
+
+def test_map_reduce_without_reducer_accepts_an_empty_source():
+    mapper = MapReduce('sections', step('m', '{item}', 'summary'), Concept('summaries', type='list'))
+    assert mapper.run(registry(sections=[])).list_content == []
+    assert asyncio.run(mapper.arun(registry(sections=[]))).list_content == []
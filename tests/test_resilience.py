@@ -0,0 +1,90 @@
+import asyncio
+import time
+
+import pytest
+
+from base import (AttemptTimeout, Concept, DeadlineExceeded, HedgePolicy, LanguageModel, ProbabilisticComponent,
+                  Prompt, RetryPolicy, TransientError, deadline)
+from helpers import registry, step
+
+
+class Scripted(LanguageModel):
+    # the n-th call sleeps for latencies[n] and fails while n < failures
+    def __init__(self, name: str, latencies=(), failures: int = 0):
+        super().__init__(name)
+        self._latencies = list(latencies)
+        self._failures = failures
+        self._count = 0
+
+    def _generate(self, prompt_string: str) -> str:
+        call, self._count = self._count, self._count + 1
+        if call < len(self._latencies):
+            time.sleep(self._latencies[call])
+        if call < self._failures:
+            raise TransientError(f'call {call} failed')
+        return f'answer {call}'
+
+    async def _agenerate(self, prompt_string: str) -> str:
+        return self._generate(prompt_string)
+
+
+def component(model: LanguageModel, **options) -> ProbabilisticComponent:
+    return ProbabilisticComponent(model, Prompt('about {subject}', Concept('answer')), **options)
+
+
+def test_transient_errors_are_retried():
+    flaky = component(Scripted('flaky', failures=2), retry=RetryPolicy(max_attempts=3, base_delay=0.001))
+    assert flaky.run(registry(subject='cats')).get_value() == 'answer 2'
+    assert flaky.resilience.stats()['retries'] == 2
+
+    failing = component(Scripted('failing', failures=5), retry=RetryPolicy(max_attempts=2, base_delay=0.001))
+    with pytest.raises(TransientError):
+        asyncio.run(failing.arun(registry(subject='cats')))
+    assert failing.resilience.stats()['attempts'] == 2
+
+
+def test_other_errors_are_not_retried():
+    class Broken(Scripted):
+        def _generate(self, prompt_string: str) -> str:
+            self._count += 1
+            raise ValueError('bad request')
+
+    broken = component(Broken('broken'), retry=RetryPolicy(base_delay=0.001))
+    with pytest.raises(ValueError):
+        broken.run(registry(subject='cats'))
+    assert broken.model._count == 1
+
+
+def test_slow_attempts_time_out():
+    slow = component(Scripted('slow', latencies=[0.2]), timeout=0.02)
+    with pytest.raises(AttemptTimeout):
+        slow.run(registry(subject='cats'))
+    assert slow.resilience.stats()['timeouts'] == 1
+
+    retried = component(Scripted('slow', latencies=[0.2]), timeout=0.02, retry=RetryPolicy(base_delay=0.001))
+    assert retried.run(registry(subject='cats')).get_value() == 'answer 1'
+
+
+def test_a_slow_call_is_hedged():
+    hedged = component(Scripted('hedged', latencies=[0.3]), hedge=HedgePolicy(min_samples=1))
+    hedged.resilience.hedge.record(0.01)
+    assert hedged.run(registry(subject='cats')).get_value() == 'answer 1'
+    assert hedged.resilience.stats()['hedge_wins'] == 1
+
+
+def test_run_deadlines_bound_every_component():
+    with deadline(0):
+        with pytest.raises(DeadlineExceeded):
+            step('summary', 'summarise {text}', 'summary').run(registry(text='a'))
+    with deadline(0.02):
+        with pytest.raises(TimeoutError):
+            step('slow', 'summarise {text}', 'summary', mean_latency=0.2).run(registry(text='a'))
+
+
+def test_policies_reject_invalid_options():
+    with pytest.raises(ValueError):
+        RetryPolicy(max_attempts=0)
+    with pytest.raises(ValueError):
+        HedgePolicy(percentile=100)
+    with pytest.raises(ValueError):
+        component(Scripted('invalid'), timeout=0)
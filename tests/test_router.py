@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from base import Chain, Concept, ConceptRegistry, PipelineCompileError, Router, Threads
+from helpers import step
+
+
+def routes():
+    return {'question': Chain([step('answer', 'answer {text}', 'reply')]),
+            'complaint': Threads([step('apology', 'apologise for {text}', 'reply'),
+                                  step('ticket', 'open a ticket for {text}', 'ticket')], max_workers=2)}
+
+
+def request(kind: str, text: str = 'the delay') -> ConceptRegistry:
+    return ConceptRegistry([Concept('kind', string_content=kind), Concept('text', string_content=text)])
+
+
+def called(route) -> int:
+    return sum(sum(component.model._calls.values()) for component in route.components)
+
+
+def test_only_the_selected_route_runs():
+    router = Router('kind', routes(), 'reply')
+    assert router.input_names() == ['kind', 'text']
+    reply = router.run(request(' complaint\n'))
+    assert reply.name == 'reply'
+    assert reply.get_value().startswith('apology[')
+    # the ticket doesn't lead to the reply and the question route wasn't taken
+    assert (called(router.routes['question']), called(router.routes['complaint'])) == (0, 1)
+    assert list(router.memory) == ['complaint']
+    assert asyncio.run(router.arun(request('question'))).get_value().startswith('answer[')
+
+
+def test_unknown_values_take_the_default_route():
+    assert Router('kind', routes(), 'reply', default='question').run(request('praise')).get_value().startswith(
+        'answer[')
+    with pytest.raises(ValueError):
+        Router('kind', routes(), 'reply').run(request('praise'))
+
+
+def test_routes_are_checked_when_the_router_is_built():
+    with pytest.raises(ValueError):
+        Router('kind', {}, 'reply')
+    with pytest.raises(ValueError):
+        Router('kind', routes(), 'reply', default='praise')
+    with pytest.raises(PipelineCompileError):
+        Router('kind', routes(), 'ticket')
+
+
+def test_a_router_is_a_step_of_a_chain():
+    chain = Chain([step('classifier', 'classify {text}', 'kind', response_size=8),
+                   Router('kind', routes(), 'reply', default='question')])
+    result = chain.run(ConceptRegistry([Concept('text', string_content='the delay')]))
+    assert sorted(result.concepts) == ['kind', 'reply', 'text']
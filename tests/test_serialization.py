@@ -0,0 +1,117 @@
+import asyncio
+import json
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+import base
+from base import (Chain, Concept, MapReduce, PipelineFormatError, ProbabilisticComponent, Prompt, RetryPolicy, Threads,
+                  compile_pipeline, dump_concept, dump_pipeline, load_concept, load_pipeline, pipeline_from_dict,
+                  pipeline_to_dict, save_pipeline)
+from base.simulated import SimulatedModel
+from helpers import registry, step, values
+
+
+def pipeline():
+    shared = SimulatedModel('shared', seed=7, response_size=48)
+    first = step('first', 'first {subject}', 'a')
+    second = step('second', 'second {subject}', 'b')
+    first.model = second.model = shared
+    mapper = MapReduce('topics', step('mapper', 'about {item}', 'summary'), Concept('summaries', type='list'),
+                       max_concurrency=2)
+    last = ProbabilisticComponent(SimulatedModel('last'), Prompt('last {a} {b} {summaries}', Concept('last')),
+                                  timeout=5.0, retry=RetryPolicy())
+    return Chain([Threads([first, second], max_workers=2), mapper, last])
+
+
+def inputs():
+    return registry(subject='cats', topics=['whiskers', 'tails'])
+
+
+def test_dict_round_trip_runs_the_same():
+    original = pipeline()
+    loaded = pipeline_from_dict(pipeline_to_dict(original))
+    assert pipeline_to_dict(loaded) == pipeline_to_dict(original)
+    assert values(loaded.run(inputs())) == values(pipeline().run(inputs()))
+    # components that shared a model still do
+    branches = loaded.components[0].components
+    assert branches[0].model is branches[1].model
+
+
+@pytest.mark.parametrize('suffix', ['json', 'yaml'])
+def test_file_round_trip(tmp_path, suffix):
+    if suffix == 'yaml':
+        pytest.importorskip('yaml')
+    path = str(tmp_path / f'pipeline.{suffix}')
+    save_pipeline(pipeline(), path)
+    loaded = load_pipeline(path)
+    assert pipeline_to_dict(loaded) == pipeline_to_dict(pipeline())
+    assert values(asyncio.run(loaded.arun(inputs()))) == values(pipeline().run(inputs()))
+
+
+def test_cached_load_matches_a_cold_load(tmp_path):
+    path = str(tmp_path / 'pipeline.json')
+    cache_dir = str(tmp_path / 'cache')
+    save_pipeline(pipeline(), path)
+    cold = load_pipeline(path, cache_dir=cache_dir, compiled=True)
+    warm = load_pipeline(path, cache_dir=cache_dir, compiled=True)
+    assert warm is not cold
+    assert values(warm.run(inputs())) == values(cold.run(inputs())) == values(pipeline().run(inputs()))
+    assert warm.max_concurrency == cold.max_concurrency == compile_pipeline(pipeline()).max_concurrency
+
+
+def test_models_passed_in_replace_the_serialized_ones(tmp_path):
+    path = str(tmp_path / 'pipeline.json')
+    save_pipeline(pipeline(), path)
+    local = SimulatedModel('shared', seed=7, response_size=48)
+    loaded = load_pipeline(path, models={'shared': local})
+    assert loaded.components[0].components[0].model is local
+
+
+def test_concepts_keep_their_fields():
+    output = Concept('parts', type='list', choice='index', index=1)
+    component = step('split', 'split {subject}', 'parts')
+    component.prompt.output = output
+    loaded = pipeline_from_dict(pipeline_to_dict(component)).prompt.output
+    assert (loaded.type, loaded.choice, loaded.index, loaded.listify_func) == \
+        (output.type, output.choice, output.index, output.listify_func)
+
+
+def test_the_concept_codec_round_trips_every_field():
+    concept = Concept('parts', type='list', choice='index', index=1, level=3, list_content=['a', 'b'])
+    loaded = load_concept(json.loads(json.dumps(dump_concept(concept))))
+    assert loaded == concept
+
+
+def test_a_listify_func_that_was_not_serialized_comes_from_the_template():
+    template = Concept('parts', type='list', listify_func=lambda text: text.split())
+    data = dump_concept(Concept('parts', type='list', listify_func=template.listify_func, string_content='a b'),
+                        strict=False)
+    assert data['listify_func'] is None
+    assert load_concept(data, template).get_value() == ['a', 'b']
+    with pytest.raises(PipelineFormatError):
+        load_concept(data)
+
+
+def test_a_lambda_listify_func_cannot_be_serialized():
+    component = step('split', 'split {subject}', 'parts')
+    component.prompt.output = Concept('parts', type='list', listify_func=lambda text: text.split())
+    with pytest.raises(PipelineFormatError):
+        dump_pipeline(component)
+
+
+def test_unknown_formats_are_rejected():
+    with pytest.raises(ValueError, match='Unknown format'):
+        dump_pipeline(pipeline(), format='toml')
+
+
+def test_importing_the_package_defers_the_subsystems():
+    script = ('import sys, base; '
+              'print(sorted(name for name in ("base.serialization", "base.checkpoint", "sqlite3", "pickle") '
+              'if name in sys.modules)); '
+              'base.load_pipeline; print("base.serialization" in sys.modules)')
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=str(pathlib.Path(base.__file__).parents[1])).stdout.split('\n')
+    assert output[:2] == ['[]', 'True']
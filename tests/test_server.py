@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+import pytest
+
+from base import Chain
+from base.server import MicroBatcher, PipelineServer
+from helpers import registry, step, values
+
+
+def pipeline():
+    return Chain([step('first', 'first {subject}', 'a'), step('second', 'second {a}', 'b')])
+
+
+async def request(port: int, method: str, path: str, payload=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    body = json.dumps(payload).encode() if payload is not None else b''
+    writer.write(f'{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode()
+                 + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+def serve(server: PipelineServer, *requests):
+    async def main():
+        await server.start()
+        try:
+            return await asyncio.gather(*[request(server.port, *arguments) for arguments in requests])
+        finally:
+            await server.stop()
+
+    return asyncio.run(main())
+
+
+def test_requests_run_the_pipeline():
+    server = PipelineServer({'jokes': pipeline()}, port=0)
+    (status, result), (listed, pipelines) = serve(
+        server, ('POST', '/pipelines/jokes', {'concepts': {'subject': 'cats'}}), ('GET', '/pipelines'))
+    assert status == 200
+    assert result['concepts'] == values(pipeline().run(registry(subject='cats')))
+    assert (listed, pipelines) == (200, {'pipelines': {'jokes': ['subject']}})
+
+
+def test_bad_requests_get_an_error_status():
+    server = PipelineServer({'jokes': pipeline()}, port=0, max_body=64)
+    responses = serve(server, ('POST', '/pipelines/unknown', {'concepts': {}}), ('GET', '/pipelines/jokes'),
+                      ('POST', '/pipelines/jokes', {'concepts': {}}), ('POST', '/pipelines/jokes', ['subject']),
+                      ('POST', '/pipelines/jokes', {'concepts': {'subject': 'x' * 100}}))
+    assert [status for status, _ in responses] == [404, 405, 400, 400, 413]
+    assert all('error' in payload for _, payload in responses)
+
+
+def test_concurrent_requests_share_model_batches():
+    server = PipelineServer({'jokes': pipeline()}, max_batch_size=4, max_wait=0.05)
+
+    async def main():
+        return await asyncio.gather(*[server.run_pipeline('jokes', {'subject': subject})
+                                      for subject in ('cats', 'dogs', 'owls', 'bats')])
+
+    results = asyncio.run(main())
+    assert [result['concepts']['subject'] for result in results] == ['cats', 'dogs', 'owls', 'bats']
+    assert server.batcher.stats() == {'calls': 8, 'batches': 2, 'largest_batch': 4, 'mean_batch_size': 4.0}
+
+
+def test_batch_errors_reach_every_caller():
+    batcher = MicroBatcher(max_batch_size=2)
+    failing = step('failing', 'about {subject}', 'answer', error_rate=1.0)
+
+    async def main():
+        return await asyncio.gather(batcher(failing, 'about cats'), batcher(failing, 'about dogs'),
+                                    return_exceptions=True)
+
+    assert [type(error).__name__ for error in asyncio.run(main())] == ['TransientError', 'TransientError']
+    with pytest.raises(ValueError):
+        MicroBatcher(max_batch_size=0)
@@ -0,0 +1,151 @@
+import asyncio
+import threading
+
+import pytest
+
+from base.singleflight import SingleFlight, fresh_calls
+
+
+def test_threads_share_one_call():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 'result'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do('key', call)))
+    leader.start()
+    started.wait()
+    waiters = [threading.Thread(target=lambda: results.append(flights.do('key', call))) for _ in range(3)]
+    for waiter in waiters:
+        waiter.start()
+    while flights.stats()['saved'] < 3:
+        pass
+    release.set()
+    for thread in [leader] + waiters:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(results) == [('result', False)] + [('result', True)] * 3
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_errors_fan_out_to_every_waiter():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def call():
+        calls.append(1)
+        started.set()
+        release.wait()
+        raise ValueError('boom')
+
+    errors = []
+
+    def caller():
+        try:
+            flights.do('key', call)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=caller)]
+    threads[0].start()
+    started.wait()
+    threads += [threading.Thread(target=caller) for _ in range(3)]
+    for thread in threads[1:]:
+        thread.start()
+    while flights.stats()['saved'] < 3:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert len(errors) == 4
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_async_errors_fan_out_to_every_waiter():
+    flights = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError('boom')
+
+    async def main():
+        return await asyncio.gather(*[flights.ado('key', call) for _ in range(4)], return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_waiters_start_over_when_the_leader_is_cancelled():
+    flights = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'result'
+
+    async def main():
+        leader = asyncio.ensure_future(flights.ado('key', call))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(flights.ado('key', call))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    assert asyncio.run(main()) == ('result', False)
+    assert len(calls) == 2
+
+
+def test_a_cancelled_waiter_leaves_the_call_running():
+    flights = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.05)
+        return 'result'
+
+    async def main():
+        leader = asyncio.ensure_future(flights.ado('key', call))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(flights.ado('key', call))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        return await leader
+
+    assert asyncio.run(main()) == ('result', False)
+
+
+def test_fresh_calls_are_not_coalesced():
+    flights = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def fresh():
+        with fresh_calls():
+            return await flights.ado('key', call)
+
+    async def main():
+        return await asyncio.gather(flights.ado('key', call), fresh())
+
+    assert asyncio.run(main()) == [('result', False), ('result', False)]
+    assert len(calls) == 2
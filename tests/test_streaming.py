@@ -0,0 +1,50 @@
+import asyncio
+
+from base import Chain
+from helpers import registry, step
+
+
+def collect(generator):
+    chunks = []
+    while True:
+        try:
+            chunks.append(next(generator))
+        except StopIteration as stop:
+            return chunks, stop.value
+
+
+def test_stream_yields_chunks_and_returns_the_output():
+    component = step('summary', 'summarise {text}', 'summary', response_size=40, chunk_size=16)
+    received = []
+    chunks, output = collect(component.stream(registry(text='a'), callback=received.append))
+    assert [len(chunk) for chunk in chunks] == [16, 16, 8]
+    assert output.get_value() == ''.join(chunks) == step('summary', 'summarise {text}', 'summary',
+                                                         response_size=40).run(registry(text='a')).get_value()
+    assert [(chunk.concept, chunk.index, chunk.done) for chunk in received] == \
+        [('summary', 0, False), ('summary', 1, False), ('summary', 2, False), ('summary', 3, True)]
+    assert received[-1].text == ''
+
+
+def test_async_stream_accepts_coroutine_callbacks():
+    component = step('summary', 'summarise {text}', 'summary', response_size=40, chunk_size=16)
+
+    async def main():
+        received, outputs = [], []
+
+        async def callback(chunk):
+            received.append(chunk)
+
+        chunks = [chunk async for chunk in component.astream(registry(text='a'), callback, outputs)]
+        return chunks, received, outputs
+
+    chunks, received, outputs = asyncio.run(main())
+    assert ''.join(chunks) == ''.join(chunk.text for chunk in received) == outputs[0].get_value()
+
+
+def test_a_run_with_a_callback_streams_every_step():
+    chain = Chain([step('first', 'first {subject}', 'a', chunk_size=8), step('second', 'second {a}', 'b')])
+    received = []
+    result = chain.run(registry(subject='cats'), callback=received.append)
+    for name in ('a', 'b'):
+        assert ''.join(chunk.text for chunk in received if chunk.concept == name) == result.concepts[name].get_value()
+    assert [chunk.concept for chunk in received if chunk.done] == ['a', 'b']
@@ -0,0 +1,34 @@
+import pytest
+
+from base import Concept, Prompt, TemplateError, compile_template
+
+
+def test_slots_are_filled_in_order():
+    template = compile_template('{subject} and {topic}, again {subject}')
+    assert template.inputs == ('subject', 'topic')
+    assert template.render(['cats', 'food']) == 'cats and food, again cats'
+    assert template.render_mapping({'topic': 'food', 'subject': 'cats'}) == 'cats and food, again cats'
+
+
+def test_rendering_matches_str_format():
+    for text in ('{a}', 'x{a}y', '{{literal}} {a}', '{a!r}: {b:>5}', '{a}{b}', 'no slots {{}}'):
+        assert compile_template(text).render_mapping({'a': 'one', 'b': 'two'}) == \
+            text.format(a='one', b='two'), text
+
+
+def test_malformed_templates_fail_when_compiled():
+    for text in ('{', '{}', '{0}', '{a.b}', '{a[0]}', '{a!x}', '{a:{b}}'):
+        with pytest.raises(TemplateError):
+            compile_template(text)
+    # pydantic wraps the TemplateError raised while building the Prompt
+    with pytest.raises(ValueError, match='Malformed template'):
+        Prompt('summarise {', Concept('summary'))
+
+
+def test_prompt_inputs_come_from_the_template():
+    prompt = Prompt('{subject} and {topic}', Concept('answer'))
+    assert prompt.inputs == ['subject', 'topic']
+    assert prompt.render({'subject': Concept('subject', string_content='cats'),
+                          'topic': Concept('topic', string_content='food')}) == 'cats and food'
+    with pytest.raises(KeyError):
+        prompt.render({'subject': Concept('subject', string_content='cats')})
@@ -0,0 +1,80 @@
+import json
+
+import pytest
+
+from base import (CallbackExporter, Chain, InMemoryStats, JsonLinesExporter, LRUCache, SpanExporter, Tracer,
+                  run_batch, set_tracer, traced)
+from helpers import registry, step
+
+
+@pytest.fixture
+def spans():
+    collected = []
+    previous = set_tracer(Tracer([CallbackExporter(collected.append)]))
+    yield collected
+    set_tracer(previous)
+
+
+def test_tracing_is_off_by_default():
+    with traced('component', 'joke') as span:
+        assert span is None
+
+
+def test_spans_are_nested_under_their_parent(spans):
+    Chain([step('first', 'first {subject}', 'a'), step('second', 'second {a}', 'b')]).run(registry(subject='cats'))
+    chain = [span for span in spans if span.kind == 'orchestrator']
+    components = [span for span in spans if span.kind == 'component']
+    assert [span.name for span in components] == ['a', 'b']
+    assert len(chain) == 1
+    assert all(span.parent_id == chain[0].span_id for span in components)
+    assert all(span.duration is not None and span.error is None for span in spans)
+
+
+def test_errors_are_recorded_on_the_span(spans):
+    with pytest.raises(Exception):
+        step('broken', '{subject}', 'broken', error_rate=1.0).run(registry(subject='cats'))
+    assert 'TransientError' in spans[-1].error
+
+
+def test_stats_count_cache_hits_of_single_and_batched_calls():
+    stats = InMemoryStats()
+    previous = set_tracer(Tracer([stats]))
+    try:
+        component = step('summary', 'summarise {text}', 'summary')
+        component.model.cache = LRUCache()
+        component.run(registry(text='a'))
+        component.run(registry(text='a'))
+        list(run_batch(component, [{'text': text} for text in 'abcd'], chunk_size=4))
+    finally:
+        set_tracer(previous)
+    summary = stats.stats()['component:summary']
+    assert summary['count'] == 3
+    assert summary['calls'] == 6
+    # one single call and one prompt of the batch were answered from the cache
+    assert summary['cache_hits'] == 2
+    assert summary['cache_hit_rate'] == pytest.approx(2 / 6)
+
+
+def test_json_lines_exporter_writes_a_line_per_span(tmp_path):
+    path = str(tmp_path / 'spans.jsonl')
+    exporter = JsonLinesExporter(path)
+    previous = set_tracer(Tracer([exporter]))
+    try:
+        step('summary', 'summarise {text}', 'summary').run(registry(text='a'))
+    finally:
+        set_tracer(previous)
+        exporter.close()
+    with open(path) as file:
+        lines = [json.loads(line) for line in file]
+    assert [(line['kind'], line['name']) for line in lines] == [('component', 'summary')]
+    assert lines[0]['attributes']['model'] == 'summary'
+
+
+def test_a_failing_exporter_does_not_fail_the_run(spans):
+    class Broken(SpanExporter):
+        def export(self, span):
+            raise RuntimeError('exporter is down')
+
+    set_tracer(Tracer([Broken(), CallbackExporter(spans.append)]))
+    assert step('summary', 'summarise {text}', 'summary').run(registry(text='a')).get_value()
+    assert len(spans) == 1